@@ -0,0 +1,92 @@
+#bounded queue + worker threads that group incoming items into micro-batches
+#used by the MQTT loop in inference.py so the network thread never runs the model itself
+
+import queue
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+class MicroBatcher:
+    def __init__(self, handle_batch: Callable[[List[Any]], None], max_batch: int = 64,
+                 max_wait_ms: float = 20.0, max_queue: int = 1024, workers: int = 1,
+                 put_timeout_ms: float = 0.0):
+        self.handle_batch = handle_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait_ms / 1000.0
+        self.put_timeout = put_timeout_ms / 1000.0
+        self.n_workers = max(1, int(workers))
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.counters = {"received": 0, "dropped": 0, "processed": 0, "batches": 0, "errors": 0}
+
+    def _count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def submit(self, item: Any) -> bool:
+        # returns False when the queue is full and the item was dropped
+        self._count("received")
+        try:
+            if self.put_timeout > 0:
+                self._q.put(item, timeout=self.put_timeout)
+            else:
+                self._q.put_nowait(item)
+            return True
+        except queue.Full:
+            self._count("dropped")
+            return False
+
+    def _next_batch(self) -> List[Any]:
+        try:
+            first = self._q.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stop.is_set() and self._q.empty()):
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                self.handle_batch(batch)
+            except Exception as e:
+                self._count("errors")
+                print("Batch error:", e, file=sys.stderr)
+            self._count("batches")
+            self._count("processed", len(batch))
+
+    def start(self) -> "MicroBatcher":
+        self._stop.clear()
+        for i in range(self.n_workers):
+            t = threading.Thread(target=self._run, name=f"batcher-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        # workers drain whatever is still queued before exiting
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self.counters)
+        out["queued"] = self._q.qsize()
+        return out
@@ -0,0 +1,120 @@
+#single versioned artifact bundle shared by preproc.py and inference.py
+#<dir>/manifest.json + one .npy per array, arrays are memory-mapped on first use so loading costs ~ms
+#no pickles: nothing here imports sklearn
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+import numpy as np
+
+BUNDLE_FORMAT = 1
+MANIFEST = "manifest.json"
+PREPROC_ARRAYS = ("gain", "offset", "medians", "keep", "mean", "scale")
+FOREST_ARRAYS = ("feature", "threshold", "left", "right", "value", "roots", "classes")
+
+def is_bundle(path) -> bool:
+    return (Path(path) / MANIFEST).exists()
+
+def write_bundle(path, compiled: Dict[str, Any], forest) -> Dict[str, Any]:
+    path = Path(path)
+    arrays: Dict[str, np.ndarray] = {}
+    for name in PREPROC_ARRAYS:
+        if compiled.get(name) is not None:
+            arrays[f"preproc.{name}"] = np.ascontiguousarray(compiled[name])
+    for name in FOREST_ARRAYS:
+        src = forest.classes_ if name == "classes" else getattr(forest, name)
+        arrays[f"forest.{name}"] = np.ascontiguousarray(src)
+    forest_meta = dict(forest.meta)
+    forest_meta.pop("version", None)
+
+    # the version is a content hash, so identical artifacts always get the same version
+    h = hashlib.sha256()
+    h.update(json.dumps([compiled["feature_columns"], forest_meta], sort_keys=True).encode("utf-8"))
+    for name in sorted(arrays):
+        a = arrays[name]
+        h.update(f"{name}:{a.dtype.str}:{a.shape}".encode("utf-8"))
+        h.update(a.tobytes())
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": h.hexdigest()[:16],
+        "created": int(time.time()),
+        "feature_columns": list(compiled["feature_columns"]),
+        "n_features": int(compiled["n_features"]),
+        "forest_meta": forest_meta,
+        "arrays": {name: f"{name}.npy" for name in arrays},
+    }
+
+    # build next to the target and swap directories, readers holding old mmaps keep their inodes
+    tmp = path.with_name(f"{path.name}.tmp-{os.getpid()}")
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    for name, a in arrays.items():
+        np.save(tmp / f"{name}.npy", a, allow_pickle=False)
+    with open(tmp / MANIFEST, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    old = path.with_name(f"{path.name}.old-{os.getpid()}")
+    if path.exists():
+        path.rename(old)
+    tmp.rename(path)
+    if old.exists():
+        shutil.rmtree(old)
+    return manifest
+
+class Bundle:
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / MANIFEST, "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported bundle format: {self.manifest.get('format')}")
+        self.version: str = self.manifest["version"]
+        self.feature_columns = self.manifest["feature_columns"]
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._compiled: Optional[Dict[str, Any]] = None
+        self._forest = None
+
+    def array(self, name: str) -> Optional[np.ndarray]:
+        fname = self.manifest["arrays"].get(name)
+        if fname is None:
+            return None
+        if name not in self._arrays:
+            self._arrays[name] = np.load(self.path / fname, mmap_mode="r", allow_pickle=False)
+        return self._arrays[name]
+
+    @property
+    def compiled(self) -> Dict[str, Any]:
+        # same shape as preproc.compile_artifacts output
+        if self._compiled is None:
+            from preproc import FEATURE_COLUMNS, KEY_ALIASES
+            index = {c: i for i, c in enumerate(self.feature_columns)}
+            for alias, target in KEY_ALIASES.items():
+                if target in index and alias not in FEATURE_COLUMNS:
+                    index[alias] = index[target]
+            self._compiled = {
+                "feature_columns": list(self.feature_columns),
+                "index": index,
+                "n_features": self.manifest["n_features"],
+                **{name: self.array(f"preproc.{name}") for name in PREPROC_ARRAYS},
+            }
+        return self._compiled
+
+    @property
+    def forest(self):
+        if self._forest is None:
+            from forest import ArrayForest
+            meta = dict(self.manifest["forest_meta"], version=self.version)
+            arrays = {name: self.array(f"forest.{name}") for name in FOREST_ARRAYS}
+            self._forest = ArrayForest(meta=meta, **arrays)
+        return self._forest
+
+    @property
+    def labels(self):
+        return self.manifest["forest_meta"].get("labels")
+
+def load_bundle(path) -> Bundle:
+    return Bundle(path)
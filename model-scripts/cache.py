@@ -0,0 +1,84 @@
+#opt-in LRU + TTL cache in front of prediction, keyed on the quantized feature vector and model version
+#ESP32 retries and repeated scans of one sample land in the same bucket and skip the model entirely
+
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence
+
+from preproc import _map_keys
+
+# bucket width per feature; readings closer than this are treated as the same sample
+DEFAULT_RESOLUTION: Dict[str, float] = {
+    "pH": 0.01,
+    "TDS_ppm": 1.0,
+    "ORP_mV": 1.0,
+    "Temperature_C": 0.1,
+    "Color_R": 1.0,
+    "Color_G": 1.0,
+    "Color_B": 1.0,
+}
+
+def _bucket(v: Any, res: float) -> Optional[int]:
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(f):
+        return None
+    return int(round(f / res))
+
+class PredictionCache:
+    def __init__(self, max_entries: int = 10000, ttl_s: float = 300.0,
+                 resolution: Optional[Dict[str, float]] = None, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_s)
+        self.resolution = dict(DEFAULT_RESOLUTION, **(resolution or {}))
+        self.clock = clock
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    def key(self, raw: Dict, feature_columns: Sequence[str], version: Any) -> Hashable:
+        mapped = _map_keys(raw)
+        return (version,) + tuple(_bucket(mapped.get(c), self.resolution.get(c, 1e-6)) for c in feature_columns)
+
+    def get(self, key: Hashable) -> Optional[Dict]:
+        now = self.clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            expires, value = entry
+            if expires < now:
+                del self._data[key]
+                self.counters["expired"] += 1
+                self.counters["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.counters["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Dict):
+        with self._lock:
+            self._data[key] = (self.clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+            self.counters["invalidations"] += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self.counters)
+            out["entries"] = len(self._data)
+        return out
@@ -0,0 +1,123 @@
+#per-device probe calibration: (gain, offset) per sensor column for each device_id, global row as fallback
+#table file (JSON):
+#  {"default": {"pH": [1.0, 0.0]},
+#   "devices": {"esp32_001": {"pH": [1.0, -0.12], "ORP_mV": [1.0, 4.5], "Color_R": [1.04, 0.0]}}}
+#columns missing from a device entry take the default row, the default row falls back to preproc.CALIBRATION
+
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence
+import numpy as np
+
+class CalibrationTable:
+    def __init__(self, columns: Sequence[str], gains: np.ndarray, offsets: np.ndarray,
+                 device_rows: Optional[Dict[str, int]] = None):
+        # row 0 is the global fallback, device_rows maps an interned device_id to its row
+        self.columns = list(columns)
+        self.gains = np.ascontiguousarray(gains, dtype=float)
+        self.offsets = np.ascontiguousarray(offsets, dtype=float)
+        self.device_rows = device_rows or {}
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any], columns: Sequence[str], default_gain: Sequence[float],
+                  default_offset: Sequence[float]) -> "CalibrationTable":
+        col_idx = {c: i for i, c in enumerate(columns)}
+        devices = spec.get("devices") or {}
+        gains = np.tile(np.asarray(default_gain, dtype=float), (len(devices) + 1, 1))
+        offsets = np.tile(np.asarray(default_offset, dtype=float), (len(devices) + 1, 1))
+
+        def fill(row: int, entry: Dict[str, Any], where: str):
+            for col, pair in entry.items():
+                i = col_idx.get(col)
+                if i is None:
+                    continue
+                if not isinstance(pair, (list, tuple)) or len(pair) != 2:
+                    raise ValueError(f"{where}.{col}: expected [gain, offset], got {pair!r}")
+                gains[row, i], offsets[row, i] = float(pair[0]), float(pair[1])
+
+        fill(0, spec.get("default") or {}, "default")
+        gains[1:] = gains[0]
+        offsets[1:] = offsets[0]
+        rows = {}
+        for row, (dev, entry) in enumerate(sorted(devices.items()), start=1):
+            fill(row, entry, f"devices.{dev}")
+            rows[sys.intern(str(dev))] = row
+        return cls(columns, gains, offsets, rows)
+
+    @classmethod
+    def from_file(cls, path, columns: Sequence[str], default_gain: Sequence[float],
+                  default_offset: Sequence[float]) -> "CalibrationTable":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f), columns, default_gain, default_offset)
+
+    def rows(self, device_ids: Sequence[Any]) -> np.ndarray:
+        get = self.device_rows.get
+        return np.fromiter((get(str(d), 0) if d is not None else 0 for d in device_ids),
+                           dtype=np.intp, count=len(device_ids))
+
+    def apply(self, X: np.ndarray, device_ids: Optional[Sequence[Any]] = None) -> np.ndarray:
+        # one gather + multiply-add for the whole batch
+        if device_ids is None or not self.device_rows:
+            return X * self.gains[0] + self.offsets[0]
+        idx = self.rows(device_ids)
+        return X * self.gains[idx] + self.offsets[idx]
+
+    def __len__(self) -> int:
+        return len(self.device_rows)
+
+class CalibrationStore:
+    # holds the current table and swaps in a new one when the file changes; readers never block
+    def __init__(self, path, columns: Sequence[str], default_gain: Sequence[float], default_offset: Sequence[float],
+                 check_interval_s: float = 2.0, on_reload: Optional[Callable[[CalibrationTable], None]] = None):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.default_gain = np.asarray(default_gain, dtype=float)
+        self.default_offset = np.asarray(default_offset, dtype=float)
+        self.check_interval = float(check_interval_s)
+        self.on_reload = on_reload
+        self.reloads = 0
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._next_check = 0.0
+        self.table = CalibrationTable.from_dict({}, self.columns, self.default_gain, self.default_offset)
+        self.reload()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def reload(self) -> bool:
+        stamp = self._stat()
+        if stamp is None or stamp == self._mtime:
+            return False
+        try:
+            table = CalibrationTable.from_file(self.path, self.columns, self.default_gain, self.default_offset)
+        except (OSError, ValueError) as e:
+            # a half-written or broken file keeps the previous table in service
+            print(f"Calibration reload failed, keeping previous table: {e}", file=sys.stderr)
+            self._mtime = stamp
+            return False
+        self.table = table
+        self._mtime = stamp
+        self.reloads += 1
+        if self.on_reload is not None:
+            self.on_reload(table)
+        return True
+
+    def current(self) -> CalibrationTable:
+        # the stat() is rate limited, so the hot path is one clock read most of the time
+        now = time.monotonic()
+        if now >= self._next_check and self._lock.acquire(blocking=False):
+            try:
+                self._next_check = now + self.check_interval
+                self.reload()
+            finally:
+                self._lock.release()
+        return self.table
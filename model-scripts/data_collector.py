@@ -4,26 +4,45 @@
 from __future__ import annotations
 import argparse
 import csv
+import datetime
+import io
 import json
 import os
+import queue
+import random
+import shutil
 import sys
+import threading
 import time
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import quote
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 
 import boto3
 import botocore
 import pandas as pd
 
 try:
-    from preproc import load_artifacts, transform_raw
+    import pyarrow as pa
+    import pyarrow.parquet as pq
 except Exception:
+    pa = None
+    pq = None
+
+try:
+    from preproc import FEATURE_COLUMNS, load_artifacts, transform_raw
+except Exception:
+    FEATURE_COLUMNS = ["pH", "TDS_ppm", "ORP_mV", "Temperature_C", "Color_R", "Color_G", "Color_B"]
     load_artifacts = None
     transform_raw = None
 
 import pickle
 
+from dedupe import open_index
+from s3upload import COMPRESSION_SUFFIX, DEFAULT_PART_SIZE, MIN_PART_SIZE, S3Uploader, TeeWriter, compressed_writer, zstandard
+
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser()
     p.add_argument("--table", required=True)
@@ -38,7 +57,30 @@ def parse_args() -> argparse.Namespace:
     p.add_argument("--raw-csv", default="raw_scans.csv", help="filename for raw flattened CSV")
     p.add_argument("--s3-bucket", help="optional S3 bucket to upload outputs")
     p.add_argument("--s3-prefix", default="", help="optional S3 prefix (folder) for uploads")
+    p.add_argument("--s3-endpoint-url", help="S3 endpoint override, e.g. a local minio/moto server for testing")
+    p.add_argument("--s3-part-size-mb", type=float, default=DEFAULT_PART_SIZE / 2**20,
+                   help="multipart part size (S3 needs at least 5 MiB for all but the last part)")
+    p.add_argument("--s3-concurrency", type=int, default=4, help="parts uploaded in parallel")
+    p.add_argument("--compress", choices=["none", "gzip", "zstd"], default="none",
+                   help="compress CSV outputs while writing (parquet files are always zstd internally)")
     p.add_argument("--region", default=None, help="AWS region (overrides env)")
+    p.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                   help="parquet writes date/device partitioned datasets named after the CSV stems")
+    p.add_argument("--flush-rows", type=int, default=1000, help="rows buffered before each CSV write")
+    p.add_argument("--incremental", action="store_true",
+                   help="resume from the checkpoint and only export records newer than each device's watermark")
+    p.add_argument("--checkpoint", help="checkpoint file (default: <out>/export_checkpoint.json)")
+    p.add_argument("--checkpoint-pages", type=int, default=50, help="scan pages per output partition/checkpoint")
+    p.add_argument("--dedupe", choices=["exact", "bloom"], default="exact",
+                   help="bloom trades a small false-positive rate (dropped new records) for fixed memory")
+    p.add_argument("--dedupe-capacity", type=int, default=10_000_000, help="expected keys, bloom mode only")
+    p.add_argument("--dedupe-fp-rate", type=float, default=0.001, help="bloom mode only")
+    p.add_argument("--dedupe-index",
+                   help="persist the dedupe index here (default in incremental mode: <out>/dedupe_index.npz)")
+    p.add_argument("--segments", type=int, default=1, help="parallel scan segments (TotalSegments)")
+    p.add_argument("--workers", type=int, default=0, help="scan threads (0 = one per segment)")
+    p.add_argument("--raw-json", action="store_true",
+                   help="also store each item re-serialized in the raw_json column (costs about as much as decoding)")
     return p.parse_args()
 
 def to_timestamp_bounds(start: Optional[str], end: Optional[str]) -> Tuple[Optional[int], Optional[int]]:
@@ -54,45 +96,139 @@ def to_timestamp_bounds(start: Optional[str], end: Optional[str]) -> Tuple[Optio
         ts_end = int(dt.replace(tzinfo=datetime.timezone.utc).timestamp())
     return ts_start, ts_end
 
-def dynamo_scan(table_name: str, region: Optional[str], start_ts: Optional[int], end_ts: Optional[int],
-                limit: int = 0) -> Iterable[Dict[str, Any]]:
+def _make_ddb_client(region: Optional[str]):
     sess = boto3.session.Session()
     if region:
-        ddb = sess.client("dynamodb", region_name=region)
-    else:
-        ddb = sess.client("dynamodb")
-    paginator = ddb.get_paginator("scan")
+        return sess.client("dynamodb", region_name=region)
+    return sess.client("dynamodb")
+
+def _scan_kwargs(table_name: str, start_ts: Optional[int], end_ts: Optional[int]) -> Dict[str, Any]:
     filter_expression = None
     expression_attr = {}
     if start_ts is not None and end_ts is not None:
-        filter_expression = "timestamp BETWEEN :s AND :e"
+        filter_expression = "#ts BETWEEN :s AND :e"
         expression_attr[":s"] = {"N": str(start_ts)}
         expression_attr[":e"] = {"N": str(end_ts)}
     elif start_ts is not None:
-        filter_expression = "timestamp >= :s"
+        filter_expression = "#ts >= :s"
         expression_attr[":s"] = {"N": str(start_ts)}
     elif end_ts is not None:
-        filter_expression = "timestamp <= :e"
+        filter_expression = "#ts <= :e"
         expression_attr[":e"] = {"N": str(end_ts)}
 
     scan_kwargs = {"TableName": table_name}
     if filter_expression:
+        # "timestamp" is a DynamoDB reserved word, so it has to go through an attribute name placeholder
         scan_kwargs.update({"FilterExpression": filter_expression,
+                            "ExpressionAttributeNames": {"#ts": "timestamp"},
                             "ExpressionAttributeValues": expression_attr})
+    return scan_kwargs
+
+_SEGMENT_DONE = object()
+
+def decode_page(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # convert DynamoDB JSON to plain python types
+    return [_dynamo_item_to_plain(it) for it in items]
+
+PageDecoder = Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]
+
+def _segment_pages(ddb, scan_kwargs: Dict[str, Any], segment: int, total: int,
+                   start_key: Optional[Dict[str, Any]] = None,
+                   decode: PageDecoder = decode_page) -> Iterable[Tuple[int, List[Dict[str, Any]], Any]]:
+    # yields (segment, decoded items, LastEvaluatedKey); a None key means the segment is finished
+    kwargs = dict(scan_kwargs)
+    if total > 1:
+        kwargs.update(Segment=segment, TotalSegments=total)
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    paginator = ddb.get_paginator("scan")
+    for page in paginator.paginate(**kwargs):
+        yield segment, decode(page.get("Items", [])), page.get("LastEvaluatedKey")
+
+def _put_unless_stopped(out: "queue.Queue", obj: Any, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            out.put(obj, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+def _scan_segment(ddb, scan_kwargs: Dict[str, Any], segment: int, total: int, start_key: Optional[Dict[str, Any]],
+                  out: "queue.Queue", stop: threading.Event, decode: PageDecoder = decode_page):
+    # pushes whole pages so the consumer sees each segment in page order
+    try:
+        for page in _segment_pages(ddb, scan_kwargs, segment, total, start_key, decode):
+            if stop.is_set():
+                break
+            _put_unless_stopped(out, page, stop)
+    except Exception as e:
+        _put_unless_stopped(out, e, stop)
+    finally:
+        _put_unless_stopped(out, _SEGMENT_DONE, stop)
+
+def _parallel_scan(ddb, scan_kwargs: Dict[str, Any], segments: List[int], total: int, workers: int,
+                   start_keys: Dict[int, Any],
+                   decode: PageDecoder = decode_page) -> Iterable[Tuple[int, List[Dict[str, Any]], Any]]:
+    out: "queue.Queue" = queue.Queue(maxsize=max(2, workers * 2))
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for seg in segments:
+            pool.submit(_scan_segment, ddb, scan_kwargs, seg, total, start_keys.get(seg), out, stop, decode)
+        remaining = len(segments)
+        while remaining:
+            got = out.get()
+            if got is _SEGMENT_DONE:
+                remaining -= 1
+            elif isinstance(got, Exception):
+                raise got
+            else:
+                yield got
+    finally:
+        # also reached when the caller stops early (limit), let producers exit
+        stop.set()
+        while True:
+            try:
+                out.get_nowait()
+            except queue.Empty:
+                break
+        pool.shutdown(wait=False)
+
+def dynamo_scan_pages(table_name: str, region: Optional[str], start_ts: Optional[int], end_ts: Optional[int],
+                      segments: int = 1, workers: int = 0, client=None,
+                      start_keys: Optional[Dict[int, Any]] = None, skip_segments: Iterable[int] = (),
+                      decode: PageDecoder = decode_page) -> Iterable[Tuple[int, List[Dict[str, Any]], Any]]:
+    ddb = client if client is not None else _make_ddb_client(region)
+    scan_kwargs = _scan_kwargs(table_name, start_ts, end_ts)
+    start_keys = start_keys or {}
+    total = max(1, segments)
+    todo = [seg for seg in range(total) if seg not in set(skip_segments)]
+
+    if len(todo) > 1:
+        pages = _parallel_scan(ddb, scan_kwargs, todo, total, workers or len(todo), start_keys, decode)
+    else:
+        pages = (p for seg in todo for p in _segment_pages(ddb, scan_kwargs, seg, total, start_keys.get(seg), decode))
+
+    try:
+        yield from pages
+    except botocore.exceptions.ClientError as e:
+        raise RuntimeError(f"DynamoDB scan failed: {e}")
+    finally:
+        pages.close()
 
+def dynamo_scan(table_name: str, region: Optional[str], start_ts: Optional[int], end_ts: Optional[int],
+                limit: int = 0, segments: int = 1, workers: int = 0, client=None) -> Iterable[Dict[str, Any]]:
+    pages = dynamo_scan_pages(table_name, region, start_ts, end_ts, segments=segments, workers=workers, client=client)
     fetched = 0
     try:
-        for page in paginator.paginate(**scan_kwargs):
-            items = page.get("Items", [])
-            for it in items:
-                # convert DynamoDB JSON to plain python types
-                plain = _dynamo_item_to_plain(it)
+        for _, items, _ in pages:
+            for plain in items:
                 yield plain
                 fetched += 1
                 if limit and fetched >= limit:
                     return
-    except botocore.exceptions.ClientError as e:
-        raise RuntimeError(f"DynamoDB scan failed: {e}")
+    finally:
+        pages.close()
 
 def _dynamo_item_to_plain(item: Dict[str, Any]) -> Dict[str, Any]:
     out = {}
@@ -135,7 +271,7 @@ def _dynamo_value_to_plain(v: Dict[str, Any]) -> Any:
         return [_dynamo_value_to_plain(x) for x in v["L"]]
     return None
 
-def flatten_record(rec: Dict[str, Any]) -> Dict[str, Any]:
+def flatten_record(rec: Dict[str, Any], raw_json: bool = True) -> Dict[str, Any]:
     out = {}
     out["device_id"] = rec.get("device_id")
     out["timestamp"] = rec.get("timestamp")
@@ -152,118 +288,526 @@ def flatten_record(rec: Dict[str, Any]) -> Dict[str, Any]:
     out["adulteration_alert"] = rec.get("adulteration_alert")
     out["model_version"] = rec.get("model_version")
     out["source"] = rec.get("source")
-    out["raw_json"] = json.dumps(rec)
+    out["ts_us"] = rec.get("ts_us")
+    if raw_json:
+        out["raw_json"] = json.dumps(rec)
+    return out
+
+# top-level attributes copied as-is by flatten_record; anything else only ever ended up in raw_json
+_FLAT_FIELDS = ("device_id", "timestamp", "prediction", "confidence", "adulteration_alert", "model_version", "source",
+                "ts_us")
+
+class _SlowPath(Exception):
+    pass
+
+def _fast_scalar(v: Optional[Dict[str, Any]]) -> Any:
+    if v is None:
+        return None
+    if "S" in v:
+        return v["S"]
+    if "N" in v:
+        n = v["N"]
+        return float(n) if "." in n else int(n)
+    if "BOOL" in v:
+        return bool(v["BOOL"])
+    if "NULL" in v:
+        return None
+    raise _SlowPath
+
+def _flatten_item_fast(item: Dict[str, Any]) -> Dict[str, Any]:
+    # straight from DynamoDB JSON to the flat row, no intermediate plain record
+    out = {}
+    sensors = item.get("sensor_readings")
+    if sensors is not None:
+        if "M" in sensors:
+            for k, v in sensors["M"].items():
+                n = v.get("N")
+                if n is not None:
+                    out[k] = float(n) if "." in n else int(n)
+                else:
+                    out[k] = _dynamo_value_to_plain(v)
+        elif "S" in sensors:
+            try:
+                decoded = json.loads(sensors["S"]) if sensors["S"] else {}
+            except Exception:
+                decoded = {}
+            if not isinstance(decoded, dict):
+                raise _SlowPath
+            out.update(decoded)
+        elif "NULL" not in sensors:
+            raise _SlowPath
+    for k in _FLAT_FIELDS:
+        out[k] = _fast_scalar(item.get(k))
     return out
 
+def flatten_page(items: List[Dict[str, Any]], raw_json: bool = False) -> List[Dict[str, Any]]:
+    # page-at-a-time equivalent of flatten_record(_dynamo_item_to_plain(item)) for our item schema;
+    # items with unexpected attribute types take the generic path
+    rows = []
+    for item in items:
+        try:
+            row = _flatten_item_fast(item)
+        except _SlowPath:
+            row = flatten_record(_dynamo_item_to_plain(item), raw_json=False)
+        if raw_json:
+            row["raw_json"] = json.dumps(_dynamo_item_to_plain(item))
+        rows.append(row)
+    return rows
+
+# fixed CSV schema so rows can be written as they arrive; anything else lands in SPILL_COLUMN as JSON
+EXPORT_COLUMNS: List[str] = ["device_id", "timestamp", *FEATURE_COLUMNS, "prediction", "prediction_label",
+                             "confidence", "adulteration_alert", "model_version", "source", "ts_us", "raw_json"]
+SPILL_COLUMN = "extra_json"
+
+class StreamingCsvWriter:
+    # compression is applied while writing (the file gets a .gz/.zst suffix); with `upload` (path -> byte
+    # sink, e.g. S3Uploader.open) the same compressed bytes are streamed out as they are produced
+    def __init__(self, path: Path, columns: List[str] = EXPORT_COLUMNS, chunk_rows: int = 1000,
+                 compression: Optional[str] = None, upload: Optional[Callable[[Path], Any]] = None):
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstandard is required for --compress zstd")
+        self.path = Path(path)
+        self.path = self.path.with_name(self.path.name + COMPRESSION_SUFFIX[compression])
+        self.columns = list(columns)
+        self.known = set(self.columns)
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.upload = upload
+        self.rows = 0
+        self._buf: List[List[Any]] = []
+        self._tmp = self.path.with_name(self.path.name + ".tmp")
+        self._raw = None
+        self._sink = None
+        self._f = None
+        self._w = None
+
+    def _open(self):
+        self._raw = open(self._tmp, "wb")
+        out = self._raw
+        if self.upload is not None:
+            self._sink = self.upload(self.path)
+            out = TeeWriter(self._raw, self._sink)
+        self._f = io.TextIOWrapper(compressed_writer(out, self.compression), encoding="utf-8", newline="")
+        self._w = csv.writer(self._f)
+        self._w.writerow(self.columns + [SPILL_COLUMN])
+
+    def write(self, row: Dict[str, Any]):
+        extra = {k: v for k, v in row.items() if k not in self.known}
+        self._buf.append([row.get(c) for c in self.columns] + [json.dumps(extra, default=str) if extra else ""])
+        self.rows += 1
+        if len(self._buf) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buf:
+            return
+        if self._f is None:
+            self._open()
+        self._w.writerows(self._buf)
+        self._buf = []
+
+    def close(self) -> List[Path]:
+        # like before, nothing is written when there were no rows; the final file appears atomically
+        self.flush()
+        if self._f is None:
+            return []
+        self._f.close()
+        self._raw.close()
+        self._f = None
+        if self._sink is not None:
+            # completes the upload; the object shows up in S3 only now, like the local rename below
+            self._sink.close()
+            self._sink = None
+        self._tmp.replace(self.path)
+        return [self.path]
+
+    def abort(self):
+        # drops the partial file and any upload in progress
+        if self._f is not None:
+            try:
+                self._f.close()
+            except Exception:
+                pass
+            self._raw.close()
+            self._f = None
+            self._tmp.unlink(missing_ok=True)
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+        self._buf = []
+
+def _parquet_schema():
+    fields = [("device_id", pa.string()), ("timestamp", pa.int64())]
+    fields += [(c, pa.float32()) for c in FEATURE_COLUMNS]
+    fields += [("prediction", pa.string()), ("prediction_label", pa.string()), ("confidence", pa.float32()),
+               ("adulteration_alert", pa.string()), ("model_version", pa.string()), ("source", pa.string()),
+               ("ts_us", pa.int64()), ("raw_json", pa.string()), (SPILL_COLUMN, pa.string())]
+    return pa.schema(fields)
+
+def _as_float(v) -> Optional[float]:
+    try:
+        return float(v) if v is not None and v != "" else None
+    except (TypeError, ValueError):
+        return None
+
+def _as_str(v) -> Optional[str]:
+    return None if v is None else str(v)
+
+class PartitionedParquetWriter:
+    # hive-style dataset: <root>/date=YYYY-MM-DD/device_id=<id>/part-<name>-<n>.parquet
+    # files are written as dot-prefixed temps (ignored by readers) and renamed on close
+    # replace=True builds the whole dataset in a staging dir and swaps it in on close, so a re-run
+    # replaces the previous export instead of adding a second copy of every row
+    def __init__(self, root: Path, name: str, chunk_rows: int = 50000, replace: bool = False):
+        if pa is None:
+            raise RuntimeError("pyarrow is required for --format parquet")
+        self.final_root = Path(root)
+        self.replace = replace
+        self.root = self.final_root.with_name(f".{self.final_root.name}.staging-{name}") if replace else self.final_root
+        self.name = name
+        self.chunk_rows = chunk_rows
+        self.schema = _parquet_schema()
+        self.known = set(self.schema.names)
+        self.rows = 0
+        self._buf: List[Dict[str, Any]] = []
+        self._pending: List[Tuple[Path, Path]] = []
+
+    def write(self, row: Dict[str, Any]):
+        self._buf.append(row)
+        self.rows += 1
+        if len(self._buf) >= self.chunk_rows:
+            self.flush()
+
+    def _table(self, rows: List[Dict[str, Any]]):
+        cols = {}
+        for field in self.schema:
+            if field.name == SPILL_COLUMN:
+                vals = []
+                for r in rows:
+                    extra = {k: v for k, v in r.items() if k not in self.known}
+                    vals.append(json.dumps(extra, default=str) if extra else None)
+            elif pa.types.is_integer(field.type):
+                vals = [int(r[field.name]) if r.get(field.name) is not None else None for r in rows]
+            elif pa.types.is_floating(field.type):
+                vals = [_as_float(r.get(field.name)) for r in rows]
+            else:
+                vals = [_as_str(r.get(field.name)) for r in rows]
+            cols[field.name] = pa.array(vals, type=field.type)
+        return pa.Table.from_pydict(cols, schema=self.schema)
+
+    def flush(self):
+        if not self._buf:
+            return
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for r in self._buf:
+            ts = r.get("timestamp")
+            day = "unknown"
+            if ts is not None:
+                day = datetime.datetime.fromtimestamp(int(ts), datetime.timezone.utc).strftime("%Y-%m-%d")
+            groups.setdefault((day, str(r.get("device_id"))), []).append(r)
+        for (day, dev), rows in groups.items():
+            part_dir = self.root / f"date={day}" / f"device_id={quote(dev, safe='')}"
+            part_dir.mkdir(parents=True, exist_ok=True)
+            final = part_dir / f"part-{self.name}-{len(self._pending):05d}.parquet"
+            tmp = part_dir / f".{final.name}.tmp"
+            # device_id lives in the directory name, like any hive partition column
+            pq.write_table(self._table(rows).drop_columns(["device_id"]), tmp, compression="zstd")
+            self._pending.append((tmp, final))
+        self._buf = []
+
+    def abort(self):
+        self._buf = []
+        for tmp, _ in self._pending:
+            tmp.unlink(missing_ok=True)
+        self._pending = []
+        if self.replace:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def close(self) -> List[Path]:
+        self.flush()
+        done = []
+        for tmp, final in self._pending:
+            tmp.replace(final)
+            done.append(final)
+        self._pending = []
+        if not self.replace:
+            return done
+        if not done:
+            # like the CSV writer, an export without rows leaves the previous output alone
+            shutil.rmtree(self.root, ignore_errors=True)
+            return []
+        old = self.final_root.with_name(f".{self.final_root.name}.old-{self.name}")
+        if self.final_root.exists():
+            self.final_root.rename(old)
+        self.root.rename(self.final_root)
+        shutil.rmtree(old, ignore_errors=True)
+        return [self.final_root / p.relative_to(self.root) for p in done]
+
 def load_label_encoder(path: Optional[str]):
     if not path:
         return None
     with open(path, "rb") as f:
         return pickle.load(f)
 
-def upload_to_s3(local_path: str, bucket: str, key: str, region: Optional[str]):
-    s3 = boto3.client("s3", region_name=region) if region else boto3.client("s3")
-    s3.upload_file(local_path, bucket, key)
+def upload_to_s3(local_path: str, bucket: str, key: str, region: Optional[str], endpoint_url: Optional[str] = None,
+                 part_size: int = DEFAULT_PART_SIZE, concurrency: int = 4):
+    uploader = S3Uploader(bucket, region=region, endpoint_url=endpoint_url, part_size=part_size, concurrency=concurrency)
+    try:
+        uploader.upload_file(local_path, key)
+    finally:
+        uploader.close()
+
+CHECKPOINT_VERSION = 1
+
+def load_checkpoint(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {"version": CHECKPOINT_VERSION, "watermarks": {}, "pass": None}
+    with open(path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise RuntimeError(f"Unsupported checkpoint version in {path}: {state.get('version')}")
+    return state
+
+def save_checkpoint(path: Path, state: Dict[str, Any]):
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp.replace(path)
+
+def _partition_path(out_dir: Path, name: str, run_id: str, seq: int) -> Path:
+    p = Path(name)
+    return out_dir / f"{p.stem}-{run_id}-{seq:04d}{p.suffix}"
+
+def _load_preproc(args):
+    if not args.preproc_artifacts:
+        return None
+    if load_artifacts is None:
+        print("preproc.load_artifacts not available; cannot apply preproc transform.", file=sys.stderr)
+        return None
+    return load_artifacts(args.preproc_artifacts)
+
+def _make_uploader(args) -> Optional[S3Uploader]:
+    if not args.s3_bucket:
+        return None
+    part_size = int(args.s3_part_size_mb * 2**20)
+    if part_size < MIN_PART_SIZE:
+        print(f"--s3-part-size-mb below the S3 minimum, using {MIN_PART_SIZE // 2**20} MiB", file=sys.stderr)
+        part_size = MIN_PART_SIZE
+    return S3Uploader(args.s3_bucket, args.s3_prefix, args.region, args.s3_endpoint_url,
+                      part_size=part_size, concurrency=args.s3_concurrency)
+
+def _start_pass(args, checkpoint_path: Path, start_ts: Optional[int], end_ts: Optional[int]):
+    # returns the checkpoint state plus the scan settings (start, end, segments, cursors, done segments) to run
+    state = load_checkpoint(checkpoint_path)
+    scan = {"table": args.table, "start": start_ts, "end": end_ts, "segments": args.segments}
+    if state["pass"] is None:
+        state["pass"] = {"scan": scan, "cursors": {}, "done": [], "pending": {}}
+        return state, start_ts, end_ts, args.segments, {}, []
+    # an interrupted pass is resumed with its own scan settings, otherwise segments would not line up
+    p = state["pass"]
+    if p["scan"] != scan:
+        print(f"Resuming interrupted pass with its original settings: {p['scan']}", file=sys.stderr)
+    start_keys = {int(k): v for k, v in p["cursors"].items()}
+    return state, p["scan"]["start"], p["scan"]["end"], p["scan"]["segments"], start_keys, list(p["done"])
+
+def _prediction_label(flat: Dict[str, Any], label_enc) -> Any:
+    pred = flat.get("prediction")
+    if not label_enc or pred is None:
+        return pred
+    try:
+        if isinstance(pred, (int, float)):
+            return label_enc.inverse_transform([int(pred)])[0]
+        return str(pred)
+    except Exception:
+        return str(pred)
+
+def _train_row(flat: Dict[str, Any], preproc_artifacts) -> Optional[Dict[str, Any]]:
+    try:
+        # sensor keys sit at the top level of the flat row, the other columns are not features
+        features = transform_raw(flat, preproc_artifacts)
+        feat_list = list(map(float, features.reshape(-1).tolist()))
+        train = dict(flat)
+        for i, col in enumerate(preproc_artifacts["feature_columns"]):
+            train[col] = feat_list[i]
+        return train
+    except Exception:
+        return None
+
+class _Export:
+    # writers, checkpoint and uploads of one collector run; main() only drives the scan
+    def __init__(self, args, out_dir: Path, state: Dict[str, Any], checkpoint_path: Path, seen, dedupe_path):
+        self.args = args
+        self.out_dir = out_dir
+        self.state = state
+        self.checkpoint_path = checkpoint_path
+        self.seen = seen
+        self.dedupe_path = dedupe_path
+        # records at or below the committed watermark were exported by an earlier, completed pass
+        self.watermarks: Dict[str, Any] = state.get("watermarks", {})
+        # highest timestamp per device seen in this pass, promoted to watermarks once the pass completes
+        self.pending: Dict[str, Any] = state["pass"]["pending"] if state else {}
+        self.label_enc = load_label_encoder(args.label_encoder)
+        self.preproc_artifacts = _load_preproc(args)
+        self.uploader = _make_uploader(args)
+        self.run_id = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+        self.seq = 0
+        self.count = self.raw_rows = self.train_rows = 0
+        self.pages_since_checkpoint = 0
+        self.written: List[Path] = []
+        self.raw_writer, self.train_writer = self._open_writers()
+
+    def _s3_key(self, path: Path) -> str:
+        return self.uploader.key_for(path.relative_to(self.out_dir).as_posix())
+
+    def _open_writers(self):
+        args, out_dir = self.args, self.out_dir
+        if args.format == "parquet":
+            name = f"{self.run_id}-{self.seq:04d}"
+            # incremental passes add partitions, a plain export replaces the dataset
+            replace = not args.incremental
+            return (PartitionedParquetWriter(out_dir / Path(args.raw_csv).stem, name, replace=replace),
+                    PartitionedParquetWriter(out_dir / Path(args.train_csv).stem, name, replace=replace))
+        if args.incremental:
+            raw_p = _partition_path(out_dir, args.raw_csv, self.run_id, self.seq)
+            train_p = _partition_path(out_dir, args.train_csv, self.run_id, self.seq)
+        else:
+            raw_p, train_p = out_dir / args.raw_csv, out_dir / args.train_csv
+        compression = None if args.compress == "none" else args.compress
+        # CSV parts go up while the file is still being written
+        upload = (lambda path: self.uploader.open(self._s3_key(path))) if self.uploader else None
+        return (StreamingCsvWriter(raw_p, chunk_rows=args.flush_rows, compression=compression, upload=upload),
+                StreamingCsvWriter(train_p, chunk_rows=args.flush_rows, compression=compression, upload=upload))
+
+    def close_writers(self):
+        for w in (self.raw_writer, self.train_writer):
+            paths = w.close()
+            if self.uploader and isinstance(w, PartitionedParquetWriter):
+                # parquet footers are written last, so these files are uploaded once complete
+                for path in paths:
+                    self.uploader.upload_file(path, self._s3_key(path))
+            self.written.extend(paths)
+        self.raw_rows += self.raw_writer.rows
+        self.train_rows += self.train_writer.rows
+
+    def _is_new(self, flat: Dict[str, Any]) -> bool:
+        dev = flat.get("device_id")
+        ts = flat.get("timestamp")
+        # edge-logged rows share timestamp seconds, their ts_us is the per-prediction key
+        key = flat.get("ts_us")
+        if dev is None or ts is None or not self.seen.add(dev, ts if key is None else key):
+            return False
+        if self.args.incremental:
+            key = str(dev)
+            mark = self.watermarks.get(key)
+            if mark is not None and ts <= mark:
+                return False
+            if self.pending.get(key) is None or ts > self.pending[key]:
+                self.pending[key] = ts
+        return True
+
+    def write(self, flat: Dict[str, Any]) -> bool:
+        # returns False for rows that were deduplicated or sampled out
+        # sampling goes first: a dropped row must not reach the dedupe index or the watermarks
+        if self.args.sample_rate < 1.0 and random.random() > self.args.sample_rate:
+            return False
+        if not self._is_new(flat):
+            return False
+        flat["prediction_label"] = _prediction_label(flat, self.label_enc)
+        self.raw_writer.write(flat)
+        if self.preproc_artifacts:
+            train = _train_row(flat, self.preproc_artifacts)
+            if train is not None:
+                self.train_writer.write(train)
+        self.count += 1
+        return True
+
+    def page_done(self, segment: int, last_key: Optional[Dict[str, Any]]):
+        if not self.args.incremental:
+            return
+        p = self.state["pass"]
+        if last_key is None:
+            p["done"].append(segment)
+            p["cursors"].pop(str(segment), None)
+        else:
+            p["cursors"][str(segment)] = last_key
+        self.pages_since_checkpoint += 1
+        if self.pages_since_checkpoint >= self.args.checkpoint_pages:
+            # partition files must be final before the cursor that covers them is persisted
+            self.close_writers()
+            if self.dedupe_path:
+                self.seen.save(self.dedupe_path)
+            save_checkpoint(self.checkpoint_path, self.state)
+            self.seq += 1
+            self.raw_writer, self.train_writer = self._open_writers()
+            self.pages_since_checkpoint = 0
+
+    def _commit_pass(self, segments: int):
+        p = self.state["pass"]
+        if len(p["done"]) >= segments:
+            for dev, ts in p["pending"].items():
+                if self.watermarks.get(dev) is None or ts > self.watermarks[dev]:
+                    self.watermarks[dev] = ts
+            self.state["pass"] = None
+        self.state["watermarks"] = self.watermarks
+        save_checkpoint(self.checkpoint_path, self.state)
+
+    def finish(self, segments: int):
+        if self.dedupe_path:
+            self.seen.save(self.dedupe_path)
+        if self.args.incremental:
+            self._commit_pass(segments)
+        if self.uploader:
+            self.uploader.close()
+            st = self.uploader.stats()
+            print(f"Uploaded {st['objects']} objects ({st['bytes']} bytes, {st['parts']} multipart parts) "
+                  f"to s3://{self.args.s3_bucket}/{self.uploader.prefix}")
+        print(f"Done. Raw rows: {self.raw_rows}. Train-ready rows: {self.train_rows}. Outputs written to {self.out_dir}")
+
+    def abort(self):
+        # an unfinished export leaves no partial files or half-completed uploads behind
+        for w in (self.raw_writer, self.train_writer):
+            w.abort()
+        if self.uploader:
+            self.uploader.close()
+
+def _export_pages(run: _Export, pages, limit: int, incremental: bool):
+    for segment, rows, last_key in pages:
+        for flat in rows:
+            # in incremental mode the cursor only moves per page, so the limit is checked at page ends
+            if run.write(flat) and limit and run.count >= limit and not incremental:
+                break
+        run.page_done(segment, last_key)
+        if limit and run.count >= limit:
+            return
 
 def main():
     args = parse_args()
     out_dir = Path(args.out)
     out_dir.mkdir(parents=True, exist_ok=True)
     start_ts, end_ts = to_timestamp_bounds(args.start, args.end)
-    label_enc = load_label_encoder(args.label_encoder) if args.label_encoder else None
-    preproc_artifacts = None
-    if args.preproc_artifacts:
-        if load_artifacts is None:
-            print("preproc.load_artifacts not available; cannot apply preproc transform.", file=sys.stderr)
-            args.preproc_artifacts = None
-        else:
-            preproc_artifacts = load_artifacts(args.preproc_artifacts)
-
-    seen = set()
-    rows: List[Dict[str, Any]] = []
-    train_rows: List[Dict[str, Any]] = []
-
-    count = 0
-    for rec in dynamo_scan(args.table, args.region, start_ts, end_ts, limit=args.limit):
-        # dedupe
-        dev = rec.get("device_id")
-        ts = rec.get("timestamp")
-        if dev is None or ts is None:
-            continue
-        key = f"{dev}#{ts}"
-        if key in seen:
-            continue
-        seen.add(key)
-
-        # sampling
-        import random
-        if args.sample_rate < 1.0 and random.random() > args.sample_rate:
-            continue
-
-        flat = flatten_record(rec)
-        rows.append(flat)
-
-        if label_enc and flat.get("prediction") is not None:
-            try:
-                if isinstance(flat["prediction"], (int, float)):
-                    lbl = label_enc.inverse_transform([int(flat["prediction"])])[0]
-                    flat["prediction_label"] = lbl
-                else:
-                    flat["prediction_label"] = str(flat["prediction"])
-            except Exception:
-                flat["prediction_label"] = str(flat.get("prediction"))
-        else:
-            flat["prediction_label"] = flat.get("prediction")
+    checkpoint_path = Path(args.checkpoint) if args.checkpoint else out_dir / "export_checkpoint.json"
+    state: Dict[str, Any] = {}
+    segments, start_keys, done_segments = args.segments, {}, []
+    if args.incremental:
+        state, start_ts, end_ts, segments, start_keys, done_segments = _start_pass(args, checkpoint_path, start_ts, end_ts)
 
-        if preproc_artifacts:
-            try:
-                features = transform_raw(flat.get("sensor_readings") or json.loads(flat.get("raw_json") or "{}"), preproc_artifacts)
-                feat_list = list(map(float, features.reshape(-1).tolist()))
-                for i, col in enumerate(preproc_artifacts["feature_columns"]):
-                    flat[col] = feat_list[i]
-                train_rows.append(flat)
-            except Exception:
-                pass
-
-        count += 1
-        if args.limit and count >= args.limit:
-            break
-
-    # write raw CSV
-    raw_path = out_dir / args.raw_csv
-    tmpf = out_dir / (args.raw_csv + ".tmp")
-    if rows:
-        # get union of keys for header
-        header = sorted({k for r in rows for k in r.keys()})
-        with open(tmpf, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=header)
-            w.writeheader()
-            for r in rows:
-                w.writerow(r)
-        tmpf.replace(raw_path)
-
-    # write train-ready CSV if requested
-    train_path = out_dir / args.train_csv
-    if train_rows:
-        header = sorted({k for r in train_rows for k in r.keys()})
-        tmpf2 = out_dir / (args.train_csv + ".tmp")
-        with open(tmpf2, "w", newline="", encoding="utf-8") as f:
-            w = csv.DictWriter(f, fieldnames=header)
-            w.writeheader()
-            for r in train_rows:
-                w.writerow(r)
-        tmpf2.replace(train_path)
-
-    # optional S3 upload
-    if args.s3_bucket:
-        if raw_path.exists():
-            key = os.path.join(args.s3_prefix, raw_path.name) if args.s3_prefix else raw_path.name
-            upload_to_s3(str(raw_path), args.s3_bucket, key, args.region)
-        if train_rows and train_path.exists():
-            key = os.path.join(args.s3_prefix, train_path.name) if args.s3_prefix else train_path.name
-            upload_to_s3(str(train_path), args.s3_bucket, key, args.region)
-
-    print(f"Done. Raw rows: {len(rows)}. Train-ready rows: {len(train_rows)}. Outputs written to {out_dir}")
+    dedupe_path = args.dedupe_index or (out_dir / "dedupe_index.npz" if args.incremental else None)
+    seen = open_index(dedupe_path, args.dedupe, args.dedupe_capacity, args.dedupe_fp_rate)
+    run = _Export(args, out_dir, state, checkpoint_path, seen, dedupe_path)
+    pages = dynamo_scan_pages(args.table, args.region, start_ts, end_ts, segments=segments, workers=args.workers,
+                              start_keys=start_keys, skip_segments=done_segments,
+                              decode=lambda items: flatten_page(items, raw_json=args.raw_json))
+    try:
+        _export_pages(run, pages, args.limit, args.incremental)
+        pages.close()
+        run.close_writers()
+    except BaseException:
+        pages.close()
+        run.abort()
+        raise
+    run.finish(segments)
 
 if __name__ == "__main__":
     main()
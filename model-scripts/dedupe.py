@@ -0,0 +1,255 @@
+#compact (device_id, timestamp) dedupe indexes for data_collector, persisted next to the export
+#exact: per-device sorted int64 timestamp arrays, ~8 bytes/key instead of a python string per key
+#bloom: fixed-size bit array with a configurable false-positive rate (a false positive drops a new record)
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+MERGE_MIN = 1024
+MERGE_FRACTION = 16
+_MASK64 = (1 << 64) - 1
+
+def _int_ts(ts: Any) -> Optional[int]:
+    if isinstance(ts, bool):
+        return None
+    if isinstance(ts, int):
+        return ts
+    if isinstance(ts, float) and ts.is_integer():
+        return int(ts)
+    return None
+
+def _save_npz(path, meta: Dict[str, Any], **arrays):
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8), **arrays)
+    os.replace(tmp, path)
+
+class _DeviceKeys:
+    __slots__ = ("arr", "buf")
+
+    def __init__(self, arr: Optional[np.ndarray] = None):
+        self.arr = arr if arr is not None else np.empty(0, dtype=np.int64)
+        self.buf: set = set()
+
+    def __contains__(self, ts: int) -> bool:
+        if ts in self.buf:
+            return True
+        arr = self.arr
+        if not len(arr) or ts < arr[0] or ts > arr[-1]:
+            return False
+        i = arr.searchsorted(ts)
+        return i < len(arr) and arr[i] == ts
+
+    def add(self, ts: int):
+        self.buf.add(ts)
+        # merge cost is amortized by letting the buffer grow with the array
+        if len(self.buf) >= max(MERGE_MIN, len(self.arr) // MERGE_FRACTION):
+            self.merge()
+
+    def merge(self):
+        if not self.buf:
+            return
+        new = np.fromiter(self.buf, dtype=np.int64, count=len(self.buf))
+        new.sort()
+        # both runs are sorted, so the stable sort only has to merge them
+        merged = np.concatenate([self.arr, new])
+        merged.sort(kind="stable")
+        self.arr = merged
+        self.buf = set()
+
+    def __len__(self) -> int:
+        return len(self.arr) + len(self.buf)
+
+class ExactDedupeIndex:
+    mode = "exact"
+
+    def __init__(self):
+        self._devices: Dict[str, _DeviceKeys] = {}
+        # non-integer timestamps are rare, they just go in a plain set
+        self._other: set = set()
+
+    def add(self, device_id: Any, ts: Any) -> bool:
+        # returns True when the key was not seen before
+        dev = str(device_id)
+        its = _int_ts(ts)
+        if its is None:
+            key = (dev, repr(ts))
+            if key in self._other:
+                return False
+            self._other.add(key)
+            return True
+        keys = self._devices.get(dev)
+        if keys is None:
+            keys = self._devices[dev] = _DeviceKeys()
+        if its in keys:
+            return False
+        keys.add(its)
+        return True
+
+    def __contains__(self, key: Tuple[Any, Any]) -> bool:
+        dev, ts = str(key[0]), key[1]
+        its = _int_ts(ts)
+        if its is None:
+            return (dev, repr(ts)) in self._other
+        keys = self._devices.get(dev)
+        return keys is not None and its in keys
+
+    def __len__(self) -> int:
+        return sum(len(k) for k in self._devices.values()) + len(self._other)
+
+    def nbytes(self) -> int:
+        # array payload only; write buffers are bounded by MERGE_FRACTION
+        return sum(k.arr.nbytes for k in self._devices.values())
+
+    def save(self, path):
+        names = list(self._devices)
+        for k in self._devices.values():
+            k.merge()
+        arrays = [self._devices[n].arr for n in names]
+        offsets = np.cumsum([0] + [len(a) for a in arrays]).astype(np.int64)
+        keys = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+        meta = {"mode": self.mode, "devices": names, "other": sorted(self._other)}
+        _save_npz(path, meta, keys=keys, offsets=offsets)
+
+    @classmethod
+    def _from_npz(cls, meta: Dict[str, Any], z) -> "ExactDedupeIndex":
+        idx = cls()
+        keys, offsets = z["keys"], z["offsets"]
+        for i, name in enumerate(meta["devices"]):
+            idx._devices[name] = _DeviceKeys(keys[offsets[i]:offsets[i + 1]].copy())
+        idx._other = {tuple(x) for x in meta.get("other", [])}
+        return idx
+
+def _splitmix64(x: int) -> int:
+    x = (x + 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+class BloomDedupeIndex:
+    mode = "bloom"
+
+    def __init__(self, capacity: int = 10_000_000, fp_rate: float = 0.001, bits: Optional[bytearray] = None,
+                 n_bits: Optional[int] = None, n_hashes: Optional[int] = None, count: int = 0):
+        self.capacity = int(capacity)
+        self.fp_rate = float(fp_rate)
+        if n_bits is None:
+            n_bits = int(math.ceil(-self.capacity * math.log(self.fp_rate) / (math.log(2) ** 2)))
+        if n_hashes is None:
+            n_hashes = max(1, int(round(n_bits / self.capacity * math.log(2))))
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        # bytearray rather than a numpy array: per-bit scalar access is several times cheaper
+        self.bits = bits if bits is not None else bytearray((n_bits + 7) // 8)
+        self.count = count
+        self._dev_hash: Dict[str, int] = {}
+
+    def _positions(self, device_id: Any, ts: Any) -> List[int]:
+        dev = str(device_id)
+        dh = self._dev_hash.get(dev)
+        if dh is None:
+            # stable across processes, unlike hash()
+            dh = self._dev_hash[dev] = int.from_bytes(hashlib.blake2b(dev.encode("utf-8"), digest_size=8).digest(), "little")
+        its = _int_ts(ts)
+        if its is None:
+            its = int.from_bytes(hashlib.blake2b(repr(ts).encode("utf-8"), digest_size=8).digest(), "little")
+        h = _splitmix64(dh ^ (its & _MASK64))
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, device_id: Any, ts: Any) -> bool:
+        bits = self.bits
+        new = False
+        for p in self._positions(device_id, ts):
+            byte, mask = p >> 3, 1 << (p & 7)
+            if not bits[byte] & mask:
+                bits[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, key: Tuple[Any, Any]) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(*key))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def nbytes(self) -> int:
+        return len(self.bits)
+
+    def save(self, path):
+        meta = {"mode": self.mode, "capacity": self.capacity, "fp_rate": self.fp_rate,
+                "n_bits": self.n_bits, "n_hashes": self.n_hashes, "count": self.count}
+        _save_npz(path, meta, bits=np.frombuffer(self.bits, dtype=np.uint8))
+
+    @classmethod
+    def _from_npz(cls, meta: Dict[str, Any], z) -> "BloomDedupeIndex":
+        return cls(meta["capacity"], meta["fp_rate"], bits=bytearray(z["bits"].tobytes()), n_bits=meta["n_bits"],
+                   n_hashes=meta["n_hashes"], count=meta["count"])
+
+def load_index(path):
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(z["meta"].tobytes().decode("utf-8"))
+        if meta["mode"] == "bloom":
+            return BloomDedupeIndex._from_npz(meta, z)
+        return ExactDedupeIndex._from_npz(meta, z)
+
+def open_index(path=None, mode: str = "exact", capacity: int = 10_000_000, fp_rate: float = 0.001):
+    # an existing file wins over mode/capacity so incremental runs keep deduping against earlier ones
+    if path is not None and Path(path).exists():
+        return load_index(path)
+    if mode == "bloom":
+        return BloomDedupeIndex(capacity, fp_rate)
+    return ExactDedupeIndex()
+
+def _rss_mb() -> float:
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench(n_keys: int, n_devices: int, mode: str, fp_rate: float):
+    # keys are generated in chunks so the generator itself does not dominate peak RSS
+    rng = np.random.default_rng(0)
+    devices = [f"esp32-{i:04d}" for i in range(n_devices)]
+    chunk = 100_000
+    rss0 = _rss_mb()
+    idx = open_index(mode=mode, capacity=n_keys, fp_rate=fp_rate)
+    t0 = time.perf_counter()
+    new = 0
+    for start in range(0, n_keys, chunk):
+        n = min(chunk, n_keys - start)
+        # key k is (device k % n_devices, second k // n_devices): every key distinct, arrival order shuffled
+        k = start + rng.permutation(n)
+        dev_idx = (k % n_devices).tolist()
+        ts = (1_700_000_000 + k // n_devices).tolist()
+        for d, t in zip(dev_idx, ts):
+            new += idx.add(devices[d], t)
+    elapsed = time.perf_counter() - t0
+    if mode == "exact":
+        for k in idx._devices.values():
+            k.merge()
+    # the last chunk is replayed and must be reported as duplicates
+    dupes = sum(1 for d, t in zip(dev_idx[-10000:], ts[-10000:]) if not idx.add(devices[d], t))
+    print(json.dumps({
+        "mode": mode, "keys": n_keys, "new_keys": new, "devices": n_devices, "index_mb": round(idx.nbytes() / 2**20, 1),
+        "peak_rss_growth_mb": round(_rss_mb() - rss0, 1), "insert_s": round(elapsed, 2),
+        "us_per_key": round(elapsed / n_keys * 1e6, 2), "redetected_of_10000": dupes,
+    }))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="memory benchmark for the dedupe indexes")
+    parser.add_argument("--keys", type=int, default=10_000_000)
+    parser.add_argument("--devices", type=int, default=300)
+    parser.add_argument("--mode", choices=["exact", "bloom"], default="exact")
+    parser.add_argument("--fp-rate", type=float, default=0.001)
+    args = parser.parse_args()
+    bench(args.keys, args.devices, args.mode, args.fp_rate)
@@ -0,0 +1,304 @@
+#flattened RandomForest: exported once from the sklearn model, then served with numpy only
+#keeps sklearn out of the Lambda layer / Pi image, only export_forest needs a fitted sklearn forest
+
+import json
+from pathlib import Path
+from typing import Optional, Sequence
+import numpy as np
+
+FOREST_FORMAT = 1
+# leaf values stored as uint16 * meta["value_scale"]; older readers must refuse these
+QUANTIZED_FORMAT = 2
+BATCH_ROWS = 2048
+
+def forest_from_sklearn(clf, labels: Optional[Sequence[str]] = None,
+                        feature_columns: Optional[Sequence[str]] = None, generation: int = 0) -> "ArrayForest":
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in clf.estimators_:
+        t = est.tree_
+        n = t.node_count
+        leaf = t.children_left == -1
+        idx = np.arange(offset, offset + n)
+        # leaves point at themselves, a step from a leaf is a no-op
+        left = np.where(leaf, idx, t.children_left + offset)
+        right = np.where(leaf, idx, t.children_right + offset)
+        value = t.value[:, 0, :].astype(np.float64)
+        value = value / value.sum(axis=1, keepdims=True)
+        features.append(np.where(leaf, 0, t.feature).astype(np.int32))
+        thresholds.append(np.where(leaf, np.inf, t.threshold))
+        lefts.append(left.astype(np.int32))
+        rights.append(right.astype(np.int32))
+        values.append(value)
+        roots.append(offset)
+        offset += n
+        max_depth = max(max_depth, int(t.max_depth))
+    meta = {
+        "format": FOREST_FORMAT,
+        "n_features": int(clf.n_features_in_),
+        "max_depth": max_depth,
+        "n_trees": len(clf.estimators_),
+        "feature_columns": list(feature_columns) if feature_columns is not None else None,
+        "labels": [str(x) for x in labels] if labels is not None else None,
+        "generation": generation,
+        "tree_generation": [generation] * len(clf.estimators_),
+    }
+    return ArrayForest(
+        feature=np.concatenate(features),
+        threshold=np.concatenate(thresholds),
+        left=np.concatenate(lefts),
+        right=np.concatenate(rights),
+        value=np.concatenate(values),
+        roots=np.asarray(roots, dtype=np.int32),
+        classes=np.asarray(clf.classes_),
+        meta=meta,
+    )
+
+def save_forest(forest: "ArrayForest", path) -> Path:
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            feature=forest.feature,
+            threshold=forest.threshold,
+            left=forest.left,
+            right=forest.right,
+            value=forest.value,
+            roots=forest.roots,
+            classes=forest.classes_,
+            meta=np.frombuffer(json.dumps(forest.meta).encode("utf-8"), dtype=np.uint8),
+        )
+    tmp.replace(path)
+    return path
+
+def export_forest(clf, path, labels: Optional[Sequence[str]] = None,
+                  feature_columns: Optional[Sequence[str]] = None) -> Path:
+    return save_forest(forest_from_sklearn(clf, labels, feature_columns), path)
+
+class ArrayLabelEncoder:
+    def __init__(self, classes):
+        self.classes_ = np.asarray(classes)
+
+    def inverse_transform(self, y):
+        return self.classes_[np.asarray(y, dtype=np.int64)]
+
+class ArrayForest:
+    def __init__(self, feature, threshold, left, right, value, roots, classes, meta):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.meta = meta
+        self.max_depth = int(meta["max_depth"])
+        self.n_features_in_ = int(meta["n_features"])
+        self.feature_columns = meta.get("feature_columns")
+        self.labels = meta.get("labels")
+        self.version = meta.get("version")
+        self.value_scale = float(meta.get("value_scale", 1.0))
+        self.is_leaf = left == np.arange(len(left))
+        self.tree_generation = np.asarray(meta.get("tree_generation") or [0] * len(roots), dtype=np.int64)
+
+    def label_encoder(self) -> Optional[ArrayLabelEncoder]:
+        return ArrayLabelEncoder(self.labels) if self.labels else None
+
+    def apply(self, X) -> np.ndarray:
+        # sklearn compares float32 inputs against float64 thresholds, do the same for exact parity
+        X = np.asarray(X, dtype=np.float32)
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        node = np.tile(self.roots, n_rows)
+        row = np.repeat(np.arange(n_rows), n_trees)
+        # walk one level at a time, dropping (row, tree) pairs as soon as they reach a leaf
+        active = np.flatnonzero(~self.is_leaf[node])
+        while active.size:
+            cur = node[active]
+            go_left = X[row[active], self.feature[cur]] <= self.threshold[cur]
+            nxt = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = nxt
+            active = active[~self.is_leaf[nxt]]
+        return node.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        out = np.empty((X.shape[0], self.value.shape[1]))
+        for start in range(0, X.shape[0], BATCH_ROWS):
+            node = self.apply(X[start:start + BATCH_ROWS])
+            out[start:start + BATCH_ROWS] = self.value[node].sum(axis=1) / len(self.roots)
+        if self.value_scale != 1.0:
+            out *= self.value_scale
+        return out
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.left, self.right, self.value, self.roots))
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+def _tree_slices(forest: ArrayForest):
+    ends = np.append(forest.roots[1:], len(forest.feature))
+    return list(zip(forest.roots.tolist(), ends.tolist()))
+
+def _concat_trees(parts, classes, meta) -> ArrayForest:
+    # parts: (forest, [tree indices]); node ids are rebased and leaf distributions padded to `classes`
+    features, thresholds, lefts, rights, values, roots, gens = [], [], [], [], [], [], []
+    offset = 0
+    for forest, trees in parts:
+        cols = np.searchsorted(classes, forest.classes_)
+        slices = _tree_slices(forest)
+        for t in trees:
+            start, end = slices[t]
+            shift = offset - start
+            features.append(forest.feature[start:end])
+            thresholds.append(forest.threshold[start:end])
+            lefts.append((forest.left[start:end] + shift).astype(np.int32))
+            rights.append((forest.right[start:end] + shift).astype(np.int32))
+            value = np.zeros((end - start, len(classes)))
+            value[:, cols] = forest.value[start:end] * forest.value_scale
+            values.append(value)
+            roots.append(offset)
+            gens.append(int(forest.tree_generation[t]))
+            offset += end - start
+    # leaf values come out as float64 again, whatever the inputs were stored as
+    meta = dict(meta, format=FOREST_FORMAT, n_trees=len(roots), tree_generation=gens)
+    meta.pop("value_scale", None)
+    return ArrayForest(np.concatenate(features), np.concatenate(thresholds), np.concatenate(lefts),
+                       np.concatenate(rights), np.concatenate(values), np.asarray(roots, dtype=np.int32),
+                       np.asarray(classes), meta)
+
+def select_trees(forest: ArrayForest, trees: Sequence[int]) -> ArrayForest:
+    return _concat_trees([(forest, list(trees))], forest.classes_, forest.meta)
+
+def merge_forests(base: ArrayForest, new: ArrayForest, labels: Optional[Sequence[str]] = None) -> ArrayForest:
+    # classes are label-encoder codes, so trees fitted on different class subsets line up by code
+    classes = np.union1d(base.classes_, new.classes_)
+    meta = dict(base.meta, max_depth=max(base.max_depth, new.max_depth),
+                generation=max(base.meta.get("generation", 0), new.meta.get("generation", 0)))
+    if labels is not None:
+        meta["labels"] = [str(x) for x in labels]
+    return _concat_trees([(base, range(len(base.roots))), (new, range(len(new.roots)))], classes, meta)
+
+def _node_depths(forest: ArrayForest) -> np.ndarray:
+    # -1 for nodes no root reaches any more
+    depth = np.full(len(forest.feature), -1, dtype=np.int32)
+    frontier = forest.roots.astype(np.int64)
+    d = 0
+    while frontier.size:
+        depth[frontier] = d
+        frontier = frontier[~forest.is_leaf[frontier]]
+        frontier = np.concatenate([forest.left[frontier], forest.right[frontier]])
+        d += 1
+    return depth
+
+def _with_nodes(forest: ArrayForest, feature, threshold, left, right, value) -> ArrayForest:
+    # drops unreachable nodes and renumbers; trees stay contiguous with their root first
+    tmp = ArrayForest(feature, threshold, left, right, value, forest.roots, forest.classes_, forest.meta)
+    depth = _node_depths(tmp)
+    keep = np.flatnonzero(depth >= 0)
+    new_id = np.full(len(feature), -1, dtype=np.int64)
+    new_id[keep] = np.arange(len(keep))
+    meta = dict(forest.meta, max_depth=int(depth.max()))
+    return ArrayForest(feature[keep], threshold[keep], new_id[left[keep]].astype(np.int32),
+                       new_id[right[keep]].astype(np.int32), value[keep], new_id[forest.roots].astype(np.int32),
+                       forest.classes_, meta)
+
+def _collapse(forest: ArrayForest, nodes: np.ndarray) -> ArrayForest:
+    # the collapsed node predicts its own class distribution, which is what its subtree averages to in training
+    feature, threshold = forest.feature.copy(), forest.threshold.copy()
+    left, right = forest.left.copy(), forest.right.copy()
+    feature[nodes] = 0
+    threshold[nodes] = np.inf
+    left[nodes] = nodes
+    right[nodes] = nodes
+    return _with_nodes(forest, feature, threshold, left, right, forest.value)
+
+def limit_depth(forest: ArrayForest, max_depth: int) -> ArrayForest:
+    depth = _node_depths(forest)
+    return _collapse(forest, np.flatnonzero((depth == max_depth) & ~forest.is_leaf))
+
+def prune_leaves(forest: ArrayForest, tol: float) -> ArrayForest:
+    # bottom-up: a split whose two leaves are both within tol (max abs probability) of the parent is removed
+    while True:
+        internal = np.flatnonzero(~forest.is_leaf)
+        l, r = forest.left[internal], forest.right[internal]
+        both = forest.is_leaf[l] & forest.is_leaf[r]
+        internal, l, r = internal[both], l[both], r[both]
+        v = forest.value[internal]
+        small = ((np.abs(forest.value[l] - v).max(axis=1) <= tol) & (np.abs(forest.value[r] - v).max(axis=1) <= tol))
+        if not small.any():
+            return forest
+        forest = _collapse(forest, internal[small])
+
+def greedy_tree_subset(forest: ArrayForest, X, y, n_trees: int) -> list:
+    # forward selection on held-out rows: add the tree that most improves accuracy, ties go to the
+    # higher mean probability of the true class
+    y = np.searchsorted(forest.classes_, np.asarray(y))
+    P = forest.value[forest.apply(X)] * forest.value_scale
+    rows = np.arange(len(y))
+    total = np.zeros((len(y), P.shape[2]))
+    chosen: list = []
+    free = np.ones(P.shape[1], dtype=bool)
+    for _ in range(min(n_trees, P.shape[1])):
+        cand = total[:, None, :] + P
+        acc = (cand.argmax(axis=2) == y[:, None]).mean(axis=0)
+        true_p = cand[rows, :, y].mean(axis=0)
+        score = np.where(free, acc + 1e-9 * true_p, -np.inf)
+        t = int(score.argmax())
+        chosen.append(t)
+        free[t] = False
+        total += P[:, t]
+    return sorted(chosen)
+
+def quantize(forest: ArrayForest) -> ArrayForest:
+    # thresholds: the largest float32 <= the float64 threshold keeps every float32 comparison exact
+    # values: probabilities in 1/65535 steps; only leaf rows are ever read, internal rows are zeroed
+    t32 = forest.threshold.astype(np.float32)
+    over = t32.astype(np.float64) > forest.threshold
+    t32[over] = np.nextafter(t32[over], np.float32(-np.inf))
+    value = np.where(forest.is_leaf[:, None], forest.value * forest.value_scale, 0.0)
+    q = np.rint(value * 65535).astype(np.uint16)
+    feature_dtype = np.int16 if forest.n_features_in_ < 2**15 else np.int32
+    meta = dict(forest.meta, format=QUANTIZED_FORMAT, value_scale=1.0 / 65535)
+    return ArrayForest(forest.feature.astype(feature_dtype), t32, forest.left, forest.right, q, forest.roots,
+                       forest.classes_, meta)
+
+def compress_forest(forest: ArrayForest, X_select=None, y_select=None, n_trees: int = 0, max_depth: int = 0,
+                    prune_tol: float = 0.0, quantized: bool = False) -> ArrayForest:
+    # order matters: the subset is picked on the full trees, quantization comes last
+    if n_trees and n_trees < len(forest.roots):
+        if X_select is None:
+            raise ValueError("tree subset selection needs held-out rows")
+        forest = select_trees(forest, greedy_tree_subset(forest, X_select, y_select, n_trees))
+    if max_depth and max_depth < forest.max_depth:
+        forest = limit_depth(forest, max_depth)
+    if prune_tol > 0:
+        forest = prune_leaves(forest, prune_tol)
+    if quantized:
+        forest = quantize(forest)
+    # a new meta dict: with no step applied `forest` is still the caller's object
+    meta = dict(forest.meta, compression={"n_trees": int(len(forest.roots)), "max_depth": int(max_depth),
+                                          "prune_tol": float(prune_tol), "quantized": bool(quantized)})
+    return ArrayForest(forest.feature, forest.threshold, forest.left, forest.right, forest.value, forest.roots,
+                       forest.classes_, meta)
+
+def load_forest(path) -> ArrayForest:
+    with np.load(path, allow_pickle=False) as z:
+        arrays = {k: z[k] for k in z.files}
+    meta = json.loads(arrays.pop("meta").tobytes().decode("utf-8"))
+    if meta.get("format") not in (FOREST_FORMAT, QUANTIZED_FORMAT):
+        raise ValueError(f"Unsupported forest format: {meta.get('format')}")
+    return ArrayForest(meta=meta, **arrays)
+
+def check_parity(clf, forest: ArrayForest, X, atol: float = 1e-12) -> float:
+    # returns the max abs probability difference, raises if predictions disagree
+    expected = clf.predict_proba(X)
+    got = forest.predict_proba(X)
+    diff = float(np.abs(expected - got).max()) if len(X) else 0.0
+    if diff > atol or not np.array_equal(clf.predict(X), forest.predict(X)):
+        raise RuntimeError(f"Array forest diverges from sklearn model (max proba diff {diff:.3g})")
+    return diff
@@ -7,12 +7,16 @@ import sys
 import json
 import argparse
 import time
-import joblib
 import numpy as np
-from sklearn.metrics import confusion_matrix
+
+from bundle import is_bundle, load_bundle
+from forest import ArrayLabelEncoder, load_forest
+from metrics import NULL_STAGE
 
 ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "./artifacts")
 MODEL_PATH = os.path.join(ARTIFACT_DIR, "rft_herb_model.pkl")
+FOREST_PATH = os.path.join(ARTIFACT_DIR, "rft_herb_model.npz")
+BUNDLE_PATH = os.path.join(ARTIFACT_DIR, "bundle")
 LE_PATH = os.path.join(ARTIFACT_DIR, "label_encoder.pkl")
 META_PATH = os.path.join(ARTIFACT_DIR, "preprocess_metadata.pkl")
 
@@ -20,11 +24,142 @@ try:
     from preprocess import preprocess_input
 except Exception:
     preprocess_input = None
+# batch counterpart of preprocess_input, set when a bundle provides the preprocessing
+preprocess_batch = None
+# opt-in PredictionCache, see enable_cache
+result_cache = None
+# opt-in per-stage timings, see enable_metrics; stages cost one attribute check while this is None
+pipeline_metrics = None
+# per-device calibration.CalibrationStore, built by load_artifacts for bundles after enable_calibration
+calibration_store = None
+_calibration_settings = None
+# per-device rolling-window features, set by load_artifacts when the model was trained with them
+rolling_stage = None
+ROLLING_MAX_DEVICES = 10000
+# opt-in durable store-and-forward log (spool.PredictionLog), see enable_prediction_log
+prediction_log = None
+
+def enable_cache(max_entries=10000, ttl_s=300.0, resolution=None):
+    global result_cache
+    from cache import PredictionCache
+    result_cache = PredictionCache(max_entries, ttl_s, resolution) if max_entries > 0 else None
+    return result_cache
+
+def enable_metrics():
+    global pipeline_metrics
+    from metrics import Metrics
+    pipeline_metrics = Metrics()
+    return pipeline_metrics
+
+def enable_prediction_log(directory, **kwargs):
+    global prediction_log
+    from spool import PredictionLog
+    prediction_log = PredictionLog(directory, **kwargs).start() if directory else None
+    return prediction_log
+
+def _stage(name):
+    return pipeline_metrics.stage(name) if pipeline_metrics is not None else NULL_STAGE
+
+def enable_calibration(path, check_interval_s=2.0):
+    # takes effect at the next load_artifacts; the file is re-read whenever it changes
+    global _calibration_settings
+    _calibration_settings = (path, check_interval_s) if path else None
+
+def _model_version(model):
+    return getattr(model, "version", None) or id(model)
+
+def _use_compiled_preprocessing(compiled):
+    global preprocess_input, preprocess_batch, calibration_store
+    from preproc import calibrate_array, impute_array, records_to_array
+    calibration_store = None
+    if _calibration_settings is not None:
+        from calibration import CalibrationStore
+        path, interval = _calibration_settings
+        # cached results were computed with the old offsets
+        calibration_store = CalibrationStore(path, compiled["feature_columns"], compiled["gain"], compiled["offset"],
+                                             interval, on_reload=lambda table: result_cache and result_cache.invalidate())
+    # same steps as preproc.transform_fast, split so each one can be timed
+    def preprocess_records(records):
+        with _stage("map_keys"):
+            X = records_to_array(records, compiled)
+        with _stage("calibration"):
+            if calibration_store is not None:
+                X = calibrate_array(X, compiled, [raw.get("device_id") for raw in records], calibration_store.current())
+            else:
+                X = calibrate_array(X, compiled)
+        with _stage("imputation"):
+            return impute_array(X, compiled)
+
+    def preprocess_one(raw, feature_columns=None):
+        return preprocess_records([raw])
+    preprocess_input = preprocess_one
+    preprocess_batch = preprocess_records
+
+def _use_rolling(model):
+    global rolling_stage
+    rolling = (getattr(model, "meta", None) or {}).get("rolling")
+    if not rolling:
+        rolling_stage = None
+        return None
+    from rolling import RollingFeatures
+    rolling_stage = RollingFeatures(len(rolling["columns"]), rolling["window"], ROLLING_MAX_DEVICES)
+    return rolling["columns"]
+
+def _add_rolling(records, X):
+    if rolling_stage is None:
+        return X
+    with _stage("rolling"):
+        return rolling_stage.transform([raw.get("device_id") for raw in records], X)
+
+def _sibling_preprocessing(model_path):
+    d = os.path.dirname(os.path.abspath(model_path))
+    if not (os.path.exists(os.path.join(d, "feature_columns.json")) and os.path.exists(os.path.join(d, "imputer.pkl"))):
+        return None
+    from preproc import load_artifacts as load_preproc
+    return load_preproc(d)["compiled"]
 
 def load_artifacts(model_path=MODEL_PATH, le_path=LE_PATH, meta_path=META_PATH):
-    model = joblib.load(model_path)
-    label_encoder = joblib.load(le_path) if os.path.exists(le_path) else None
-    metadata = joblib.load(meta_path) if os.path.exists(meta_path) else {}
+    if result_cache is not None:
+        # results from the previous artifacts must never be served for the new ones
+        result_cache.invalidate()
+    if is_bundle(model_path):
+        # manifest + mmapped arrays: model, labels, columns, preprocessing and version in one place
+        bundle = load_bundle(model_path)
+        model = bundle.forest
+        label_encoder = ArrayLabelEncoder(bundle.labels) if bundle.labels else None
+        _use_compiled_preprocessing(bundle.compiled)
+        _use_rolling(model)
+        return model, label_encoder, list(bundle.feature_columns)
+    # the preprocessing rft.py fitted for this model is saved next to it
+    compiled = _sibling_preprocessing(model_path)
+    if compiled is not None:
+        _use_compiled_preprocessing(compiled)
+    elif _calibration_settings is not None:
+        print("Per-device calibration needs the preprocessing artifacts, ignoring it for", model_path, file=sys.stderr)
+    # only the pickle-based paths below need joblib, the bundle path never imports it
+    import joblib
+    if str(model_path).endswith(".npz"):
+        if compiled is None:
+            # raw values without alias mapping and median imputation give confidently wrong predictions
+            raise FileNotFoundError(f"{model_path} needs feature_columns.json and imputer.pkl from training in the "
+                                    "same directory, or serve the bundle instead")
+        # array forest carries its own labels and columns, no sklearn unpickling needed
+        model = load_forest(model_path)
+        label_encoder = model.label_encoder()
+        if label_encoder is None and os.path.exists(le_path):
+            label_encoder = joblib.load(le_path)
+        metadata = {"feature_columns": model.feature_columns} if model.feature_columns else {}
+        base_columns = _use_rolling(model)
+        if base_columns:
+            # the model's own columns include the rolling ones, raw records only carry the base sensors
+            metadata = {"feature_columns": base_columns}
+    else:
+        model = joblib.load(model_path)
+        label_encoder = joblib.load(le_path) if os.path.exists(le_path) else None
+        metadata = {}
+        _use_rolling(model)
+    if os.path.exists(meta_path):
+        metadata = joblib.load(meta_path)
     feature_columns = metadata.get("feature_columns", metadata.get("feature_cols", None))
     return model, label_encoder, feature_columns
 
@@ -35,30 +170,158 @@ def dict_to_vector(raw, feature_columns):
     vec = [float(raw.get(c, 0.0)) for c in feature_columns]
     return np.asarray(vec, dtype=float).reshape(1, -1)
 
+def _cache_key(raw, feature_columns, model):
+    version = _model_version(model)
+    if calibration_store is not None:
+        # polled here too so a changed table invalidates the cache before it can serve a stale hit
+        calibration_store.current()
+        # the same reading calibrates differently per device
+        version = (version, raw.get("device_id"))
+    return result_cache.key(raw, feature_columns, version)
+
+def _cacheable(feature_columns):
+    # rolling features depend on the device's history, so equal readings can give different results
+    return result_cache is not None and feature_columns is not None and rolling_stage is None
+
 def predict_from_raw(model, label_encoder, feature_columns, raw):
-    if preprocess_input is not None:
-        try:
-            vec = preprocess_input(raw, feature_columns=feature_columns)
-        except Exception:
+    with _stage("predict_from_raw"):
+        out = _predict_one(model, label_encoder, feature_columns, raw)
+    if prediction_log is not None:
+        prediction_log.append(raw, out)
+    return out
+
+def _predict_one(model, label_encoder, feature_columns, raw):
+    key = None
+    if _cacheable(feature_columns):
+        with _stage("cache_lookup"):
+            key = _cache_key(raw, feature_columns, model)
+            hit = result_cache.get(key)
+        if hit is not None:
+            return dict(hit, timestamp=int(time.time()))
+    with _stage("preprocess"):
+        if preprocess_input is not None:
+            try:
+                vec = preprocess_input(raw, feature_columns=feature_columns)
+            except Exception:
+                vec = dict_to_vector(raw, feature_columns)
+        else:
             vec = dict_to_vector(raw, feature_columns)
-    else:
-        vec = dict_to_vector(raw, feature_columns)
-    pred = model.predict(vec)
+    vec = _add_rolling([raw], vec)
+    with _stage("predict"):
+        pred = model.predict(vec)
     if hasattr(model, "predict_proba"):
         try:
-            proba = model.predict_proba(vec).max(axis=1)[0]
+            with _stage("predict_proba"):
+                proba = model.predict_proba(vec).max(axis=1)[0]
         except Exception:
             proba = None
     else:
         proba = None
+    with _stage("decode_labels"):
+        if label_encoder is not None:
+            try:
+                pred_label = label_encoder.inverse_transform(pred)[0]
+            except Exception:
+                pred_label = str(pred[0])
+        else:
+            pred_label = str(pred[0])
+    out = {"prediction": pred_label, "confidence": float(proba) if proba is not None else None, "timestamp": int(time.time())}
+    if getattr(model, "version", None):
+        out["model_version"] = model.version
+    if key is not None:
+        result_cache.put(key, dict(out))
+    return out
+
+def records_to_matrix(records, feature_columns):
+    if preprocess_batch is not None:
+        return preprocess_batch(records)
+    if preprocess_input is not None:
+        try:
+            return np.vstack([preprocess_input(raw, feature_columns=feature_columns) for raw in records])
+        except Exception:
+            pass
+    X = np.asarray([[float(raw.get(c, 0.0)) for c in feature_columns] for raw in records], dtype=float)
+    return X.reshape(-1, len(feature_columns))
+
+def _decode_labels(label_encoder, pred):
     if label_encoder is not None:
         try:
-            pred_label = label_encoder.inverse_transform(pred)[0]
+            return [str(x) for x in label_encoder.inverse_transform(pred)]
         except Exception:
-            pred_label = str(pred[0])
+            pass
+    return [str(x) for x in pred]
+
+def predict_batch(model, label_encoder, feature_columns, records):
+    records = list(records)
+    out = _predict_batch_cached(model, label_encoder, feature_columns, records)
+    if prediction_log is not None:
+        prediction_log.extend(records, out)
+    return out
+
+def _predict_batch_cached(model, label_encoder, feature_columns, records):
+    if not _cacheable(feature_columns) or not records:
+        return _predict_records(model, label_encoder, feature_columns, records)
+    # only cache misses go through the model, in one batch
+    keys = [_cache_key(raw, feature_columns, model) for raw in records]
+    ts = int(time.time())
+    out = [None] * len(records)
+    misses = []
+    for i, key in enumerate(keys):
+        hit = result_cache.get(key)
+        if hit is not None:
+            out[i] = dict(hit, timestamp=ts)
+        else:
+            misses.append(i)
+    if misses:
+        computed = _predict_records(model, label_encoder, feature_columns, [records[i] for i in misses])
+        for i, res in zip(misses, computed):
+            result_cache.put(keys[i], dict(res))
+            out[i] = res
+    return out
+
+def _predict_records(model, label_encoder, feature_columns, records):
+    # one (n, features) matrix and a single predict_proba pass for the whole batch
+    if not records:
+        return []
+    if feature_columns is None:
+        # columns are inferred per record in this case, so rows may not line up
+        out = []
+        for raw in records:
+            with _stage("predict_from_raw"):
+                out.append(_predict_one(model, label_encoder, feature_columns, raw))
+        return out
+    if pipeline_metrics is not None:
+        pipeline_metrics.observe_size("predict_batch", len(records))
+    with _stage("preprocess"):
+        X = records_to_matrix(records, feature_columns)
+    X = _add_rolling(records, X)
+    proba = None
+    if hasattr(model, "predict_proba"):
+        try:
+            with _stage("predict_proba"):
+                proba = model.predict_proba(X)
+        except Exception:
+            proba = None
+    if proba is not None:
+        idx = proba.argmax(axis=1)
+        classes = getattr(model, "classes_", None)
+        pred = np.asarray(classes).take(idx) if classes is not None else idx
+        conf = proba[np.arange(len(idx)), idx].tolist()
     else:
-        pred_label = str(pred[0])
-    out = {"prediction": pred_label, "confidence": float(proba) if proba is not None else None, "timestamp": int(time.time())}
+        with _stage("predict"):
+            pred = model.predict(X)
+        conf = [None] * len(records)
+    with _stage("decode_labels"):
+        labels = _decode_labels(label_encoder, pred)
+    ts = int(time.time())
+    out = [
+        {"prediction": lbl, "confidence": float(c) if c is not None else None, "timestamp": ts}
+        for lbl, c in zip(labels, conf)
+    ]
+    version = getattr(model, "version", None)
+    if version:
+        for res in out:
+            res["model_version"] = version
     return out
 
 def predict_json_file(model, label_encoder, feature_columns, json_path):
@@ -68,9 +331,7 @@ def predict_json_file(model, label_encoder, feature_columns, json_path):
         out = predict_from_raw(model, label_encoder, feature_columns, obj)
         print(json.dumps(out, indent=2))
     elif isinstance(obj, list):
-        results = []
-        for raw in obj:
-            results.append(predict_from_raw(model, label_encoder, feature_columns, raw))
+        results = predict_batch(model, label_encoder, feature_columns, obj)
         print(json.dumps(results, indent=2))
     else:
         raise ValueError("Unsupported JSON structure for prediction")
@@ -78,55 +339,189 @@ def predict_json_file(model, label_encoder, feature_columns, json_path):
 def predict_csv(model, label_encoder, feature_columns, csv_path):
     import pandas as pd
     df = pd.read_csv(csv_path)
-    rows = []
-    for _, r in df.iterrows():
-        raw = r.to_dict()
-        rows.append(predict_from_raw(model, label_encoder, feature_columns, raw))
+    rows = predict_batch(model, label_encoder, feature_columns, df.to_dict("records"))
     print(json.dumps(rows, indent=2))
 
-def start_mqtt_loop(model, label_encoder, feature_columns, broker, port, topic):
-    import paho.mqtt.client as mqtt
+def handle_mqtt_batch(model, label_encoder, feature_columns, messages, publish=None):
+    # messages are raw (topic, payload) pairs; decoding happens here, off the network thread
+    records = []
+    with _stage("json_decode"):
+        for _, payload in messages:
+            try:
+                data = json.loads(payload.decode("utf-8") if isinstance(payload, bytes) else payload)
+            except Exception as e:
+                print("Error:", e, file=sys.stderr)
+                continue
+            if isinstance(data, dict):
+                records.append(data)
+            else:
+                print("Error: expected a JSON object, got", type(data).__name__, file=sys.stderr)
+    if pipeline_metrics is not None:
+        pipeline_metrics.inc("mqtt_messages", len(messages))
+        pipeline_metrics.inc("mqtt_decode_errors", len(messages) - len(records))
+        pipeline_metrics.observe_size("mqtt_batch", len(messages))
+    if not records:
+        return []
+    with _stage("predict_batch"):
+        results = predict_batch(model, label_encoder, feature_columns, records)
+    with _stage("publish"):
+        for raw, res in zip(records, results):
+            if raw.get("device_id") is not None:
+                res["device_id"] = raw["device_id"]
+            if publish is not None:
+                publish(json.dumps(res))
+            else:
+                print(json.dumps(res))
+    return results
+
+def start_mqtt_loop(model, label_encoder, feature_columns, broker, port, topic, reply_topic="herb/sensor/prediction",
+                    batch_size=64, batch_ms=20.0, queue_size=1024, workers=1, client=None):
+    from batching import MicroBatcher
+    if client is None:
+        import paho.mqtt.client as mqtt
+        client = mqtt.Client()
+    publish = (lambda body: client.publish(reply_topic, body)) if reply_topic else None
+    batcher = MicroBatcher(
+        lambda msgs: handle_mqtt_batch(model, label_encoder, feature_columns, msgs, publish),
+        max_batch=batch_size, max_wait_ms=batch_ms, max_queue=queue_size, workers=workers,
+    )
     def on_connect(client, userdata, flags, rc):
         client.subscribe(topic)
     def on_message(client, userdata, msg):
-        try:
-            payload = msg.payload.decode("utf-8")
-            data = json.loads(payload)
-            res = predict_from_raw(model, label_encoder, feature_columns, data)
-            print(json.dumps(res))
-        except Exception as e:
-            print("Error:", e, file=sys.stderr)
-    client = mqtt.Client()
+        if not batcher.submit((msg.topic, msg.payload)):
+            dropped = batcher.counters["dropped"]
+            if dropped == 1 or dropped % 1000 == 0:
+                print(f"Queue full, dropped {dropped} messages so far", file=sys.stderr)
     client.on_connect = on_connect
     client.on_message = on_message
-    client.connect(broker, port, 60)
-    client.loop_forever()
+    batcher.start()
+    try:
+        client.connect(broker, port, 60)
+        client.loop_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        batcher.stop()
+        print("MQTT stats:", json.dumps(batcher.stats()), file=sys.stderr)
+        if result_cache is not None:
+            print("Cache stats:", json.dumps(result_cache.stats()), file=sys.stderr)
+    return batcher
 
 def main():
+    global ROLLING_MAX_DEVICES
     parser = argparse.ArgumentParser()
     parser.add_argument("--json")
     parser.add_argument("--csv")
+    parser.add_argument("--out", help="stream --csv predictions to this file in chunks instead of printing one JSON array")
+    parser.add_argument("--out-format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--chunk-rows", type=int, default=20000)
+    parser.add_argument("--processes", type=int, default=None,
+                        help="scoring processes for chunked --csv (default: all cores, 0 = in-process)")
     parser.add_argument("--mqtt", action="store_true")
     parser.add_argument("--broker", default="localhost")
     parser.add_argument("--port", type=int, default=1883)
     parser.add_argument("--topic", default="herb/sensor/data")
+    parser.add_argument("--serve", action="store_true", help="run a local HTTP server for POST /v1/predict")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--http-port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=256, help="in-flight HTTP requests beyond this get 503")
+    parser.add_argument("--reply-topic", default="herb/sensor/prediction", help="empty string prints results instead")
+    parser.add_argument("--batch-size", type=int, default=64, help="flush a micro-batch at this many messages")
+    parser.add_argument("--batch-ms", type=float, default=None,
+                        help="or after this many milliseconds (20 for MQTT, 0 for --serve)")
+    parser.add_argument("--queue-size", type=int, default=1024, help="messages beyond this are dropped")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--cache-size", type=int, default=0, help="LRU prediction cache entries (0 = off)")
+    parser.add_argument("--cache-ttl", type=float, default=300.0, help="seconds a cached prediction stays valid")
+    parser.add_argument("--metrics-jsonl",
+                        help="append a metrics snapshot to this file every --metrics-interval ('-' = stderr)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0)
+    parser.add_argument("--metrics-port", type=int, default=0, help="serve Prometheus text on 127.0.0.1:<port>/metrics")
+    parser.add_argument("--rolling-max-devices", type=int, default=ROLLING_MAX_DEVICES,
+                        help="devices whose rolling windows are kept in memory, least recently seen are evicted")
+    parser.add_argument("--calibration", help="per-device calibration table (JSON), reloaded when the file changes")
+    parser.add_argument("--spool", help="durably log every prediction under this directory (store-and-forward)")
+    parser.add_argument("--spool-max-mb", type=float, default=256.0, help="oldest log segments are dropped past this")
+    parser.add_argument("--spool-commit-ms", type=float, default=50.0, help="group commit interval (one fsync per interval)")
+    parser.add_argument("--forward-table", help="DynamoDB table the logged predictions are shipped to")
+    parser.add_argument("--forward-region", default=None)
+    parser.add_argument("--forward-endpoint-url", help="DynamoDB endpoint override, e.g. DynamoDB Local for testing")
     parser.add_argument("--model")
     parser.add_argument("--le")
     parser.add_argument("--meta")
     args = parser.parse_args()
-    model_path = args.model if args.model else MODEL_PATH
+    if args.model:
+        model_path = args.model
+    else:
+        model_path = next((p for p in (BUNDLE_PATH, FOREST_PATH) if os.path.exists(p)), MODEL_PATH)
     le_path = args.le if args.le else LE_PATH
     meta_path = args.meta if args.meta else META_PATH
+    ROLLING_MAX_DEVICES = args.rolling_max_devices
+    if args.csv and (args.out or args.processes is not None):
+        # chunked scoring loads the artifacts itself, once per worker process
+        from scoring import score_csv
+        ignored = [flag for flag, on in (("--cache-size", args.cache_size > 0), ("--spool", args.spool),
+                                         ("--forward-table", args.forward_table),
+                                         ("--metrics-jsonl", args.metrics_jsonl), ("--metrics-port", args.metrics_port))
+                   if on]
+        if ignored:
+            print(f"Chunked --csv scoring does not support {', '.join(ignored)}, ignoring", file=sys.stderr)
+        score_csv(args.csv, model_path, le_path, meta_path, out_path=args.out, fmt=args.out_format,
+                  chunk_rows=args.chunk_rows, processes=args.processes, calibration=args.calibration)
+        return
+    if args.cache_size > 0:
+        enable_cache(args.cache_size, args.cache_ttl)
+    if args.calibration:
+        enable_calibration(args.calibration)
+    exporter = metrics_server = None
+    if args.metrics_jsonl or args.metrics_port:
+        from metrics import JsonLinesExporter, serve_prometheus
+        m = enable_metrics()
+        if args.metrics_jsonl:
+            exporter = JsonLinesExporter(m, args.metrics_jsonl, args.metrics_interval).start()
+        if args.metrics_port:
+            metrics_server = serve_prometheus(m, args.metrics_port)
+    forwarder = None
+    if args.spool:
+        log = enable_prediction_log(args.spool, max_bytes=int(args.spool_max_mb * 2**20),
+                                    commit_ms=args.spool_commit_ms)
+        if args.forward_table:
+            from spool import DynamoForwarder
+            forwarder = DynamoForwarder(log, args.forward_table, region=args.forward_region,
+                                        endpoint_url=args.forward_endpoint_url).start()
+    elif args.forward_table:
+        print("--forward-table needs --spool, predictions are only forwarded from the local log", file=sys.stderr)
     model, label_encoder, feature_columns = load_artifacts(model_path, le_path, meta_path)
-    if args.json:
-        predict_json_file(model, label_encoder, feature_columns, args.json)
-    elif args.csv:
-        predict_csv(model, label_encoder, feature_columns, args.csv)
-    elif args.mqtt:
-        start_mqtt_loop(model, label_encoder, feature_columns, args.broker, args.port, args.topic)
-    else:
-        print("Provide --json or --csv or --mqtt")
-        sys.exit(1)
+    try:
+        if args.json:
+            predict_json_file(model, label_encoder, feature_columns, args.json)
+        elif args.csv:
+            predict_csv(model, label_encoder, feature_columns, args.csv)
+        elif args.mqtt:
+            start_mqtt_loop(model, label_encoder, feature_columns, args.broker, args.port, args.topic,
+                            reply_topic=args.reply_topic, batch_size=args.batch_size,
+                            batch_ms=20.0 if args.batch_ms is None else args.batch_ms,
+                            queue_size=args.queue_size, workers=args.workers)
+        elif args.serve:
+            from server import run_server
+            run_server(lambda records: predict_batch(model, label_encoder, feature_columns, records),
+                       args.host, args.http_port, model_version=getattr(model, "version", None),
+                       batch_size=args.batch_size, batch_ms=0.0 if args.batch_ms is None else args.batch_ms,
+                       max_concurrency=args.max_concurrency, workers=args.workers, stage=_stage)
+        else:
+            print("Provide --json or --csv or --mqtt or --serve")
+            sys.exit(1)
+    finally:
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        if exporter is not None:
+            exporter.stop()
+        if prediction_log is not None:
+            # whatever is still queued is committed; unsent segments are picked up by the next run
+            prediction_log.close()
+            if forwarder is not None:
+                forwarder.stop(timeout=5.0)
+            print("Prediction log:", json.dumps(prediction_log.stats()), file=sys.stderr)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,219 @@
+#per-stage latency histograms + counters for the inference pipeline
+#disabled by default: inference.py only times stages once enable_metrics() installed a registry
+#export as periodic JSON lines or as Prometheus text on a local HTTP port
+
+import bisect
+import json
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+# seconds; fixed upper bounds so observe() is a bisect + increment, the last bucket is +Inf
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float):
+        i = bisect.bisect_left(self.bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # upper bound of the bucket holding the q-th observation, good enough to spot a slow stage
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        return {"count": n, "sum": total, "buckets": counts}
+
+class _Stage:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+        return False
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_STAGE = _NullStage()
+
+class Metrics:
+    def __init__(self, prefix: str = "herb"):
+        self.prefix = prefix
+        self.started = time.time()
+        self.stages: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _hist(self, table: Dict[str, Histogram], name: str, bounds) -> Histogram:
+        h = table.get(name)
+        if h is None:
+            with self._lock:
+                h = table.setdefault(name, Histogram(bounds))
+        return h
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self._hist(self.stages, name, LATENCY_BUCKETS))
+
+    def observe(self, name: str, seconds: float):
+        self._hist(self.stages, name, LATENCY_BUCKETS).observe(seconds)
+
+    def observe_size(self, name: str, n: int):
+        self._hist(self.sizes, name, SIZE_BUCKETS).observe(n)
+
+    def inc(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            counters = dict(self.counters)
+            stages = dict(self.stages)
+            sizes = dict(self.sizes)
+        out = {"ts": round(time.time(), 3), "uptime_s": round(time.time() - self.started, 1),
+               "counters": counters, "stages": {}, "sizes": {}}
+        for name, h in sorted(stages.items()):
+            snap = h.snapshot()
+            out["stages"][name] = {
+                "count": snap["count"],
+                "mean_ms": round(snap["sum"] / snap["count"] * 1e3, 4) if snap["count"] else None,
+                "p50_ms": _ms(h.quantile(0.5)),
+                "p90_ms": _ms(h.quantile(0.9)),
+                "p99_ms": _ms(h.quantile(0.99)),
+            }
+        for name, h in sorted(sizes.items()):
+            snap = h.snapshot()
+            mean = round(snap["sum"] / snap["count"], 2) if snap["count"] else None
+            out["sizes"][name] = {"count": snap["count"], "mean": mean}
+        return out
+
+    def prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            counters = dict(self.counters)
+            stages = dict(self.stages)
+            sizes = dict(self.sizes)
+        for name, v in sorted(counters.items()):
+            metric = f"{self.prefix}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {v}"]
+        _prom_family(lines, f"{self.prefix}_stage_seconds", "stage", stages)
+        _prom_family(lines, f"{self.prefix}_batch_size", "name", sizes)
+        return "\n".join(lines) + "\n"
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    if v is None:
+        return None
+    return v * 1e3 if v != float("inf") else v
+
+def _prom_family(lines: List[str], metric: str, label: str, hists: Dict[str, Histogram]):
+    if not hists:
+        return
+    lines.append(f"# TYPE {metric} histogram")
+    for name, h in sorted(hists.items()):
+        snap = h.snapshot()
+        cum = 0
+        for bound, c in zip(list(h.bounds) + ["+Inf"], snap["buckets"]):
+            cum += c
+            lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cum}')
+        lines.append(f'{metric}_sum{{{label}="{name}"}} {snap["sum"]}')
+        lines.append(f'{metric}_count{{{label}="{name}"}} {snap["count"]}')
+
+class JsonLinesExporter:
+    # appends one snapshot per interval; "-" writes to stderr
+    def __init__(self, metrics: Metrics, path: str, interval_s: float = 10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = max(0.1, float(interval_s))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def write(self):
+        line = json.dumps(self.metrics.snapshot())
+        if self.path == "-":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print("Metrics export error:", e, file=sys.stderr)
+
+    def start(self) -> "JsonLinesExporter":
+        self._thread = threading.Thread(target=self._run, name="metrics-jsonl", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # one last line so short runs still leave a record
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(1.0)
+            self._thread = None
+        self.write()
+
+def serve_prometheus(metrics: Metrics, port: int, host: str = "127.0.0.1"):
+    # GET /metrics on a daemon thread; returns the server so callers can shut it down
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
@@ -1,11 +1,13 @@
+from __future__ import annotations
 import json
 import pickle
 from pathlib import Path
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List
 import numpy as np
-import pandas as pd
-from sklearn.impute import SimpleImputer
-from sklearn.preprocessing import StandardScaler
+
+if TYPE_CHECKING:
+    # pandas is only imported where a DataFrame has to be built, bundle serving never pays for it
+    import pandas as pd
 
 FEATURE_COLUMNS: List[str] = [
     "pH",
@@ -41,25 +43,39 @@ def _map_keys(raw: Dict) -> Dict:
             out[k] = v
     return out
 
-def apply_calibration(df: pd.DataFrame) -> pd.DataFrame:
+# per-column (gain, offset), applied as x * gain + offset. identity until probes are calibrated
+CALIBRATION: Dict[str, tuple] = {
+    "pH": (1.0, 0.0),
+    "TDS_ppm": (1.0, 0.0),
+    "ORP_mV": (1.0, 0.0),
+    "Temperature_C": (1.0, 0.0),
+    "Color_R": (1.0, 0.0),
+    "Color_G": (1.0, 0.0),
+    "Color_B": (1.0, 0.0),
+}
+
+def apply_calibration(df: pd.DataFrame, table=None, device_ids=None) -> pd.DataFrame:
+    # one multiply-add over all calibrated columns; with a calibration.CalibrationTable each row
+    # gets its device's (gain, offset), unknown or missing device ids get the table's default row
     df = df.copy()
-    if "Color_R" in df.columns:
-        df["Color_R"] = df["Color_R"] * 1.0
-    if "Color_G" in df.columns:
-        df["Color_G"] = df["Color_G"] * 1.0
-    if "Color_B" in df.columns:
-        df["Color_B"] = df["Color_B"] * 1.0
-    if "ORP_mV" in df.columns:
-        df["ORP_mV"] = df["ORP_mV"] + 0.0
-    if "pH" in df.columns:
-        df["pH"] = df["pH"] + 0.0
-    if "TDS_ppm" in df.columns:
-        df["TDS_ppm"] = df["TDS_ppm"] * 1.0
-    if "Temperature_C" in df.columns:
-        df["Temperature_C"] = df["Temperature_C"] * 1.0
+    if table is None:
+        cols = [c for c in CALIBRATION if c in df.columns]
+        gain = np.array([CALIBRATION[c][0] for c in cols], dtype=float)
+        offset = np.array([CALIBRATION[c][1] for c in cols], dtype=float)
+    else:
+        cols = [c for c in table.columns if c in df.columns]
+        pos = [table.columns.index(c) for c in cols]
+        idx = table.rows(device_ids) if device_ids is not None else np.zeros(len(df), dtype=np.intp)
+        gain = table.gains[idx][:, pos]
+        offset = table.offsets[idx][:, pos]
+    if cols:
+        df[cols] = df[cols].to_numpy(dtype=float) * gain + offset
     return df
 
 def fit_preprocessor(df: pd.DataFrame, out_dir: str or Path, do_scale: bool = False):
+    # sklearn is only needed to fit; serving goes through the compiled arrays
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import StandardScaler
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
     present = [c for c in FEATURE_COLUMNS if c in df.columns]
@@ -86,6 +102,12 @@ def fit_preprocessor(df: pd.DataFrame, out_dir: str or Path, do_scale: bool = Fa
 
 def load_artifacts(path: str or Path):
     p = Path(path)
+    from bundle import is_bundle, load_bundle
+    if is_bundle(p):
+        # a bundle dir only carries the compiled arrays, no sklearn objects to unpickle
+        b = load_bundle(p)
+        return {"imputer": None, "scaler": None, "feature_columns": list(b.feature_columns),
+                "compiled": b.compiled, "version": b.version}
     with open(p / "feature_columns.json", "r") as f:
         feature_columns = json.load(f)
     with open(p / "imputer.pkl", "rb") as f:
@@ -94,11 +116,15 @@ def load_artifacts(path: str or Path):
     if (p / "scaler.pkl").exists():
         with open(p / "scaler.pkl", "rb") as f:
             scaler = pickle.load(f)
-    return {"imputer": imputer, "scaler": scaler, "feature_columns": feature_columns}
+    artifacts = {"imputer": imputer, "scaler": scaler, "feature_columns": feature_columns}
+    artifacts["compiled"] = compile_artifacts(artifacts)
+    return artifacts
 
 def transform_df(df: pd.DataFrame, artifacts: Dict):
     feature_columns = artifacts["feature_columns"]
     df_sel = df.reindex(columns=feature_columns)
+    if artifacts.get("imputer") is None:
+        return transform_array(df_sel.to_numpy(dtype=float), artifacts["compiled"])
     df_sel = apply_calibration(df_sel)
     imputed = artifacts["imputer"].transform(df_sel.values)
     scaler = artifacts.get("scaler")
@@ -109,7 +135,89 @@ def transform_df(df: pd.DataFrame, artifacts: Dict):
     return transformed
 
 def transform_raw(raw: Dict, artifacts: Dict):
+    if artifacts.get("compiled") is not None:
+        return transform_fast(raw, artifacts["compiled"])
+    import pandas as pd
     mapped = _map_keys(raw)
     df = pd.DataFrame([mapped])
     arr = transform_df(df, artifacts)
     return arr
+
+def compile_artifacts(artifacts: Dict) -> Dict:
+    # flattens the fitted imputer/scaler into plain arrays so single readings skip pandas + sklearn
+    feature_columns = list(artifacts["feature_columns"])
+    n = len(feature_columns)
+    gain = np.array([CALIBRATION.get(c, (1.0, 0.0))[0] for c in feature_columns], dtype=float)
+    offset = np.array([CALIBRATION.get(c, (1.0, 0.0))[1] for c in feature_columns], dtype=float)
+    medians = np.asarray(artifacts["imputer"].statistics_, dtype=float)
+    # SimpleImputer drops columns that were all-NaN at fit time
+    keep = np.flatnonzero(~np.isnan(medians))
+    scaler = artifacts.get("scaler")
+    mean = scale = None
+    if scaler is not None:
+        mean = np.asarray(scaler.mean_, dtype=float) if scaler.with_mean else np.zeros(len(keep))
+        scale = np.asarray(scaler.scale_, dtype=float) if scaler.with_std else np.ones(len(keep))
+    index = {}
+    for i, c in enumerate(feature_columns):
+        index[c] = i
+    for alias, target in KEY_ALIASES.items():
+        if target in index and alias not in FEATURE_COLUMNS:
+            index[alias] = index[target]
+    return {
+        "feature_columns": feature_columns,
+        "index": index,
+        "n_features": n,
+        "gain": gain,
+        "offset": offset,
+        "medians": medians[keep],
+        "keep": keep,
+        "mean": mean,
+        "scale": scale,
+    }
+
+def _to_float(v) -> float:
+    if v is None:
+        return np.nan
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return np.nan
+
+def records_to_array(raws: List[Dict], compiled: Dict) -> np.ndarray:
+    index = compiled["index"]
+    X = np.full((len(raws), compiled["n_features"]), np.nan)
+    for row, raw in enumerate(raws):
+        for k, v in raw.items():
+            i = index.get(k)
+            if i is not None:
+                X[row, i] = _to_float(v)
+    return X
+
+def calibrate_array(X: np.ndarray, compiled: Dict, device_ids=None, table=None) -> np.ndarray:
+    if table is not None:
+        return table.apply(X, device_ids)
+    return X * compiled["gain"] + compiled["offset"]
+
+def impute_array(X: np.ndarray, compiled: Dict) -> np.ndarray:
+    keep = compiled["keep"]
+    if len(keep) != X.shape[1]:
+        X = X[:, keep]
+    X = np.where(np.isnan(X), compiled["medians"], X)
+    if compiled["scale"] is not None:
+        X -= compiled["mean"]
+        X /= compiled["scale"]
+    return X
+
+def transform_array(X: np.ndarray, compiled: Dict) -> np.ndarray:
+    return impute_array(calibrate_array(X, compiled), compiled)
+
+def transform_fast(raw, compiled: Dict) -> np.ndarray:
+    raws = [raw] if isinstance(raw, dict) else list(raw)
+    return transform_array(records_to_array(raws, compiled), compiled)
+
+def compiled_parity(df: pd.DataFrame, artifacts: Dict, compiled: Dict = None) -> bool:
+    compiled = compiled or compile_artifacts(artifacts)
+    expected = transform_df(df, artifacts)
+    cols = [c for c in compiled["feature_columns"] if c in df.columns]
+    got = transform_fast(df[cols].to_dict("records"), compiled)
+    return expected.shape == got.shape and np.array_equal(expected, got)
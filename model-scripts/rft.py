@@ -1,33 +1,238 @@
 #the big boy, trains RandomForest on preprocessed data and saves model and label encoder
 
 import os
+import argparse
+import csv
+import hashlib
+import json
+import time
 import joblib
 import numpy as np
 import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, StratifiedKFold, train_test_split
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 
-from preproc import fit_preprocessor, load_artifacts, transform_df
+from bundle import write_bundle
+from forest import (check_parity, compress_forest, forest_from_sklearn, load_forest, merge_forests, save_forest,
+                    select_trees)
+from preproc import FEATURE_COLUMNS, compiled_parity, fit_preprocessor, load_artifacts, transform_df
+from rolling import rolling_feature_names, rolling_offline
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except Exception:
+    pa = None
 
 CSV_PATH = os.path.join(os.path.dirname(__file__), "main_dataset.csv")
 ARTIFACT_DIR = os.environ.get("ARTIFACT_DIR", "./artifacts")
 RANDOM_STATE = 42
 TEST_SIZE = 0.2
+# read when present so rolling-window features can replay each device's readings in order
+ID_COLUMNS = ["device_id", "timestamp"]
+PARAM_GRID = {
+    "n_estimators": [100, 200, 400],
+    "max_depth": [None, 12, 20],
+    "min_samples_leaf": [1, 2, 5],
+    "max_features": ["sqrt", 0.5],
+}
+
+def _require_pyarrow(what):
+    if pa is None:
+        raise RuntimeError(f"pyarrow is required to read {what}")
+
+def write_arrow_cache(df: pd.DataFrame, path, label_col="Herb_Name"):
+    # float32 sensor columns + label in an uncompressed Arrow IPC file, which can be memory-mapped
+    _require_pyarrow("Arrow caches")
+    cols = {c: pa.array(df[c].to_numpy(dtype=np.float32)) for c in FEATURE_COLUMNS if c in df.columns}
+    if "device_id" in df.columns:
+        cols["device_id"] = pa.array([None if pd.isna(v) else str(v) for v in df["device_id"]], type=pa.string())
+    if "timestamp" in df.columns:
+        cols["timestamp"] = pa.array(pd.to_numeric(df["timestamp"], errors="coerce").to_numpy(dtype=np.float64))
+    cols[label_col] = pa.array(df[label_col].astype(str).tolist(), type=pa.string())
+    table = pa.table(cols)
+    tmp = str(path) + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp, path)
+
+# data_collector --compress writes .csv.gz / .csv.zst
+CSV_SUFFIXES = (".csv", ".csv.gz", ".csv.zst")
+
+def load_training_frame(path, label_col="Herb_Name", arrow_cache=False, with_ids=False) -> pd.DataFrame:
+    # only the sensor columns and the label are read (plus device_id/timestamp with_ids), whatever the source format
+    path = str(path)
+    wanted = [*FEATURE_COLUMNS, label_col, *(ID_COLUMNS if with_ids else [])]
+    csv_suffix = next((s for s in CSV_SUFFIXES if path.endswith(s)), None)
+    if csv_suffix is not None:
+        # pandas infers gzip/zstd from the suffix; the cache sits next to it as plain arrow
+        cache = path[:-len(csv_suffix)] + ".arrow"
+        if arrow_cache and os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(path):
+            return load_training_frame(cache, label_col, with_ids=with_ids)
+        # the cache always keeps the id columns, so it serves with_ids reads too
+        cols = wanted + [c for c in ID_COLUMNS if c not in wanted] if arrow_cache else wanted
+        df = pd.read_csv(path, usecols=lambda c: c in cols)
+        if arrow_cache and label_col in df.columns:
+            write_arrow_cache(df, cache, label_col)
+        return df[[c for c in df.columns if c in wanted]]
+    if path.endswith((".arrow", ".feather", ".ipc")):
+        _require_pyarrow(path)
+        with pa.memory_map(path, "r") as src:
+            table = pa.ipc.open_file(src).read_all()
+        return table.select([c for c in wanted if c in table.column_names]).to_pandas()
+    # parquet file or a date/device partitioned dataset directory written by data_collector --format parquet
+    _require_pyarrow(path)
+    dataset = ds.dataset(path, format="parquet", partitioning="hive")
+    columns = [c for c in wanted if c in dataset.schema.names]
+    files = dataset.files
+    if not files:
+        raise RuntimeError(f"No parquet files found under {path}")
+    if with_ids and "device_id" in columns:
+        # device_id is a hive partition column, only the dataset reader fills it in
+        return dataset.to_table(columns=columns).to_pandas()
+    table = pq.read_table(files if os.path.isdir(path) else path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+def build_features(df: pd.DataFrame, artifacts, rolling_window=0) -> np.ndarray:
+    X = transform_df(df[artifacts["feature_columns"]], artifacts)
+    if rolling_window:
+        ids = df["device_id"].tolist() if "device_id" in df.columns else [None] * len(df)
+        ts = pd.to_numeric(df["timestamp"], errors="coerce").to_numpy() if "timestamp" in df.columns else None
+        X = rolling_offline(ids, ts, X, rolling_window)
+    return X
+
+def _base_columns(artifacts):
+    # transform output order: feature_columns minus any the imputer dropped
+    cols = artifacts["feature_columns"]
+    return [cols[i] for i in artifacts["compiled"]["keep"]]
+
+def model_feature_names(artifacts, rolling_window=0):
+    if not rolling_window:
+        return artifacts["feature_columns"]
+    base = _base_columns(artifacts)
+    return base + rolling_feature_names(base, rolling_window)
+
+def _export(clf, path, labels, artifacts, rolling_window=0):
+    forest = forest_from_sklearn(clf, labels, model_feature_names(artifacts, rolling_window))
+    if rolling_window:
+        # inference reads this to rebuild the same rolling stage in front of the model
+        forest.meta["rolling"] = {"window": int(rolling_window), "columns": _base_columns(artifacts)}
+    return save_forest(forest, path)
+
+def _dataset_fingerprint(path) -> str:
+    # file content for single files; names, sizes and mtimes for dataset directories
+    h = hashlib.sha256()
+    path = str(path)
+    if os.path.isdir(path):
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                p = os.path.join(root, name)
+                st = os.stat(p)
+                h.update(f"{os.path.relpath(p, path)}:{st.st_size}:{st.st_mtime_ns}".encode())
+    else:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def _artifacts_fingerprint(artifacts) -> str:
+    c = artifacts["compiled"]
+    h = hashlib.sha256(json.dumps(c["feature_columns"]).encode())
+    for name in ("gain", "offset", "medians", "keep", "mean", "scale"):
+        if c[name] is not None:
+            h.update(np.ascontiguousarray(c[name]).tobytes())
+    return h.hexdigest()
+
+def cached_features(data_path, label_col, artifacts, cache_dir, arrow_cache=False, rolling_window=0):
+    # transformed X + raw labels, keyed on the dataset, the fitted preprocessing and the rolling window
+    key = hashlib.sha256(
+        f"{_dataset_fingerprint(data_path)}:{_artifacts_fingerprint(artifacts)}:{label_col}:{rolling_window}".encode()
+    ).hexdigest()[:24]
+    path = os.path.join(cache_dir, f"features-{key}.npz")
+    if os.path.exists(path):
+        with np.load(path, allow_pickle=False) as z:
+            return z["X"], z["y"], True
+    df = load_training_frame(data_path, label_col, arrow_cache, with_ids=bool(rolling_window))
+    if label_col not in df.columns:
+        raise RuntimeError(f"Expected label column '{label_col}' in {data_path}")
+    df = df[df[label_col].notna()]
+    X = build_features(df, artifacts, rolling_window)
+    y = df[label_col].astype(str).to_numpy(dtype=str)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, X=X, y=y)
+    os.replace(tmp, path)
+    return X, y, False
+
+def search(data_path=CSV_PATH, label_col="Herb_Name", mode="grid", folds=5, n_iter=20, jobs=-1, arrow_cache=False,
+           rolling_window=0):
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    if not os.path.exists(os.path.join(ARTIFACT_DIR, "imputer.pkl")):
+        df = load_training_frame(data_path, label_col, arrow_cache)
+        fit_preprocessor(df, ARTIFACT_DIR, do_scale=False)
+    artifacts = load_artifacts(ARTIFACT_DIR)
+
+    t0 = time.perf_counter()
+    X, y_raw, hit = cached_features(data_path, label_col, artifacts, os.path.join(ARTIFACT_DIR, "cache"), arrow_cache,
+                                    rolling_window)
+    print(f"Features: {X.shape} ({'cache hit' if hit else 'computed and cached'}, {time.perf_counter() - t0:.2f}s)")
+    y = LabelEncoder().fit_transform(y_raw)
+
+    # parallelism lives in the search (one process per fit), so each forest stays single-threaded
+    base = RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=1)
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=RANDOM_STATE)
+    if mode == "random":
+        searcher = RandomizedSearchCV(base, PARAM_GRID, n_iter=n_iter, cv=cv, n_jobs=jobs,
+                                      scoring="accuracy", random_state=RANDOM_STATE, refit=False)
+    else:
+        searcher = GridSearchCV(base, PARAM_GRID, cv=cv, n_jobs=jobs, scoring="accuracy", refit=False)
+    t0 = time.perf_counter()
+    searcher.fit(X, y)
+    elapsed = time.perf_counter() - t0
+
+    res = searcher.cv_results_
+    order = np.argsort(res["rank_test_score"], kind="stable")
+    board_path = os.path.join(ARTIFACT_DIR, "search_leaderboard.csv")
+    with open(board_path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["rank", "mean_accuracy", "std_accuracy", "mean_fit_s", "mean_score_s", "params"])
+        for i in order:
+            w.writerow([int(res["rank_test_score"][i]), f"{res['mean_test_score'][i]:.4f}",
+                        f"{res['std_test_score'][i]:.4f}", f"{res['mean_fit_time'][i]:.3f}",
+                        f"{res['mean_score_time'][i]:.3f}", json.dumps(res["params"][i])])
+    best = res["params"][order[0]]
+    best_path = os.path.join(ARTIFACT_DIR, "search_best_params.json")
+    with open(best_path, "w") as f:
+        json.dump(best, f, indent=2)
 
-def train():
+    print(f"{len(order)} candidates x {folds} folds in {elapsed:.1f}s")
+    for i in order[:5]:
+        print(f"  {res['mean_test_score'][i]:.4f} +/- {res['std_test_score'][i]:.4f}  "
+              f"fit {res['mean_fit_time'][i]:.2f}s  {res['params'][i]}")
+    print(f"Saved: {board_path}")
+    print(f"Saved: {best_path}")
+    return best
+
+def train(data_path=CSV_PATH, label_col="Herb_Name", arrow_cache=False, rf_params=None, rolling_window=0):
     os.makedirs(ARTIFACT_DIR, exist_ok=True)
-    df = pd.read_csv(CSV_PATH)
+    df = load_training_frame(data_path, label_col, arrow_cache, with_ids=bool(rolling_window))
 
-    if "Herb_Name" not in df.columns:
-        raise RuntimeError("Expected label column 'Herb_Name' in CSV")
+    if label_col not in df.columns:
+        raise RuntimeError(f"Expected label column '{label_col}' in {data_path}")
+    df = df[df[label_col].notna()]
 
     fit_preprocessor(df, ARTIFACT_DIR, do_scale=False)
     artifacts = load_artifacts(ARTIFACT_DIR)
 
-    X = transform_df(df[artifacts["feature_columns"]], artifacts)
-    y_raw = df["Herb_Name"].astype(str)
+    X = build_features(df, artifacts, rolling_window)
+    if not compiled_parity(df[artifacts["feature_columns"]], artifacts, artifacts["compiled"]):
+        raise RuntimeError("Compiled preprocessing does not match transform_df")
+    y_raw = df[label_col].astype(str)
     le = LabelEncoder()
     y = le.fit_transform(y_raw)
 
@@ -35,7 +240,8 @@ def train():
         X, y, test_size=TEST_SIZE, random_state=RANDOM_STATE, stratify=y
     )
 
-    clf = RandomForestClassifier(n_estimators=200, random_state=RANDOM_STATE)
+    params = {"n_estimators": 200, **(rf_params or {})}
+    clf = RandomForestClassifier(random_state=RANDOM_STATE, n_jobs=-1, **params)
     clf.fit(X_train, y_train)
 
     y_pred_train = clf.predict(X_train)
@@ -50,7 +256,7 @@ def train():
     print("Confusion matrix (rows=true, cols=pred):")
     print(cm)
 
-    feat_names = artifacts["feature_columns"]
+    feat_names = model_feature_names(artifacts, rolling_window)
     importances = clf.feature_importances_
     pairs = sorted(zip(feat_names, importances), key=lambda x: x[1], reverse=True)
     print("Feature importances:")
@@ -61,9 +267,230 @@ def train():
     le_path = os.path.join(ARTIFACT_DIR, "label_encoder.pkl")
     joblib.dump(clf, model_path)
     joblib.dump(le, le_path)
+    # a fresh fit resets the code order that --update appended to
+    if os.path.exists(os.path.join(ARTIFACT_DIR, "labels.json")):
+        os.remove(os.path.join(ARTIFACT_DIR, "labels.json"))
+    forest_path = _export(clf, os.path.join(ARTIFACT_DIR, "rft_herb_model.npz"), le.classes_, artifacts, rolling_window)
+    forest = load_forest(forest_path)
+    diff = check_parity(clf, forest, X_test)
+    bundle_path = os.path.join(ARTIFACT_DIR, "bundle")
+    manifest = write_bundle(bundle_path, artifacts["compiled"], forest)
     print(f"\nSaved: {model_path}")
     print(f"Saved: {le_path}")
+    print(f"Saved: {forest_path} (max proba diff vs sklearn: {diff:.3g})")
+    print(f"Saved: {bundle_path} (version {manifest['version']})")
 
-if __name__ == "__main__":
-    train()
+def _holdout_split(X, y, test_size=TEST_SIZE):
+    try:
+        return train_test_split(X, y, test_size=test_size, random_state=RANDOM_STATE, stratify=y)
+    except ValueError:
+        # a brand-new class with a single row cannot be stratified
+        return train_test_split(X, y, test_size=test_size, random_state=RANDOM_STATE)
+
+def _load_labels(le_path):
+    # labels.json keeps codes in append order; label_encoder.pkl is only the original sorted fit
+    labels_path = os.path.join(ARTIFACT_DIR, "labels.json")
+    if os.path.exists(labels_path):
+        with open(labels_path) as f:
+            return json.load(f)
+    return [str(x) for x in joblib.load(le_path).classes_]
+
+def update(new_paths, label_col="Herb_Name", extra_trees=50, max_age=0, max_trees=0, compare_data=None,
+           holdout=TEST_SIZE):
+    # grows the exported array forest with trees fitted on new rows only; preprocessing stays as fitted
+    # a `holdout` share of the new rows is never fitted, it only scores the forest before/after the update
+    artifacts = load_artifacts(ARTIFACT_DIR)
+    forest_path = os.path.join(ARTIFACT_DIR, "rft_herb_model.npz")
+    le_path = os.path.join(ARTIFACT_DIR, "label_encoder.pkl")
+    base = load_forest(forest_path)
+    labels = list(base.labels) if base.labels else _load_labels(le_path)
+    # new trees must see the same rolling features the base forest was trained on
+    rolling_window = (base.meta.get("rolling") or {}).get("window", 0)
+    feat_names = model_feature_names(artifacts, rolling_window)
+
+    df = pd.concat([load_training_frame(p, label_col, with_ids=bool(rolling_window)) for p in new_paths],
+                   ignore_index=True)
+    if label_col not in df.columns:
+        raise RuntimeError(f"Expected label column '{label_col}' in {new_paths}")
+    df = df[df[label_col].notna()]
+    X = build_features(df, artifacts, rolling_window)
+    y_raw = df[label_col].astype(str)
+    # new herbs are appended, existing codes never move, so old trees keep meaning the same thing
+    for lbl in sorted(set(y_raw) - set(labels)):
+        labels.append(lbl)
+    code = {lbl: i for i, lbl in enumerate(labels)}
+    y = y_raw.map(code).to_numpy()
+    if holdout > 0:
+        X_fit, X_hold, y_fit, y_hold = _holdout_split(X, y, holdout)
+    else:
+        X_fit, y_fit, X_hold, y_hold = X, y, X[:0], y[:0]
+
+    generation = int(base.meta.get("generation", 0)) + 1
+    t0 = time.perf_counter()
+    rf = RandomForestClassifier(n_estimators=extra_trees, random_state=RANDOM_STATE + generation, n_jobs=-1)
+    rf.fit(X_fit, y_fit)
+    merged = merge_forests(base, forest_from_sklearn(rf, labels, feat_names, generation), labels)
+    keep = [t for t in range(len(merged.roots))
+            if not max_age or generation - merged.tree_generation[t] < max_age]
+    if max_trees and len(keep) > max_trees:
+        newest = sorted(keep, key=lambda t: merged.tree_generation[t], reverse=True)[:max_trees]
+        keep = sorted(newest)
+    if len(keep) < len(merged.roots):
+        merged = select_trees(merged, keep)
+    update_s = time.perf_counter() - t0
+
+    report = {"generation": generation, "new_rows": int(len(y)), "new_classes": labels[len(base.labels or []):],
+              "fitted_rows": int(len(y_fit)), "holdout_rows": int(len(y_hold)),
+              "trees": int(len(merged.roots)), "update_s": round(update_s, 3)}
+    if len(y_hold):
+        report["holdout_acc_before"] = round(accuracy_score(y_hold, base.predict(X_hold)), 4)
+        report["holdout_acc_after"] = round(accuracy_score(y_hold, merged.predict(X_hold)), 4)
 
+    if compare_data:
+        hist = load_training_frame(compare_data, label_col, with_ids=bool(rolling_window))
+        hist = hist[hist[label_col].notna()]
+        for lbl in sorted(set(hist[label_col].astype(str)) - set(labels)):
+            labels.append(lbl)
+            code[lbl] = len(labels) - 1
+        X_all = np.vstack([build_features(hist, artifacts, rolling_window), X_fit])
+        y_all = np.concatenate([hist[label_col].astype(str).map(code).to_numpy(), y_fit])
+        t0 = time.perf_counter()
+        full = RandomForestClassifier(n_estimators=int(len(merged.roots)), random_state=RANDOM_STATE, n_jobs=-1)
+        full.fit(X_all, y_all)
+        report["full_retrain_s"] = round(time.perf_counter() - t0, 3)
+        if len(y_hold):
+            report["full_retrain_holdout_acc"] = round(accuracy_score(y_hold, full.predict(X_hold)), 4)
+
+    save_forest(merged, forest_path)
+    manifest = write_bundle(os.path.join(ARTIFACT_DIR, "bundle"), artifacts["compiled"], merged)
+    report["version"] = manifest["version"]
+    # appended herbs break LabelEncoder's sorted-classes invariant, so the code order lives in labels.json
+    labels_path = os.path.join(ARTIFACT_DIR, "labels.json")
+    with open(labels_path + ".tmp", "w") as f:
+        json.dump(labels, f)
+    os.replace(labels_path + ".tmp", labels_path)
+    with open(os.path.join(ARTIFACT_DIR, "update_log.jsonl"), "a") as f:
+        f.write(json.dumps(report) + "\n")
+    print(json.dumps(report, indent=2))
+    print(f"Saved: {forest_path} (rft_herb_model.pkl is not updated, inference prefers the bundle)")
+    print(f"Saved: {labels_path} ({le_path} keeps the original classes)")
+    return report
+
+def _model_profile(forest, path, X, y, ref_pred, latency_rows=200):
+    pred = forest.predict(X)
+    single = []
+    for i in range(min(latency_rows, len(X))):
+        t0 = time.perf_counter()
+        forest.predict_proba(X[i:i + 1])
+        single.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    forest.predict_proba(X)
+    batch_s = time.perf_counter() - t0
+    return {"trees": int(len(forest.roots)), "nodes": int(len(forest.feature)), "max_depth": forest.max_depth,
+            "array_bytes": int(forest.nbytes()), "file_bytes": os.path.getsize(path),
+            "accuracy": round(accuracy_score(y, pred), 4), "agreement": round(float((pred == ref_pred).mean()), 4),
+            "p50_single_us": round(float(np.median(single)) * 1e6, 1),
+            "batch_rows_per_s": round(len(X) / batch_s) if batch_s else None}
+
+def compress(data_path=CSV_PATH, label_col="Herb_Name", n_trees=50, max_depth=0, prune_tol=0.0, quantized=False,
+             arrow_cache=False, name="edge"):
+    # smaller forest for the Pi: scored on the same held-out split train() used, trees are picked on one
+    # half of it and every number in the report comes from the other half
+    artifacts = load_artifacts(ARTIFACT_DIR)
+    forest_path = os.path.join(ARTIFACT_DIR, "rft_herb_model.npz")
+    base = load_forest(forest_path)
+    labels = list(base.labels) if base.labels else _load_labels(os.path.join(ARTIFACT_DIR, "label_encoder.pkl"))
+    rolling_window = (base.meta.get("rolling") or {}).get("window", 0)
+
+    df = load_training_frame(data_path, label_col, arrow_cache, with_ids=bool(rolling_window))
+    if label_col not in df.columns:
+        raise RuntimeError(f"Expected label column '{label_col}' in {data_path}")
+    df = df[df[label_col].notna()]
+    X = build_features(df, artifacts, rolling_window)
+    code = {lbl: i for i, lbl in enumerate(labels)}
+    y = df[label_col].astype(str).map(code)
+    known = y.notna().to_numpy()
+    X, y = X[known], y[known].to_numpy(dtype=np.int64)
+    _, X_hold, _, y_hold = _holdout_split(X, y)
+    if n_trees and n_trees < len(base.roots):
+        try:
+            X_sel, X_rep, y_sel, y_rep = train_test_split(X_hold, y_hold, test_size=0.5, random_state=RANDOM_STATE,
+                                                          stratify=y_hold)
+        except ValueError:
+            X_sel, X_rep, y_sel, y_rep = train_test_split(X_hold, y_hold, test_size=0.5, random_state=RANDOM_STATE)
+    else:
+        X_sel = y_sel = None
+        X_rep, y_rep = X_hold, y_hold
+
+    t0 = time.perf_counter()
+    small = compress_forest(base, X_sel, y_sel, n_trees, max_depth, prune_tol, quantized)
+    compress_s = time.perf_counter() - t0
+    small_path = save_forest(small, os.path.join(ARTIFACT_DIR, f"rft_herb_model_{name}.npz"))
+    bundle_path = os.path.join(ARTIFACT_DIR, f"bundle_{name}")
+    manifest = write_bundle(bundle_path, artifacts["compiled"], load_forest(small_path))
+
+    ref_pred = base.predict(X_rep)
+    report = {"settings": small.meta["compression"], "report_rows": int(len(y_rep)), "compress_s": round(compress_s, 3),
+              "original": _model_profile(base, forest_path, X_rep, y_rep, ref_pred),
+              "compressed": _model_profile(load_forest(small_path), small_path, X_rep, y_rep, ref_pred),
+              "version": manifest["version"]}
+    o, c = report["original"], report["compressed"]
+    print(f"{'':>18s} {'original':>12s} {'compressed':>12s}")
+    for k in ("trees", "nodes", "max_depth", "array_bytes", "file_bytes", "accuracy", "agreement", "p50_single_us",
+              "batch_rows_per_s"):
+        print(f"{k:>18s} {o[k]!s:>12s} {c[k]!s:>12s}")
+    report_path = os.path.join(ARTIFACT_DIR, f"compress_{name}_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    # the npz is served with feature_columns.json/imputer.pkl from the same directory, the bundle is self-contained
+    print(f"Saved: {small_path} (needs the preprocessing artifacts in {ARTIFACT_DIR})")
+    print(f"Saved: {bundle_path} (version {manifest['version']}, load with inference.py --model {bundle_path})")
+    print(f"Saved: {report_path}")
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=CSV_PATH, help="CSV, Arrow IPC file, parquet file or parquet dataset dir")
+    parser.add_argument("--label-col", default="Herb_Name")
+    parser.add_argument("--arrow-cache", action="store_true",
+                        help="for CSV input, keep a memory-mappable .arrow copy next to it and reuse it")
+    parser.add_argument("--search", choices=["grid", "random"],
+                        help="cross-validated hyperparameter search instead of training")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--n-iter", type=int, default=20, help="candidates for --search random")
+    parser.add_argument("--jobs", type=int, default=-1, help="search worker processes (-1 = all cores)")
+    parser.add_argument("--params", help="JSON file of forest params for training, e.g. search_best_params.json")
+    parser.add_argument("--update", nargs="+", metavar="NEW_DATA",
+                        help="grow the exported forest with trees fitted on these new files/datasets only")
+    parser.add_argument("--extra-trees", type=int, default=50, help="trees added per --update")
+    parser.add_argument("--max-age", type=int, default=0, help="retire trees older than this many updates (0 = never)")
+    parser.add_argument("--max-trees", type=int, default=0, help="keep at most this many (newest) trees (0 = no cap)")
+    parser.add_argument("--holdout", type=float, default=TEST_SIZE,
+                        help="--update: share of the new rows kept out of fitting to score the update (0 = fit all)")
+    parser.add_argument("--rolling-window", type=int, default=0,
+                        help="add per-device rolling mean/var/slope over this many readings as features (0 = off)")
+    parser.add_argument("--compare-full", action="store_true",
+                        help="also time a full retrain on --data plus the new rows and report its accuracy")
+    parser.add_argument("--compress", action="store_true",
+                        help="write a smaller copy of the exported forest for edge devices and report the trade-off")
+    parser.add_argument("--keep-trees", type=int, default=50, help="--compress: trees kept by greedy selection (0 = all)")
+    parser.add_argument("--max-depth", type=int, default=0, help="--compress: cut trees at this depth (0 = no limit)")
+    parser.add_argument("--prune-tol", type=float, default=0.0,
+                        help="--compress: remove splits whose leaves move no class probability by more than this")
+    parser.add_argument("--quantize", action="store_true", help="--compress: float32 thresholds, uint16 leaf values")
+    args = parser.parse_args()
+    if args.compress:
+        compress(args.data, args.label_col, args.keep_trees, args.max_depth, args.prune_tol, args.quantize,
+                 args.arrow_cache)
+    elif args.update:
+        update(args.update, args.label_col, args.extra_trees, args.max_age, args.max_trees,
+               args.data if args.compare_full else None, args.holdout)
+    elif args.search:
+        search(args.data, args.label_col, args.search, args.folds, args.n_iter, args.jobs, args.arrow_cache,
+               args.rolling_window)
+    else:
+        rf_params = None
+        if args.params:
+            with open(args.params) as f:
+                rf_params = json.load(f)
+        train(args.data, args.label_col, args.arrow_cache, rf_params, args.rolling_window)
@@ -0,0 +1,141 @@
+#per-device rolling-window features: mean, variance and slope of each preprocessed sensor column
+#over the last `window` readings of the same device_id, appended after the base features
+#inference (online, one reading at a time) and rft.py (offline, whole frames) both go through
+#RollingFeatures.update in arrival order, so the same stream always gives bit-identical features
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+
+ROLLING_STATS = ("mean", "var", "slope")
+DEFAULT_MAX_DEVICES = 10000
+
+def rolling_feature_names(columns: Sequence[str], window: int) -> List[str]:
+    return [f"{c}_{stat}{window}" for stat in ROLLING_STATS for c in columns]
+
+def _device_key(v: Any) -> Any:
+    if v is None or (isinstance(v, float) and np.isnan(v)):
+        return None
+    return str(v)
+
+class _DeviceWindow:
+    # ring buffer plus running sums; t is the reading index inside the window, 0 = oldest
+    __slots__ = ("buf", "n", "head", "s", "q", "tx")
+
+    def __init__(self, window: int, k: int):
+        self.buf = np.zeros((window, k))
+        self.n = 0
+        self.head = 0
+        self.s = np.zeros(k)
+        self.q = np.zeros(k)
+        self.tx = np.zeros(k)
+
+    def push(self, x: np.ndarray):
+        w = len(self.buf)
+        if self.n < w:
+            self.s += x
+            self.q += x * x
+            self.tx += self.n * x
+            self.n += 1
+        else:
+            old = self.buf[self.head]
+            # dropping t=0 shifts every other reading down by one: tx -= (s - old)
+            self.tx -= self.s - old
+            self.s += x - old
+            self.q += x * x - old * old
+            self.tx += (w - 1) * x
+        self.buf[self.head] = x
+        self.head = (self.head + 1) % w
+        if self.head == 0 and self.n == w:
+            self._resum()
+
+    def _resum(self):
+        # exact recompute once per lap keeps add/subtract rounding from drifting on long streams
+        self.s = self.buf.sum(axis=0)
+        self.q = (self.buf * self.buf).sum(axis=0)
+        self.tx = np.arange(len(self.buf)) @ self.buf
+
+    def stats(self, out: np.ndarray):
+        n = self.n
+        k = len(self.s)
+        mean = self.s / n
+        out[:k] = mean
+        out[k:2 * k] = np.maximum(self.q / n - mean * mean, 0.0)
+        if n > 1:
+            st = n * (n - 1) / 2.0
+            st2 = (n - 1) * n * (2 * n - 1) / 6.0
+            out[2 * k:] = (n * self.tx - st * self.s) / (n * st2 - st * st)
+        else:
+            out[2 * k:] = 0.0
+
+class RollingFeatures:
+    def __init__(self, n_features: int, window: int = 16, max_devices: int = DEFAULT_MAX_DEVICES):
+        if window < 1:
+            raise ValueError("window must be >= 1")
+        self.k = int(n_features)
+        self.window = int(window)
+        self.max_devices = max(1, int(max_devices))
+        self._devices: "OrderedDict[Any, _DeviceWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @property
+    def n_outputs(self) -> int:
+        return len(ROLLING_STATS) * self.k
+
+    def update(self, device_id: Any, x: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+        # feeds one preprocessed reading and returns [mean..., var..., slope...] including it
+        out = np.empty(self.n_outputs) if out is None else out
+        device_id = _device_key(device_id)
+        if device_id is None:
+            # no stream to attach to: a window of just this reading
+            out[:self.k] = x
+            out[self.k:] = 0.0
+            return out
+        with self._lock:
+            dev = self._devices.get(device_id)
+            if dev is None:
+                dev = self._devices[device_id] = _DeviceWindow(self.window, self.k)
+                if len(self._devices) > self.max_devices:
+                    # idle devices fall off the LRU end and start from an empty window if they return
+                    self._devices.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._devices.move_to_end(device_id)
+            dev.push(x)
+            dev.stats(out)
+        return out
+
+    def transform(self, device_ids: Sequence[Any], X: np.ndarray) -> np.ndarray:
+        # rows are applied in order, so a batch is the same as feeding its readings one by one
+        X = np.asarray(X, dtype=float)
+        R = np.empty((len(X), self.n_outputs))
+        for i, dev in enumerate(device_ids):
+            self.update(dev, X[i], R[i])
+        return np.hstack([X, R])
+
+    def __len__(self) -> int:
+        return len(self._devices)
+
+    def stats(self) -> Dict[str, int]:
+        return {"devices": len(self._devices), "evictions": self.evictions}
+
+def rolling_offline(device_ids: Sequence[Any], timestamps: Optional[Sequence[Any]], X: np.ndarray,
+                    window: int) -> np.ndarray:
+    # replays each device's rows in timestamp order (file order when there are no timestamps) and
+    # returns [X, rolling features] in the original row order
+    X = np.asarray(X, dtype=float)
+    keys = [_device_key(v) for v in device_ids]
+    order = np.arange(len(X))
+    if timestamps is not None:
+        ts = np.asarray(timestamps, dtype=float)
+        order = order[np.argsort(np.nan_to_num(ts, nan=np.inf), kind="stable")]
+    # rows of one device stay contiguous after this sort, so only one window is ever live
+    rank = {k: i for i, k in enumerate(sorted({k for k in keys if k is not None}))}
+    order = order[np.argsort([rank.get(keys[i], -1) for i in order], kind="stable")]
+    rf = RollingFeatures(X.shape[1], window, max_devices=1)
+    R = np.empty((len(X), rf.n_outputs))
+    for i in order:
+        rf.update(keys[i], X[i], R[i])
+    return np.hstack([X, R])
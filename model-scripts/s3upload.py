@@ -0,0 +1,206 @@
+#S3 uploads that start while the file is still being written
+#a MultipartUpload is a write-only byte sink: every full part goes to a shared thread pool right away,
+#so scanning, compressing and uploading overlap; the object only appears once the upload is completed
+#endpoint_url points the client at a local S3 stand-in (minio, moto server, localstack) for testing
+
+import gzip
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Dict, List, Optional
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+COMPRESSION_SUFFIX = {None: "", "none": "", "gzip": ".gz", "zstd": ".zst"}
+
+def compressed_writer(sink: BinaryIO, compression: Optional[str], level: Optional[int] = None):
+    # returns a binary writer whose close() finishes the stream but leaves `sink` open
+    if compression in (None, "none"):
+        return _Unclosable(sink)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=sink, mode="wb", compresslevel=6 if level is None else level, mtime=0)
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required for zstd compression (pip install zstandard)")
+        cctx = zstandard.ZstdCompressor(level=3 if level is None else level)
+        return cctx.stream_writer(sink, closefd=False)
+    raise ValueError(f"unknown compression {compression!r}")
+
+class _Unclosable:
+    def __init__(self, sink: BinaryIO):
+        self._sink = sink
+        self.closed = False
+
+    def write(self, b) -> int:
+        return self._sink.write(b)
+
+    def writable(self) -> bool:
+        return True
+
+    def readable(self) -> bool:
+        return False
+
+    def seekable(self) -> bool:
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+class TeeWriter:
+    # the local copy and the upload see the same bytes
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, b) -> int:
+        for s in self.sinks:
+            s.write(b)
+        return len(b)
+
+    def flush(self):
+        for s in self.sinks:
+            if hasattr(s, "flush"):
+                s.flush()
+
+class S3Uploader:
+    def __init__(self, bucket: str, prefix: str = "", region: Optional[str] = None, endpoint_url: Optional[str] = None,
+                 part_size: int = DEFAULT_PART_SIZE, concurrency: int = 4, client=None):
+        if client is None:
+            import boto3
+            client = boto3.session.Session().client("s3", region_name=region, endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.part_size = int(part_size)
+        self.concurrency = max(1, int(concurrency))
+        self._pool = ThreadPoolExecutor(self.concurrency, thread_name_prefix="s3-part")
+        # parts read but not yet acknowledged, across all open uploads; writers block past this
+        self._slots = threading.BoundedSemaphore(self.concurrency * 2)
+        self.counters = {"objects": 0, "parts": 0, "bytes": 0}
+        # parts finish on pool threads, counters are bumped under this
+        self._lock = threading.Lock()
+
+    def key_for(self, rel: str) -> str:
+        return f"{self.prefix}/{rel}" if self.prefix else rel
+
+    def open(self, key: str) -> "MultipartUpload":
+        return MultipartUpload(self, key)
+
+    def upload_file(self, path, key: str):
+        up = self.open(key)
+        try:
+            with open(path, "rb") as f:
+                while True:
+                    b = f.read(self.part_size)
+                    if not b:
+                        break
+                    up.write(b)
+        except BaseException:
+            up.abort()
+            raise
+        up.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counters)
+
+class MultipartUpload:
+    def __init__(self, uploader: S3Uploader, key: str):
+        self.u = uploader
+        self.key = key
+        self.upload_id: Optional[str] = None
+        self.bytes = 0
+        self.closed = False
+        self._buf = bytearray()
+        self._parts: List[Any] = []
+
+    def write(self, b) -> int:
+        self._buf += b
+        self.bytes += len(b)
+        ps = self.u.part_size
+        while len(self._buf) >= ps:
+            self._submit(bytes(self._buf[:ps]))
+            del self._buf[:ps]
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def _submit(self, data: bytes):
+        u = self.u
+        if self.upload_id is None:
+            self.upload_id = u.client.create_multipart_upload(Bucket=u.bucket, Key=self.key)["UploadId"]
+        for fut in self._parts:
+            # a failed part fails the export now instead of after the whole scan
+            if fut.done() and fut.exception() is not None:
+                raise fut.exception()
+        u._slots.acquire()
+        try:
+            self._parts.append(u._pool.submit(self._put_part, len(self._parts) + 1, data))
+        except BaseException:
+            u._slots.release()
+            raise
+
+    def _put_part(self, number: int, data: bytes) -> Dict[str, Any]:
+        u = self.u
+        try:
+            r = u.client.upload_part(Bucket=u.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=data)
+        finally:
+            u._slots.release()
+        with u._lock:
+            u.counters["parts"] += 1
+        return {"PartNumber": number, "ETag": r["ETag"]}
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        u = self.u
+        if self.upload_id is None:
+            # smaller than one part: a plain PUT, multipart needs at least one part anyway
+            u.client.put_object(Bucket=u.bucket, Key=self.key, Body=bytes(self._buf))
+        else:
+            try:
+                if self._buf:
+                    self._submit(bytes(self._buf))
+                parts = [f.result() for f in self._parts]
+                u.client.complete_multipart_upload(Bucket=u.bucket, Key=self.key, UploadId=self.upload_id,
+                                                   MultipartUpload={"Parts": parts})
+            except BaseException:
+                self._abort()
+                raise
+        self._buf = bytearray()
+        with u._lock:
+            u.counters["objects"] += 1
+            u.counters["bytes"] += self.bytes
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._abort()
+
+    def _abort(self):
+        for f in self._parts:
+            f.cancel()
+        for f in self._parts:
+            if not f.cancelled():
+                try:
+                    f.result()
+                except Exception:
+                    pass
+        self._buf = bytearray()
+        if self.upload_id is not None:
+            try:
+                self.u.client.abort_multipart_upload(Bucket=self.u.bucket, Key=self.key, UploadId=self.upload_id)
+            except Exception:
+                pass
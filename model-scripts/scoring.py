@@ -0,0 +1,147 @@
+#chunked CSV scoring for exports too big for predict_csv
+#the parent only parses chunks and writes results in input order; worker processes load the
+#artifacts once and return ready-to-write NDJSON/CSV text, so memory stays at ~2 chunks per worker
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import inference
+
+OUTPUT_FIELDS = ["row", "device_id", "prediction", "confidence", "model_version"]
+
+# (model, label_encoder, feature_columns) of this process
+_artifacts = None
+
+def _init_worker(model_path, le_path, meta_path, calibration=None):
+    global _artifacts
+    if calibration:
+        inference.enable_calibration(calibration)
+    _artifacts = inference.load_artifacts(model_path, le_path, meta_path)
+
+def _score_chunk(first_row: int, chunk, fmt: str):
+    model, label_encoder, feature_columns = _artifacts
+    records = chunk.to_dict("records")
+    results = inference.predict_batch(model, label_encoder, feature_columns, records)
+    buf = io.StringIO()
+    if fmt == "csv":
+        w = csv.writer(buf)
+        for i, (raw, res) in enumerate(zip(records, results)):
+            w.writerow([first_row + i, _device_id(raw), res["prediction"], res["confidence"], res.get("model_version")])
+    else:
+        for i, (raw, res) in enumerate(zip(records, results)):
+            out = {"row": first_row + i, **res}
+            dev = _device_id(raw)
+            if dev is not None:
+                out["device_id"] = dev
+            buf.write(json.dumps(out))
+            buf.write("\n")
+    return len(records), buf.getvalue()
+
+def _device_id(raw):
+    dev = raw.get("device_id")
+    # pandas fills missing cells with NaN
+    return None if dev is None or dev != dev else dev
+
+def _wanted_columns(feature_columns):
+    # everything the preprocessing can map to a feature, plus device_id; other export columns are never parsed
+    from preproc import FEATURE_COLUMNS, KEY_ALIASES
+    cols = set(FEATURE_COLUMNS).union(feature_columns or [])
+    cols.update(k for k, v in KEY_ALIASES.items() if v in cols)
+    cols.add("device_id")
+    return cols
+
+def score_csv(csv_path, model_path, le_path=inference.LE_PATH, meta_path=inference.META_PATH, out_path=None,
+              fmt: str = "ndjson", chunk_rows: int = 20000, processes: Optional[int] = None, calibration=None,
+              progress_s: float = 5.0) -> int:
+    import pandas as pd
+    if calibration:
+        inference.enable_calibration(calibration)
+    model, label_encoder, feature_columns = inference.load_artifacts(model_path, le_path, meta_path)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if inference.rolling_stage is not None and processes > 1:
+        # rolling windows need every device's rows in file order through one process
+        print("Model uses rolling-window features, scoring with a single process", file=sys.stderr)
+        processes = 1
+    wanted = _wanted_columns(feature_columns)
+    reader = pd.read_csv(csv_path, chunksize=chunk_rows, usecols=lambda c: c in wanted)
+
+    if processes > 0:
+        pool = ProcessPoolExecutor(processes, initializer=_init_worker,
+                                   initargs=(model_path, le_path, meta_path, calibration))
+        submit = pool.submit
+    else:
+        global _artifacts
+        pool = None
+        _artifacts = (model, label_encoder, feature_columns)
+
+        class _Done:
+            def __init__(self, value):
+                self.value = value
+
+            def result(self):
+                return self.value
+
+            def done(self):
+                return True
+
+        def submit(fn, *a):
+            return _Done(fn(*a))
+
+    tmp = None
+    if out_path:
+        tmp = f"{out_path}.tmp"
+        sink = open(tmp, "w", newline="", encoding="utf-8")
+    else:
+        sink = sys.stdout
+    if fmt == "csv":
+        csv.writer(sink).writerow(OUTPUT_FIELDS)
+
+    max_inflight = max(2, processes * 2)
+    pending: deque = deque()
+    rows = 0
+    t0 = time.perf_counter()
+    next_report = t0 + progress_s
+
+    def write_head():
+        nonlocal rows, next_report
+        n, text = pending.popleft().result()
+        sink.write(text)
+        rows += n
+        now = time.perf_counter()
+        if progress_s and now >= next_report:
+            print(f"{rows} rows, {rows / (now - t0):.0f} rows/s", file=sys.stderr)
+            next_report = now + progress_s
+
+    ok = False
+    try:
+        submitted = 0
+        for chunk in reader:
+            pending.append(submit(_score_chunk, submitted, chunk, fmt))
+            submitted += len(chunk)
+            # results go out strictly in submission order, finished chunks behind a slow one wait
+            while pending and (len(pending) >= max_inflight or pending[0].done()):
+                write_head()
+        while pending:
+            write_head()
+        ok = True
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if tmp is not None:
+            sink.close()
+            if not ok:
+                os.remove(tmp)
+    if tmp is not None:
+        os.replace(tmp, out_path)
+    elapsed = time.perf_counter() - t0
+    print(f"Scored {rows} rows in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s, "
+          f"{max(processes, 1)} process{'es' if processes > 1 else ''})", file=sys.stderr)
+    return rows
@@ -0,0 +1,237 @@
+#local HTTP stand-in for the API Gateway /v1/predict endpoint, for on-prem sites without cloud access
+#asyncio keeps the connections (HTTP/1.1 keep-alive), MicroBatcher worker threads run the model so
+#concurrent requests share one predict_batch call and the event loop never blocks on numpy
+
+import asyncio
+import json
+import signal
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from batching import MicroBatcher
+from metrics import NULL_STAGE
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+MAX_RECORDS_PER_REQUEST = 1000
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 408: "Request Timeout",
+           411: "Length Required", 413: "Payload Too Large", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable", 504: "Gateway Timeout"}
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def request_record(obj: Any) -> Dict:
+    # the firmware nests readings under sensor_readings (as an object or a JSON string) next to device_id
+    if not isinstance(obj, dict):
+        raise HttpError(400, "expected a JSON object")
+    readings = obj.get("sensor_readings")
+    if isinstance(readings, str):
+        try:
+            readings = json.loads(readings)
+        except ValueError:
+            raise HttpError(400, "sensor_readings is not valid JSON")
+    if readings is None:
+        return obj
+    if not isinstance(readings, dict):
+        raise HttpError(400, "sensor_readings must be an object")
+    record = dict(readings)
+    if obj.get("device_id") is not None:
+        record["device_id"] = obj["device_id"]
+    return record
+
+def _response(status: int, body: Dict, keep_alive: bool, extra: Tuple[str, ...] = ()) -> bytes:
+    payload = json.dumps(body).encode("utf-8")
+    head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}", "Content-Type: application/json",
+            f"Content-Length: {len(payload)}", "Connection: " + ("keep-alive" if keep_alive else "close"), *extra]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload
+
+class PredictionServer:
+    # predict maps a list of records to a list of result dicts, e.g. a bound inference.predict_batch
+    def __init__(self, predict: Callable[[List[Dict]], List[Dict]], model_version: Any = None,
+                 batch_size: int = 64, batch_ms: float = 0.0, max_concurrency: int = 256, workers: int = 1,
+                 request_timeout_s: float = 10.0, keepalive_s: float = 15.0, stage: Optional[Callable] = None):
+        self.predict_records = predict
+        self.model_version = model_version
+        self.stage = stage or (lambda name: NULL_STAGE)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.request_timeout = request_timeout_s
+        self.keepalive = keepalive_s
+        self.inflight = 0
+        self.counters = {"requests": 0, "rejected": 0, "errors": 0, "connections": 0}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        # batch_ms=0 takes whatever queued up while the previous batch ran, so lone requests never wait
+        # one queue item per request (a list body is a single item), so at most max_concurrency items are
+        # ever queued and submit() only drops if that invariant breaks; batch_size counts requests
+        self.batcher = MicroBatcher(self._handle_batch, max_batch=batch_size, max_wait_ms=batch_ms,
+                                    max_queue=self.max_concurrency * 4, workers=workers)
+
+    def _handle_batch(self, items: List[Tuple[List[Dict], asyncio.Future]]):
+        # runs on a batcher thread: all requests of the batch go through one predict call and each
+        # future gets its own slice back, resolved on the loop in one callback per batch
+        futures = [fut for _, fut in items]
+        try:
+            results = self.predict_records([rec for recs, _ in items for rec in recs])
+        except Exception as e:
+            self.loop.call_soon_threadsafe(_fail_all, futures, e)
+            raise
+        slices, start = [], 0
+        for recs, _ in items:
+            slices.append(results[start:start + len(recs)])
+            start += len(recs)
+        self.loop.call_soon_threadsafe(_resolve_all, futures, slices)
+
+    async def predict(self, records: List[Dict]) -> List[Dict]:
+        if len(records) > MAX_RECORDS_PER_REQUEST:
+            raise HttpError(413, f"at most {MAX_RECORDS_PER_REQUEST} records per request")
+        fut = self.loop.create_future()
+        if not self.batcher.submit((records, fut)):
+            fut.cancel()
+            raise HttpError(503, "prediction queue full")
+        try:
+            # a timed-out request is cancelled; its records may still be scored, the result is discarded
+            results = await asyncio.wait_for(fut, self.request_timeout)
+        except asyncio.TimeoutError:
+            raise HttpError(504, "prediction timed out")
+        for rec, res in zip(records, results):
+            if rec.get("device_id") is not None:
+                res["device_id"] = rec["device_id"]
+        return results
+
+    async def _route(self, method: str, path: str, body: bytes) -> Tuple[int, Any]:
+        path = path.split("?", 1)[0].rstrip("/")
+        if path == "/health":
+            return 200, {"status": "ok", "model_version": self.model_version,
+                         "inflight": self.inflight, **self.batcher.stats()}
+        if path != "/v1/predict":
+            raise HttpError(404, "not found")
+        if method != "POST":
+            raise HttpError(405, "use POST")
+        try:
+            obj = json.loads(body)
+        except ValueError:
+            raise HttpError(400, "body is not valid JSON")
+        if self.inflight >= self.max_concurrency:
+            self.counters["rejected"] += 1
+            raise HttpError(503, "too many concurrent requests")
+        self.inflight += 1
+        try:
+            if isinstance(obj, list):
+                return 200, await self.predict([request_record(o) for o in obj])
+            return 200, (await self.predict([request_record(obj)]))[0]
+        finally:
+            self.inflight -= 1
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes, bool]]:
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, path, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                headers[k.strip().lower()] = v.strip()
+        conn = headers.get("connection", "").lower()
+        keep_alive = conn != "close" if version == "HTTP/1.1" else conn == "keep-alive"
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411, "chunked bodies are not supported, send Content-Length")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise HttpError(400, "bad Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HttpError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), self.request_timeout) if length else b""
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        except asyncio.TimeoutError:
+            raise HttpError(408, "body not received in time")
+        return method, path, headers, body, keep_alive
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.counters["connections"] += 1
+        try:
+            while True:
+                try:
+                    req = await self._read_request(reader)
+                except HttpError as e:
+                    # framing is unknown after a bad request, so the connection is closed
+                    writer.write(_response(e.status, {"error": str(e)}, False))
+                    break
+                if req is None:
+                    break
+                method, path, _, body, keep_alive = req
+                self.counters["requests"] += 1
+                with self.stage("http_request"):
+                    try:
+                        status, out = await self._route(method, path, body)
+                        extra = ()
+                    except HttpError as e:
+                        status, out = e.status, {"error": str(e)}
+                        extra = ("Retry-After: 1",) if e.status == 503 else ()
+                    except Exception as e:
+                        self.counters["errors"] += 1
+                        print("Request error:", e, file=sys.stderr)
+                        status, out, extra = 500, {"error": "internal error"}, ()
+                writer.write(_response(status, out, keep_alive, extra))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int, ready: Optional[asyncio.Event] = None):
+        self.loop = asyncio.get_running_loop()
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                # windows, or not on the main thread
+                pass
+        print(f"Serving /v1/predict on http://{host}:{port}", file=sys.stderr)
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            self.batcher.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.counters, **{f"batcher_{k}": v for k, v in self.batcher.stats().items()})
+
+def _resolve_all(futures, results):
+    for fut, res in zip(futures, results):
+        if not fut.done():
+            fut.set_result(res)
+
+def _fail_all(futures, exc):
+    for fut in futures:
+        if not fut.done():
+            fut.set_exception(exc)
+
+def run_server(predict, host="0.0.0.0", port=8080, **kwargs):
+    srv = PredictionServer(predict, **kwargs)
+    try:
+        asyncio.run(srv.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("HTTP stats:", json.dumps(srv.stats()), file=sys.stderr)
+    return srv
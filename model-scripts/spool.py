@@ -0,0 +1,390 @@
+#store-and-forward log for edge predictions: survives reboots and link loss, ships to DynamoDB when it can
+#append() only queues (raw, result) in memory; a writer thread encodes, writes and fsyncs everything queued
+#every commit_ms (group commit) into NDJSON segments <dir>/seg-<n>.open, sealed to .ndjson when full or old
+#the forwarder turns sealed segments into BatchWriteItem calls in the item shape data_collector.py scans
+#disk is capped at max_bytes by dropping the oldest sealed segments, the memory queue at max_pending
+
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+CURSOR_FILE = "forward_cursor.json"
+# BatchWriteItem takes at most 25 put requests
+MAX_BATCH_ITEMS = 25
+
+# readings stamped before this are not wall-clock times (the ESP32 firmware sends millis(), i.e. uptime)
+MIN_EPOCH_S = 1_000_000_000
+# and device clocks more than this far ahead of ours are not trusted either
+MAX_CLOCK_SKEW_S = 86400
+
+def _epoch_seconds(ts: Any) -> Optional[float]:
+    if not isinstance(ts, (int, float)) or isinstance(ts, bool) or ts != ts:
+        return None
+    return float(ts) if MIN_EPOCH_S <= ts <= time.time() + MAX_CLOCK_SKEW_S else None
+
+def _reading_time(raw: Dict[str, Any], res: Dict[str, Any]) -> float:
+    # the device's own clock when it looks like epoch seconds, else the prediction time, else now
+    ts = _epoch_seconds(raw.get("timestamp"))
+    if ts is None:
+        ts = _epoch_seconds(res.get("timestamp"))
+    return ts if ts is not None else time.time()
+
+def _log_row(raw: Dict[str, Any], res: Dict[str, Any], device_id: str, key_us: int) -> Dict[str, Any]:
+    # timestamp stays integer epoch seconds like every other record the collector reads (dedupe index,
+    # watermarks, parquet partitions); ts_us is unique per device and logged prediction, so a table
+    # keyed on (device_id, ts_us) keeps same-second readings apart
+    row = {"device_id": device_id, "timestamp": key_us // 1_000_000, "ts_us": key_us,
+           "sensor_readings": {k: v for k, v in raw.items() if k not in ("device_id", "timestamp")},
+           "prediction": res.get("prediction"), "confidence": res.get("confidence"), "source": "edge"}
+    if res.get("model_version"):
+        row["model_version"] = res["model_version"]
+    return row
+
+def _to_attr(v: Any) -> Dict[str, Any]:
+    if v is None:
+        return {"NULL": True}
+    if isinstance(v, bool):
+        return {"BOOL": v}
+    if isinstance(v, (int, float)):
+        # DynamoDB numbers have no NaN/inf
+        return {"N": str(v)} if math.isfinite(v) else {"NULL": True}
+    if isinstance(v, dict):
+        return {"M": {str(k): _to_attr(x) for k, x in v.items()}}
+    if isinstance(v, (list, tuple)):
+        return {"L": [_to_attr(x) for x in v]}
+    return {"S": str(v)}
+
+def to_dynamo_item(row: Dict[str, Any]) -> Dict[str, Any]:
+    # inverse of data_collector._dynamo_item_to_plain; None attributes are left out
+    return {k: _to_attr(v) for k, v in row.items() if v is not None}
+
+class PredictionLog:
+    def __init__(self, directory, segment_bytes: int = 4 * 1024 * 1024, max_bytes: int = 256 * 1024 * 1024,
+                 commit_ms: float = 50.0, seal_s: float = 5.0, max_pending: int = 100000, fsync: bool = True,
+                 default_device_id: Optional[str] = None):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = int(segment_bytes)
+        self.max_bytes = int(max_bytes)
+        self.commit_s = commit_ms / 1000.0
+        self.seal_s = seal_s
+        self.max_pending = int(max_pending)
+        self.fsync = fsync
+        self.default_device_id = default_device_id or socket.gethostname()
+        self.counters = {"appended": 0, "committed": 0, "commits": 0, "dropped_queue": 0, "dropped_disk": 0,
+                         "segments": 0}
+        self._pending: deque = deque()
+        self._write_lock = threading.Lock()
+        self._seg_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._f = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._opened = 0.0
+        # (path, bytes) of sealed segments, oldest first
+        self._sealed: deque = deque()
+        self._seq = 0
+        self._dropped_segments = 0
+        # last key handed out per device, in microseconds
+        self._last_us: Dict[str, int] = {}
+        self._recover()
+
+    def _recover(self):
+        # a segment still open at a crash keeps its complete lines and is sealed as it is
+        for p in sorted(self.dir.glob("seg-*.open")):
+            with open(p, "rb+") as f:
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+            if p.stat().st_size:
+                p.replace(p.with_suffix(".ndjson"))
+            else:
+                p.unlink()
+        for p in sorted(self.dir.glob("seg-*.ndjson")):
+            self._sealed.append((p, p.stat().st_size))
+            self._seq = max(self._seq, int(p.stem.split("-")[1]) + 1)
+        # never reuse the name of the segment the forwarder cursor points at, even once it is gone
+        try:
+            with open(self.dir / CURSOR_FILE, "r", encoding="utf-8") as f:
+                cur = json.load(f)
+            self._seq = max(self._seq, int(Path(cur["segment"]).stem.split("-")[1]) + 1)
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            pass
+
+    def append(self, raw: Dict[str, Any], result: Dict[str, Any]) -> bool:
+        # copies only; the caller may keep mutating its dicts (e.g. adding device_id to the result)
+        if len(self._pending) >= self.max_pending:
+            self.counters["dropped_queue"] += 1
+            return False
+        self._pending.append((dict(raw), dict(result)))
+        self.counters["appended"] += 1
+        return True
+
+    def extend(self, records, results):
+        for raw, res in zip(records, results):
+            self.append(raw, res)
+
+    def start(self) -> "PredictionLog":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._write_lock:
+            self._commit()
+            self._seal()
+
+    def _run(self):
+        while not self._stop.wait(self.commit_s):
+            try:
+                with self._write_lock:
+                    self._commit()
+            except OSError as e:
+                # disk full or similar: rows stay queued (up to max_pending) and the next commit retries
+                print("Prediction log write failed:", e, file=sys.stderr)
+
+    def flush(self):
+        # commits whatever is queued now, from the calling thread
+        with self._write_lock:
+            self._commit()
+
+    def _commit(self):
+        n = len(self._pending)
+        if n:
+            rows = [self._pending.popleft() for _ in range(n)]
+            try:
+                data = "".join(json.dumps(self._row(raw, res), separators=(",", ":"), default=str) + "\n"
+                               for raw, res in rows).encode("utf-8")
+                if self._f is None:
+                    self._open()
+                self._f.write(data)
+                self._f.flush()
+                if self.fsync:
+                    os.fsync(self._f.fileno())
+            except BaseException:
+                # nothing leaves the queue unless it is on disk
+                self._pending.extendleft(reversed(rows))
+                raise
+            self._size += len(data)
+            self.counters["committed"] += n
+            self.counters["commits"] += 1
+        if self._f is not None and (self._size >= self.segment_bytes or time.monotonic() - self._opened >= self.seal_s):
+            self._seal()
+        self._enforce_limit()
+
+    def _row(self, raw: Dict[str, Any], res: Dict[str, Any]) -> Dict[str, Any]:
+        # same-second readings of one device get consecutive microsecond keys instead of overwriting each other
+        dev = str(raw.get("device_id") or self.default_device_id)
+        key_us = max(int(_reading_time(raw, res) * 1e6), self._last_us.get(dev, -1) + 1)
+        self._last_us[dev] = key_us
+        return _log_row(raw, res, dev, key_us)
+
+    def _open(self):
+        self._path = self.dir / f"seg-{self._seq:08d}.open"
+        self._seq += 1
+        self._f = open(self._path, "ab")
+        self._size = 0
+        self._opened = time.monotonic()
+
+    def _seal(self):
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        sealed = self._path.with_suffix(".ndjson")
+        self._path.replace(sealed)
+        with self._seg_lock:
+            self._sealed.append((sealed, self._size))
+        self._size = 0
+        self.counters["segments"] += 1
+
+    def _enforce_limit(self):
+        with self._seg_lock:
+            total = self._size + sum(size for _, size in self._sealed)
+            while total > self.max_bytes and self._sealed:
+                path, size = self._sealed.popleft()
+                try:
+                    with open(path, "rb") as f:
+                        self.counters["dropped_disk"] += f.read().count(b"\n")
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self._dropped_segments += 1
+                if self._dropped_segments == 1 or self._dropped_segments % 100 == 0:
+                    print(f"Prediction log over {self.max_bytes} bytes, dropped {self._dropped_segments} oldest "
+                          f"segments so far ({self.counters['dropped_disk']} rows)", file=sys.stderr)
+
+    def oldest_sealed(self) -> Optional[Path]:
+        with self._seg_lock:
+            return self._sealed[0][0] if self._sealed else None
+
+    def release(self, path: Path):
+        # called by the forwarder once every row of the segment is acknowledged
+        with self._seg_lock:
+            self._sealed = deque(s for s in self._sealed if s[0] != path)
+        Path(path).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._seg_lock:
+            backlog = sum(size for _, size in self._sealed) + self._size
+            segments = len(self._sealed)
+        return dict(self.counters, pending=len(self._pending), sealed_segments=segments, backlog_bytes=backlog)
+
+class _Stopped(Exception):
+    pass
+
+class DynamoForwarder:
+    # ships sealed segments oldest first; rows are at-least-once (a put of the same key is idempotent)
+    def __init__(self, log: PredictionLog, table: str, client=None, region: Optional[str] = None,
+                 endpoint_url: Optional[str] = None, batch_items: int = MAX_BATCH_ITEMS, base_delay_s: float = 0.5,
+                 max_delay_s: float = 60.0, idle_s: float = 1.0):
+        if client is None:
+            import boto3
+            client = boto3.session.Session().client("dynamodb", region_name=region, endpoint_url=endpoint_url)
+        self.log = log
+        self.table = table
+        self.client = client
+        self.batch_items = max(1, min(int(batch_items), MAX_BATCH_ITEMS))
+        self.base_delay = base_delay_s
+        self.max_delay = max_delay_s
+        self.idle_s = idle_s
+        self.cursor_path = log.dir / CURSOR_FILE
+        self.counters = {"sent": 0, "batches": 0, "retries": 0, "rejected": 0, "dropped_duplicates": 0, "segments": 0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._attempt = 0
+
+    def start(self) -> "DynamoForwarder":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prediction-forwarder", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            seg = self.log.oldest_sealed()
+            if seg is None:
+                self._stop.wait(self.idle_s)
+                continue
+            try:
+                self.ship_segment(seg)
+            except _Stopped:
+                return
+            except Exception as e:
+                print(f"Forwarder error on {seg.name}:", e, file=sys.stderr)
+                if self._stop.wait(self._next_delay()):
+                    return
+
+    def _next_delay(self) -> float:
+        # exponential with full jitter, so many Pis coming back online do not retry in lockstep
+        delay = min(self.max_delay, self.base_delay * 2 ** self._attempt) * random.random()
+        self._attempt = min(self._attempt + 1, 30)
+        return delay
+
+    def _backoff(self):
+        if self._stop.wait(self._next_delay()):
+            raise _Stopped
+
+    def _load_cursor(self, seg: Path) -> int:
+        try:
+            with open(self.cursor_path, "r", encoding="utf-8") as f:
+                cur = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        return int(cur.get("offset", 0)) if cur.get("segment") == seg.name else 0
+
+    def _save_cursor(self, seg: Path, offset: int):
+        tmp = self.cursor_path.with_name(CURSOR_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segment": seg.name, "offset": offset}, f)
+        tmp.replace(self.cursor_path)
+
+    def ship_segment(self, seg: Path) -> int:
+        offset = self._load_cursor(seg)
+        try:
+            with open(seg, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            # dropped by the disk limit meanwhile
+            self.log.release(seg)
+            return 0
+        batch: List[Tuple[Dict[str, Any], int]] = []
+        sent = 0
+        last_save = time.monotonic()
+        pos = offset
+        for line in data.splitlines(keepends=True):
+            pos += len(line)
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            batch.append((row, pos))
+            if len(batch) >= self.batch_items:
+                sent += self._send(batch)
+                batch = []
+                if time.monotonic() - last_save >= 1.0:
+                    self._save_cursor(seg, pos)
+                    last_save = time.monotonic()
+        if batch:
+            sent += self._send(batch)
+        self.log.release(seg)
+        # the cursor only ever describes a segment that still exists
+        self.cursor_path.unlink(missing_ok=True)
+        self.counters["segments"] += 1
+        return sent
+
+    def _send(self, batch: List[Tuple[Dict[str, Any], int]]) -> int:
+        # keys are unique per log, but one request may not name a key twice (e.g. rows from an older log)
+        items = {}
+        for row, _ in batch:
+            items[(row.get("device_id"), row.get("ts_us", row.get("timestamp")))] = row
+        self.counters["dropped_duplicates"] += len(batch) - len(items)
+        requests = [{"PutRequest": {"Item": to_dynamo_item(row)}} for row in items.values()]
+        while requests:
+            try:
+                resp = self.client.batch_write_item(RequestItems={self.table: requests})
+            except Exception as e:
+                code = getattr(e, "response", {}).get("Error", {}).get("Code")
+                if code == "ValidationException":
+                    # the items themselves are bad, retrying would block the log forever
+                    print("Forwarder dropped a batch DynamoDB rejected:", e, file=sys.stderr)
+                    self.counters["rejected"] += len(requests)
+                    return len(items) - len(requests)
+                self.counters["retries"] += 1
+                self._backoff()
+                continue
+            self.counters["batches"] += 1
+            unprocessed = (resp.get("UnprocessedItems") or {}).get(self.table) or []
+            self.counters["sent"] += len(requests) - len(unprocessed)
+            requests = unprocessed
+            if requests:
+                # throttled: back off before resending only what was left
+                self.counters["retries"] += 1
+                self._backoff()
+            else:
+                self._attempt = 0
+        return len(items)
+
+    def stats(self) -> Dict[str, int]:
+        return dict(self.counters)
@@ -0,0 +1,96 @@
+#dedupe indexes: exact answers, buffered merges, persistence and the bloom false-positive budget
+
+import json
+
+import numpy as np
+import pytest
+
+import dedupe
+from dedupe import BloomDedupeIndex, ExactDedupeIndex, load_index, open_index
+
+def _keys(n, n_devices=7, seed=0):
+    rng = np.random.default_rng(seed)
+    # duplicates on purpose: every key is drawn from a space about half the size of n
+    devs = rng.integers(0, n_devices, n)
+    ts = 1_700_000_000 + rng.integers(0, n // (2 * n_devices) + 1, n)
+    return [(f"dev{d}", int(t)) for d, t in zip(devs, ts)]
+
+def test_exact_index_answers_like_a_set():
+    idx, ref = ExactDedupeIndex(), set()
+    for dev, ts in _keys(5000):
+        assert idx.add(dev, ts) == ((dev, ts) not in ref)
+        ref.add((dev, ts))
+    assert len(idx) == len(ref)
+    assert all(k in idx for k in ref)
+    assert ("dev0", 1) not in idx and ("nope", 1_700_000_000) not in idx
+
+def test_exact_index_key_types():
+    idx = ExactDedupeIndex()
+    assert idx.add(42, 1_700_000_000)
+    # device ids compare as strings, integral floats as ints
+    assert not idx.add("42", 1_700_000_000.0)
+    assert idx.add("42", 1_700_000_000.5)
+    assert not idx.add("42", 1_700_000_000.5)
+    assert idx.add("42", "2024-01-01T00:00:00")
+    assert len(idx._other) == 2 and len(idx) == 3
+
+def test_buffer_merges_keep_arrays_sorted_and_unique(monkeypatch):
+    monkeypatch.setattr(dedupe, "MERGE_MIN", 16)
+    idx, ref = ExactDedupeIndex(), set()
+    for dev, ts in _keys(20000, n_devices=3, seed=1):
+        assert idx.add(dev, ts) == ((dev, ts) not in ref)
+        ref.add((dev, ts))
+    for keys in idx._devices.values():
+        # merges happened along the way and the buffer stays a fraction of the array
+        assert len(keys.arr) > 16
+        assert len(keys.buf) < max(16, len(keys.arr) // dedupe.MERGE_FRACTION)
+        assert np.all(np.diff(keys.arr) > 0)
+        assert not set(keys.arr.tolist()) & keys.buf
+    assert len(idx) == len(ref)
+
+def test_exact_save_load_round_trip(tmp_path):
+    idx = ExactDedupeIndex()
+    keys = _keys(3000)
+    for dev, ts in keys:
+        idx.add(dev, ts)
+    idx.add("dev1", 1.5)
+    path = tmp_path / "dedupe_index.npz"
+    idx.save(path)
+    loaded = load_index(path)
+    assert isinstance(loaded, ExactDedupeIndex) and len(loaded) == len(idx)
+    assert all(k in loaded for k in keys) and ("dev1", 1.5) in loaded
+    assert not loaded.add(*keys[0]) and loaded.add("dev1", 1)
+    assert not (tmp_path / "dedupe_index.npz.tmp").exists()
+
+def test_bloom_has_no_false_negatives_and_stays_near_its_fp_rate():
+    idx = BloomDedupeIndex(capacity=20000, fp_rate=0.01)
+    inserted = [(f"dev{i % 11}", 1_700_000_000 + i) for i in range(20000)]
+    for k in inserted:
+        idx.add(*k)
+    assert all(k in idx for k in inserted)
+    assert all(not idx.add(*k) for k in inserted[:1000])
+    unseen = [(f"dev{i % 11}", 1_800_000_000 + i) for i in range(20000)]
+    fp = sum(k in idx for k in unseen) / len(unseen)
+    assert fp < 0.03
+
+def test_bloom_save_load_and_open_index_prefers_the_file(tmp_path):
+    idx = BloomDedupeIndex(capacity=1000, fp_rate=0.001)
+    for i in range(500):
+        idx.add("dev", i)
+    path = tmp_path / "bloom.npz"
+    idx.save(path)
+    # an existing index keeps its own mode and sizing whatever the command line asks for
+    loaded = open_index(path, mode="exact")
+    assert isinstance(loaded, BloomDedupeIndex)
+    assert (loaded.n_bits, loaded.n_hashes, len(loaded)) == (idx.n_bits, idx.n_hashes, 500)
+    assert all(("dev", i) in loaded for i in range(500))
+    assert isinstance(open_index(tmp_path / "missing.npz", mode="bloom", capacity=10), BloomDedupeIndex)
+    assert isinstance(open_index(None), ExactDedupeIndex)
+
+@pytest.mark.parametrize("mode", ["exact", "bloom"])
+def test_bench_inserts_distinct_keys(mode, capsys):
+    dedupe.bench(20000, 13, mode, 0.001)
+    out = json.loads(capsys.readouterr().out)
+    assert out["redetected_of_10000"] == 10000
+    if mode == "exact":
+        assert out["new_keys"] == 20000
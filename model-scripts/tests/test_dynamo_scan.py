@@ -0,0 +1,175 @@
+#DynamoDB export scan against a stand-in client: filters, segments, cursors and page decoding
+
+import csv
+import itertools
+import json
+import sys
+
+import botocore
+import pytest
+
+import data_collector
+from data_collector import _dynamo_item_to_plain, dynamo_scan, dynamo_scan_pages, flatten_page, flatten_record
+from dedupe import load_index
+
+def _item(i):
+    return {
+        "device_id": {"S": f"dev{i % 3}"},
+        "timestamp": {"N": str(1_700_000_000 + i)},
+        "prediction": {"S": "Tulsi"},
+        "confidence": {"N": "0.875"},
+        "adulteration_alert": {"BOOL": i % 2 == 0},
+        "model_version": {"NULL": True},
+        "sensor_readings": {"M": {"pH": {"N": "6.5"}, "TDS_ppm": {"N": str(200 + i)}, "note": {"S": "ok"}}},
+    }
+
+class FakePaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        self.client.calls.append(kwargs)
+        if self.client.error is not None:
+            raise self.client.error
+        seg, total = kwargs.get("Segment", 0), kwargs.get("TotalSegments", 1)
+        items = [it for i, it in enumerate(self.client.items) if i % total == seg]
+        start = kwargs["ExclusiveStartKey"]["pos"]["N"] if "ExclusiveStartKey" in kwargs else 0
+        size = self.client.page_size
+        for n, pos in enumerate(range(int(start), len(items), size)):
+            if n == self.client.crash_after:
+                raise ConnectionError("scan interrupted")
+            page = {"Items": items[pos:pos + size]}
+            if pos + size < len(items):
+                page["LastEvaluatedKey"] = {"pos": {"N": str(pos + size)}}
+            yield page
+
+class FakeDynamo:
+    def __init__(self, items, page_size=4, error=None, crash_after=None):
+        self.items = items
+        self.page_size = page_size
+        self.error = error
+        # pages served per paginate() call before the connection drops
+        self.crash_after = crash_after
+        self.calls = []
+
+    def get_paginator(self, name):
+        assert name == "scan"
+        return FakePaginator(self)
+
+def test_scan_filters_on_timestamp_and_pages_through():
+    client = FakeDynamo([_item(i) for i in range(10)])
+    pages = list(dynamo_scan_pages("readings", None, 1_700_000_000, 1_700_086_399, client=client))
+    call = client.calls[0]
+    assert call["TableName"] == "readings"
+    assert call["FilterExpression"] == "#ts BETWEEN :s AND :e"
+    assert call["ExpressionAttributeNames"] == {"#ts": "timestamp"}
+    assert call["ExpressionAttributeValues"] == {":s": {"N": "1700000000"}, ":e": {"N": "1700086399"}}
+    assert [len(items) for _, items, _ in pages] == [4, 4, 2]
+    # only the last page of a segment comes without a cursor
+    assert [key is None for _, _, key in pages] == [False, False, True]
+    assert pages[0][1][0]["sensor_readings"] == {"pH": 6.5, "TDS_ppm": 200, "note": "ok"}
+
+def test_parallel_segments_cover_every_item_once():
+    client = FakeDynamo([_item(i) for i in range(30)])
+    pages = list(dynamo_scan_pages("readings", None, None, None, segments=3, workers=2, client=client))
+    assert sorted(c["Segment"] for c in client.calls) == [0, 1, 2]
+    assert all(c["TotalSegments"] == 3 and "FilterExpression" not in c for c in client.calls)
+    timestamps = [it["timestamp"] for _, items, _ in pages for it in items]
+    assert sorted(timestamps) == [1_700_000_000 + i for i in range(30)]
+    # every segment still ends with exactly one cursor-less page
+    assert sorted(seg for seg, _, key in pages if key is None) == [0, 1, 2]
+
+def test_resume_from_cursor_and_skip_finished_segments():
+    client = FakeDynamo([_item(i) for i in range(20)])
+    pages = list(dynamo_scan_pages("readings", None, None, None, segments=2, client=client,
+                                   start_keys={1: {"pos": {"N": "4"}}}, skip_segments=[0]))
+    assert len(client.calls) == 1
+    assert client.calls[0]["Segment"] == 1
+    assert client.calls[0]["ExclusiveStartKey"] == {"pos": {"N": "4"}}
+    assert sum(len(items) for _, items, _ in pages) == 6
+
+def test_default_client_comes_from_region(monkeypatch):
+    regions = []
+    client = FakeDynamo([_item(i) for i in range(5)])
+    monkeypatch.setattr(data_collector, "_make_ddb_client", lambda region: regions.append(region) or client)
+    assert len(list(dynamo_scan("readings", "eu-west-1", None, None, limit=3))) == 3
+    assert regions == ["eu-west-1"]
+
+def test_client_error_is_reported():
+    error = botocore.exceptions.ClientError({"Error": {"Code": "ResourceNotFoundException", "Message": "no table"}},
+                                            "Scan")
+    with pytest.raises(RuntimeError, match="DynamoDB scan failed"):
+        list(dynamo_scan_pages("missing", None, None, None, client=FakeDynamo([], error=error)))
+
+def test_flatten_page_matches_generic_path():
+    items = [_item(i) for i in range(4)]
+    items[1]["sensor_readings"] = {"S": json.dumps({"pH": 7.1, "ORP_mV": 12})}
+    # a list attribute is not part of the fast path and falls back to the generic decoder
+    items[2]["source"] = {"L": [{"S": "a"}, {"N": "1"}]}
+    items[3]["sensor_readings"] = {"NULL": True}
+    client = FakeDynamo(items, page_size=10)
+    (_, rows, _), = dynamo_scan_pages("readings", None, None, None, client=client, decode=flatten_page)
+    assert rows == [flatten_record(_dynamo_item_to_plain(it), raw_json=False) for it in items]
+    assert rows[0]["adulteration_alert"] is True and rows[0]["model_version"] is None
+    assert json.loads(flatten_page(items[:1], raw_json=True)[0]["raw_json"]) == _dynamo_item_to_plain(items[0])
+
+def _collect(monkeypatch, client, out, *args):
+    monkeypatch.setattr(data_collector, "_make_ddb_client", lambda region: client)
+    monkeypatch.setattr(sys, "argv", ["data_collector.py", "--table", "readings", "--out", str(out), *args])
+    data_collector.main()
+
+def _exported(out):
+    keys = []
+    for path in sorted(out.glob("raw_scans*.csv")):
+        with open(path, newline="") as f:
+            keys += [(r["device_id"], int(r["timestamp"])) for r in csv.DictReader(f)]
+    return keys
+
+def _keys(items):
+    return sorted((it["device_id"]["S"], int(it["timestamp"]["N"])) for it in items)
+
+def test_incremental_export_resumes_after_a_crash(monkeypatch, tmp_path):
+    items = [_item(i) for i in range(30)]
+    client = FakeDynamo(items, crash_after=3)
+    with pytest.raises(ConnectionError):
+        _collect(monkeypatch, client, tmp_path, "--incremental", "--checkpoint-pages", "1")
+    state = json.loads((tmp_path / "export_checkpoint.json").read_text())
+    # three pages were checkpointed, the pass is still open and no watermark was committed
+    assert state["pass"]["cursors"] == {"0": {"pos": {"N": "12"}}} and state["watermarks"] == {}
+    assert len(_exported(tmp_path)) == 12
+    client.crash_after = None
+    _collect(monkeypatch, client, tmp_path, "--incremental", "--checkpoint-pages", "1")
+    assert client.calls[-1]["ExclusiveStartKey"] == {"pos": {"N": "12"}}
+    assert sorted(_exported(tmp_path)) == _keys(items)
+    state = json.loads((tmp_path / "export_checkpoint.json").read_text())
+    assert state["pass"] is None
+    assert state["watermarks"] == {"dev0": 1_700_000_027, "dev1": 1_700_000_028, "dev2": 1_700_000_029}
+    # a later pass over the same table finds nothing new
+    _collect(monkeypatch, client, tmp_path, "--incremental", "--checkpoint-pages", "1")
+    assert sorted(_exported(tmp_path)) == _keys(items)
+
+def test_sampled_out_rows_are_not_marked_seen(monkeypatch, tmp_path):
+    items = [_item(i) for i in range(30)]
+    client = FakeDynamo(items)
+    index = tmp_path / "seen.npz"
+    draws = itertools.cycle([0.1, 0.9])
+    monkeypatch.setattr(data_collector.random, "random", lambda: next(draws))
+    _collect(monkeypatch, client, tmp_path, "--sample-rate", "0.5", "--dedupe-index", str(index))
+    first = sorted(_exported(tmp_path))
+    assert first == _keys(items[::2])
+    seen = load_index(index)
+    assert len(seen) == 15 and all(key in seen for key in first)
+    # the rows sampled out the first time are still new to the next run
+    _collect(monkeypatch, client, tmp_path, "--dedupe-index", str(index))
+    assert sorted(_exported(tmp_path)) == _keys(items[1::2])
+
+def test_sampled_out_rows_do_not_advance_the_watermark(monkeypatch, tmp_path):
+    items = [_item(i) for i in range(30)]
+    client = FakeDynamo(items)
+    draws = iter([0.1] * 20 + [0.9] * 10)
+    monkeypatch.setattr(data_collector.random, "random", lambda: next(draws))
+    _collect(monkeypatch, client, tmp_path, "--incremental", "--sample-rate", "0.5")
+    state = json.loads((tmp_path / "export_checkpoint.json").read_text())
+    assert state["watermarks"] == {"dev0": 1_700_000_018, "dev1": 1_700_000_019, "dev2": 1_700_000_017}
+    _collect(monkeypatch, client, tmp_path, "--incremental")
+    assert sorted(_exported(tmp_path)) == _keys(items)
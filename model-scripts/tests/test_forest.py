@@ -0,0 +1,86 @@
+#ArrayForest has to give the same probabilities as the sklearn forest it was exported from
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest import (check_parity, compress_forest, forest_from_sklearn, load_forest, merge_forests, quantize,
+                    save_forest)
+
+COLUMNS = ["pH", "TDS_ppm", "ORP_mV", "Temperature_C", "Color_R", "Color_G", "Color_B"]
+LABELS = ["Amla", "Haldi", "Tulsi"]
+
+def _data(seed, n=600):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, len(COLUMNS)))
+    y = (X[:, 0] + X[:, 1] * X[:, 2] > 0).astype(int) + (X[:, 3] > 1)
+    return X, y
+
+@pytest.fixture(scope="module")
+def fitted():
+    X, y = _data(0)
+    clf = RandomForestClassifier(n_estimators=25, max_depth=10, random_state=0).fit(X, y)
+    return clf, X
+
+def test_matches_sklearn_predict_proba(fitted):
+    clf, X = fitted
+    forest = forest_from_sklearn(clf)
+    np.testing.assert_allclose(forest.predict_proba(X), clf.predict_proba(X), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(forest.predict(X), clf.predict(X))
+    assert check_parity(clf, forest, X) <= 1e-12
+
+def test_single_row_and_empty_input(fitted):
+    clf, X = fitted
+    forest = forest_from_sklearn(clf)
+    np.testing.assert_allclose(forest.predict_proba(X[0]), clf.predict_proba(X[:1]), rtol=0, atol=1e-12)
+    assert forest.predict_proba(X[:0]).shape == (0, len(clf.classes_))
+
+def test_rows_on_split_thresholds(fitted):
+    # sklearn compares in float32, values exactly at a threshold must take the same branch
+    clf, X = fitted
+    forest = forest_from_sklearn(clf)
+    internal = np.flatnonzero(~forest.is_leaf)[:300]
+    X_edge = np.resize(X, (len(internal), X.shape[1])).astype(np.float32)
+    X_edge[np.arange(len(internal)), forest.feature[internal]] = forest.threshold[internal]
+    assert check_parity(clf, forest, X_edge) <= 1e-12
+
+def test_parity_survives_save_and_load(fitted, tmp_path):
+    clf, X = fitted
+    path = save_forest(forest_from_sklearn(clf, LABELS, COLUMNS), tmp_path / "forest.npz")
+    loaded = load_forest(path)
+    assert check_parity(clf, loaded, X) <= 1e-12
+    assert loaded.feature_columns == COLUMNS
+    assert list(loaded.label_encoder().inverse_transform([0, 2])) == ["Amla", "Tulsi"]
+
+def test_check_parity_raises_on_divergence(fitted):
+    clf, X = fitted
+    forest = forest_from_sklearn(clf)
+    forest.value = forest.value[:, ::-1].copy()
+    with pytest.raises(RuntimeError):
+        check_parity(clf, forest, X)
+
+def test_merged_forest_averages_both_models(fitted):
+    clf, X = fitted
+    X_new, y_new = _data(1, 300)
+    new = RandomForestClassifier(n_estimators=15, max_depth=10, random_state=1).fit(X_new, y_new)
+    merged = merge_forests(forest_from_sklearn(clf, LABELS), forest_from_sklearn(new, LABELS, generation=1))
+    expected = (25 * clf.predict_proba(X) + 15 * new.predict_proba(X)) / 40
+    np.testing.assert_allclose(merged.predict_proba(X), expected, rtol=0, atol=1e-12)
+    assert sorted(set(merged.tree_generation.tolist())) == [0, 1]
+
+def test_quantized_forest_stays_close(fitted, tmp_path):
+    clf, X = fitted
+    small = load_forest(save_forest(quantize(forest_from_sklearn(clf)), tmp_path / "q.npz"))
+    assert small.nbytes() < forest_from_sklearn(clf).nbytes()
+    assert np.abs(small.predict_proba(X) - clf.predict_proba(X)).max() < 1e-3
+
+def test_compress_forest_leaves_its_input_alone(fitted):
+    clf, X = fitted
+    forest = forest_from_sklearn(clf, LABELS, COLUMNS)
+    before = dict(forest.meta)
+    small = compress_forest(forest, X, clf.predict(X), n_trees=10, max_depth=6, quantized=True)
+    unchanged = compress_forest(forest)
+    assert forest.meta == before and "compression" not in forest.meta
+    assert small.meta["compression"]["n_trees"] == 10 and len(small.roots) == 10
+    assert unchanged.meta["compression"]["n_trees"] == 25 and unchanged is not forest
+    assert check_parity(clf, unchanged, X) <= 1e-12
@@ -0,0 +1,47 @@
+#every artifact format rft.py writes must preprocess raw readings the same way
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import inference
+from bundle import write_bundle
+from forest import export_forest, forest_from_sklearn
+from preproc import FEATURE_COLUMNS, compile_artifacts, fit_preprocessor, transform_df
+
+LABELS = ["Amla", "Haldi", "Tulsi"]
+# aliased keys, missing sensors and an empty reading all depend on the fitted preprocessing
+READINGS = [{"pH": 6.3, "TDS_ppm": 1}, {"ph": 6.1, "tds": 300, "orp": 20, "temp": 25, "r": 100, "g": 120, "b": 90}, {}]
+
+@pytest.fixture(autouse=True)
+def _restore_globals(monkeypatch):
+    # load_artifacts installs module-level preprocessing, other tests expect the defaults back
+    for name in ("preprocess_input", "preprocess_batch", "calibration_store", "rolling_stage"):
+        monkeypatch.setattr(inference, name, getattr(inference, name))
+
+@pytest.fixture(scope="module")
+def artifacts(tmp_path_factory):
+    d = tmp_path_factory.mktemp("artifacts")
+    rng = np.random.default_rng(4)
+    df = pd.DataFrame(rng.normal(loc=[6, 400, 100, 25, 120, 120, 120], scale=[1, 150, 80, 3, 50, 50, 50],
+                                 size=(400, len(FEATURE_COLUMNS))), columns=FEATURE_COLUMNS)
+    y = (df["pH"] > 6).astype(int) + (df["TDS_ppm"] > 500)
+    pre = fit_preprocessor(df, d)
+    clf = RandomForestClassifier(n_estimators=15, random_state=0).fit(transform_df(df, pre), y)
+    export_forest(clf, d / "model.npz", LABELS, pre["feature_columns"])
+    write_bundle(d / "bundle", compile_artifacts(pre), forest_from_sklearn(clf, LABELS, pre["feature_columns"]))
+    return d
+
+def _predict(path):
+    model, le, cols = inference.load_artifacts(str(path), "/nonexistent/le.pkl", "/nonexistent/meta.pkl")
+    return [(r["prediction"], r["confidence"]) for r in inference.predict_batch(model, le, cols, READINGS)]
+
+def test_npz_matches_bundle_on_raw_readings(artifacts):
+    assert _predict(artifacts / "model.npz") == _predict(artifacts / "bundle")
+
+def test_bare_npz_is_refused(artifacts, tmp_path):
+    bare = tmp_path / "model.npz"
+    bare.write_bytes((artifacts / "model.npz").read_bytes())
+    with pytest.raises(FileNotFoundError, match="imputer.pkl"):
+        inference.load_artifacts(str(bare), "/nonexistent/le.pkl", "/nonexistent/meta.pkl")
@@ -0,0 +1,85 @@
+#MQTT loop against a stand-in for paho's client: messages in, one reply per valid reading out
+
+import json
+import threading
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import inference
+from forest import forest_from_sklearn
+
+COLUMNS = ["pH", "TDS_ppm", "ORP_mV"]
+
+@pytest.fixture(scope="module")
+def model():
+    rng = np.random.default_rng(2)
+    X = rng.normal(size=(300, len(COLUMNS)))
+    clf = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, (X[:, 0] > 0).astype(int))
+    return forest_from_sklearn(clf, ["Amla", "Tulsi"], COLUMNS)
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class FakeClient:
+    # loop_forever delivers the queued messages, then waits until the worker has published `expected` replies
+    def __init__(self, messages, expected):
+        self.messages = messages
+        self.expected = expected
+        self.subscribed = []
+        self.published = []
+        self.address = None
+        self.on_connect = self.on_message = None
+        self._replied = threading.Event()
+
+    def connect(self, host, port, keepalive):
+        self.address = (host, port)
+
+    def subscribe(self, topic):
+        self.subscribed.append(topic)
+
+    def publish(self, topic, payload):
+        self.published.append((topic, json.loads(payload)))
+        if len(self.published) >= self.expected:
+            self._replied.set()
+
+    def loop_forever(self):
+        self.on_connect(self, None, {}, 0)
+        for m in self.messages:
+            self.on_message(self, None, m)
+        assert self._replied.wait(10), f"only {len(self.published)} of {self.expected} replies"
+
+def _readings(n):
+    rng = np.random.default_rng(3)
+    return [{"device_id": f"dev{i % 4}", **dict(zip(COLUMNS, map(float, rng.normal(size=len(COLUMNS)))))}
+            for i in range(n)]
+
+def test_loop_replies_to_every_valid_reading(model):
+    readings = _readings(40)
+    messages = [FakeMessage("herb/in", json.dumps(r).encode()) for r in readings]
+    # undecodable payloads and non-object JSON are skipped without a reply
+    messages[5:5] = [FakeMessage("herb/in", b"{not json"), FakeMessage("herb/in", b"[1, 2]")]
+    client = FakeClient(messages, expected=len(readings))
+    batcher = inference.start_mqtt_loop(model, model.label_encoder(), COLUMNS, "broker.local", 1883, "herb/in",
+                                        reply_topic="herb/out", batch_size=8, batch_ms=5, client=client)
+
+    assert client.address == ("broker.local", 1883)
+    assert client.subscribed == ["herb/in"]
+    assert all(topic == "herb/out" for topic, _ in client.published)
+    expected = inference.predict_batch(model, model.label_encoder(), COLUMNS, readings)
+    replies = [body for _, body in client.published]
+    assert [r["prediction"] for r in replies] == [r["prediction"] for r in expected]
+    assert [r["device_id"] for r in replies] == [r["device_id"] for r in readings]
+    stats = batcher.stats()
+    assert stats["processed"] == len(messages)
+    assert stats["dropped"] == 0 and stats["errors"] == 0
+
+def test_batch_without_reply_topic_prints(model, capsys):
+    reading = _readings(1)[0]
+    results = inference.handle_mqtt_batch(model, model.label_encoder(), COLUMNS, [("herb/in", json.dumps(reading))])
+    printed = json.loads(capsys.readouterr().out)
+    assert printed["prediction"] == results[0]["prediction"] in ("Amla", "Tulsi")
+    assert printed["device_id"] == reading["device_id"]
@@ -0,0 +1,174 @@
+#multipart uploads against a stand-in S3 client
+
+import gzip
+import io
+import threading
+
+import pytest
+
+from data_collector import StreamingCsvWriter
+from s3upload import S3Uploader, TeeWriter, compressed_writer
+
+class FakeS3:
+    # keeps completed objects in memory; `fail_part` makes that part number fail
+    def __init__(self, fail_part=None):
+        self.fail_part = fail_part
+        self.objects = {}
+        self.uploads = {}
+        self.completed = []
+        self.aborted = []
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def create_multipart_upload(self, Bucket, Key):
+        with self._lock:
+            upload_id = f"up{len(self.uploads)}"
+            self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise IOError(f"part {PartNumber} failed")
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"{UploadId}-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = MultipartUpload["Parts"]
+        assert [p["PartNumber"] for p in parts] == list(range(1, len(parts) + 1))
+        assert all(p["ETag"] == f'"{UploadId}-{p["PartNumber"]}"' for p in parts)
+        stored = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b"".join(stored[p["PartNumber"]] for p in parts)
+        self.completed.append(Key)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(Key)
+
+def _uploader(client, **kwargs):
+    kwargs.setdefault("part_size", 1024)
+    kwargs.setdefault("concurrency", 3)
+    return S3Uploader("bucket", prefix="exports/", client=client, **kwargs)
+
+def test_small_object_is_a_single_put():
+    s3 = FakeS3()
+    up = _uploader(s3)
+    sink = up.open(up.key_for("raw.csv"))
+    sink.write(b"a,b\n1,2\n")
+    sink.close()
+    up.close()
+    assert s3.objects == {("bucket", "exports/raw.csv"): b"a,b\n1,2\n"}
+    assert s3.completed == [] and up.stats() == {"objects": 1, "parts": 0, "bytes": 8}
+
+def test_large_object_goes_up_in_ordered_parts():
+    s3 = FakeS3()
+    up = _uploader(s3)
+    data = bytes(range(256)) * 40
+    sink = up.open("big.bin")
+    for i in range(0, len(data), 700):
+        sink.write(data[i:i + 700])
+    sink.close()
+    up.close()
+    assert s3.objects[("bucket", "big.bin")] == data
+    assert s3.completed == ["big.bin"] and s3.aborted == []
+    assert up.stats() == {"objects": 1, "parts": 10, "bytes": len(data)}
+
+def test_failed_part_aborts_the_upload(tmp_path):
+    s3 = FakeS3(fail_part=2)
+    up = _uploader(s3)
+    path = tmp_path / "broken.bin"
+    path.write_bytes(b"x" * 4096)
+    with pytest.raises(IOError):
+        up.upload_file(path, "broken.bin")
+    up.close()
+    assert s3.aborted == ["broken.bin"]
+    assert s3.objects == {} and s3.uploads == {}
+
+def test_part_failing_at_close_aborts_the_upload():
+    s3 = FakeS3(fail_part=4)
+    up = _uploader(s3)
+    sink = up.open("late.bin")
+    sink.write(b"x" * 4096)
+    with pytest.raises(IOError):
+        sink.close()
+    up.close()
+    assert s3.aborted == ["late.bin"] and s3.completed == []
+
+def test_upload_file(tmp_path):
+    s3 = FakeS3()
+    up = _uploader(s3)
+    path = tmp_path / "part-0000.parquet"
+    path.write_bytes(b"PAR1" * 1000)
+    up.upload_file(path, up.key_for("raw_scans/part-0000.parquet"))
+    up.close()
+    assert s3.objects[("bucket", "exports/raw_scans/part-0000.parquet")] == b"PAR1" * 1000
+
+def test_compressed_tee_keeps_local_copy_and_upload_identical():
+    s3 = FakeS3()
+    up = _uploader(s3)
+    local, sink = io.BytesIO(), up.open("rows.csv.gz")
+    w = compressed_writer(TeeWriter(local, sink), "gzip")
+    w.write(b"device_id,timestamp\n" * 500)
+    w.close()
+    sink.close()
+    up.close()
+    assert s3.objects[("bucket", "rows.csv.gz")] == local.getvalue()
+    assert gzip.decompress(local.getvalue()) == b"device_id,timestamp\n" * 500
+
+def test_collector_csv_is_streamed_while_written(tmp_path):
+    s3 = FakeS3()
+    up = _uploader(s3)
+    w = StreamingCsvWriter(tmp_path / "raw_scans.csv", chunk_rows=50, compression="gzip",
+                           upload=lambda path: up.open(up.key_for(path.name)))
+    for i in range(2000):
+        w.write({"device_id": f"dev{i % 7}", "timestamp": 1_700_000_000 + i, "pH": 6.5})
+    (path,) = w.close()
+    up.close()
+    assert path.name == "raw_scans.csv.gz"
+    assert s3.objects[("bucket", "exports/raw_scans.csv.gz")] == path.read_bytes()
+
+def test_aborted_collector_csv_leaves_nothing_behind(tmp_path):
+    s3 = FakeS3()
+    up = _uploader(s3)
+    w = StreamingCsvWriter(tmp_path / "raw_scans.csv", chunk_rows=50,
+                           upload=lambda path: up.open(up.key_for(path.name)))
+    for i in range(2000):
+        w.write({"device_id": "dev1", "timestamp": i})
+    w.abort()
+    up.close()
+    assert s3.objects == {} and s3.aborted == ["exports/raw_scans.csv"]
+    assert list(tmp_path.iterdir()) == []
+
+def test_counters_stay_exact_with_parts_finishing_concurrently():
+    s3 = FakeS3()
+    up = _uploader(s3, part_size=64, concurrency=8)
+
+    def push(n):
+        sink = up.open(f"obj{n}.bin")
+        for _ in range(50):
+            sink.write(b"x" * 64)
+        sink.close()
+
+    threads = [threading.Thread(target=push, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    up.close()
+    assert up.stats() == {"objects": 8, "parts": 400, "bytes": 8 * 50 * 64}
+
+def test_compressed_training_csv_loads_and_caches(tmp_path):
+    rft = pytest.importorskip("rft")
+    path = tmp_path / "train.csv.gz"
+    rows = "".join(f"dev{i % 7},{1_700_000_000 + i},6.5,basil,extra\n" for i in range(200))
+    path.write_bytes(gzip.compress(("device_id,timestamp,pH,Herb_Name,unused\n" + rows).encode()))
+    df = rft.load_training_frame(path, with_ids=True)
+    assert len(df) == 200 and set(df.columns) == {"pH", "Herb_Name", "device_id", "timestamp"}
+    assert (df["pH"] == 6.5).all() and df["timestamp"].iloc[-1] == 1_700_000_199
+    if rft.pa is not None:
+        first = rft.load_training_frame(path, arrow_cache=True)
+        assert (tmp_path / "train.arrow").exists()
+        cached = rft.load_training_frame(path, arrow_cache=True)
+        assert cached["pH"].tolist() == first["pH"].tolist() and cached["Herb_Name"].tolist() == first["Herb_Name"].tolist()
@@ -0,0 +1,164 @@
+#--serve HTTP front end: framing, keep-alive, error statuses and request/result slicing across batches
+
+import asyncio
+import json
+import threading
+
+import server
+from server import PredictionServer
+
+def _echo(records):
+    return [{"prediction": f"p{r.get('pH')}", "confidence": 1.0} for r in records]
+
+class _Gate:
+    # predict function that blocks until opened and records every batch it was called with
+    def __init__(self):
+        self.opened = threading.Event()
+        self.calls = []
+        self.entered = threading.Event()
+
+    def __call__(self, records):
+        self.calls.append(len(records))
+        self.entered.set()
+        self.opened.wait(10)
+        return _echo(records)
+
+def _run(srv, scenario):
+    async def main():
+        srv.loop = asyncio.get_running_loop()
+        srv.batcher.start()
+        listener = await asyncio.start_server(srv.handle_connection, "127.0.0.1", 0, limit=server.MAX_HEADER_BYTES)
+        try:
+            return await scenario(listener.sockets[0].getsockname()[1])
+        finally:
+            listener.close()
+            await listener.wait_closed()
+            srv.batcher.stop()
+    return asyncio.run(main())
+
+def _request(body, path="/v1/predict", headers=()):
+    data = body if isinstance(body, bytes) else json.dumps(body).encode()
+    head = [f"POST {path} HTTP/1.1", "Host: test", f"Content-Length: {len(data)}", *headers]
+    return ("\r\n".join(head) + "\r\n\r\n").encode() + data
+
+async def _read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    headers = {k.strip().lower(): v.strip() for k, v in (l.split(":", 1) for l in lines[1:] if ":" in l)}
+    body = await reader.readexactly(int(headers["content-length"]))
+    return status, headers, json.loads(body)
+
+async def _post(port, body, **kwargs):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(_request(body, **kwargs))
+    await writer.drain()
+    try:
+        return await _read_response(reader)
+    finally:
+        writer.close()
+
+def test_keep_alive_serves_many_requests_on_one_connection():
+    srv = PredictionServer(_echo)
+
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        out = []
+        for i in range(3):
+            writer.write(_request({"device_id": f"d{i}", "sensor_readings": {"pH": i}}))
+            out.append(await _read_response(reader))
+        writer.write(_request([{"pH": 7}, {"pH": 8}], headers=("Connection: close",)))
+        out.append(await _read_response(reader))
+        # the server hangs up after a Connection: close request
+        assert await reader.read() == b""
+        writer.close()
+        return out
+
+    out = _run(srv, scenario)
+    assert [s for s, _, _ in out] == [200] * 4
+    assert [h["connection"] for _, h, _ in out] == ["keep-alive"] * 3 + ["close"]
+    assert [b["prediction"] for _, _, b in out[:3]] == ["p0", "p1", "p2"]
+    assert [b["device_id"] for _, _, b in out[:3]] == ["d0", "d1", "d2"]
+    assert [r["prediction"] for r in out[3][2]] == ["p7", "p8"]
+    assert srv.counters["connections"] == 1 and srv.counters["requests"] == 4
+
+def test_malformed_bodies_get_400_and_keep_the_connection():
+    srv = PredictionServer(_echo)
+    bodies = [b"{not json", [{"pH": 1}, 5], {"sensor_readings": "{broken"}, {"sensor_readings": [1, 2]}]
+
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        out = []
+        for body in bodies + [{"pH": 3}]:
+            writer.write(_request(body))
+            out.append(await _read_response(reader))
+        writer.close()
+        return out
+
+    out = _run(srv, scenario)
+    assert [s for s, _, _ in out] == [400, 400, 400, 400, 200]
+    assert out[1][2] == {"error": "expected a JSON object"}
+    assert out[-1][2]["prediction"] == "p3"
+
+def test_oversized_bodies_get_413(monkeypatch):
+    monkeypatch.setattr(server, "MAX_RECORDS_PER_REQUEST", 5)
+    srv = PredictionServer(_echo)
+
+    async def scenario(port):
+        too_many = await _post(port, [{"pH": i} for i in range(6)])
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        # rejected from the header alone, before any body byte is read
+        writer.write(f"POST /v1/predict HTTP/1.1\r\nContent-Length: {server.MAX_BODY_BYTES + 1}\r\n\r\n".encode())
+        too_big = await _read_response(reader)
+        closed = await reader.read() == b""
+        writer.close()
+        return too_many, too_big, closed
+
+    too_many, too_big, closed = _run(srv, scenario)
+    assert too_many[0] == 413 and "at most 5 records" in too_many[2]["error"]
+    assert too_big[0] == 413 and too_big[1]["connection"] == "close" and closed
+
+def test_saturation_gets_503_and_slow_predictions_504():
+    gate = _Gate()
+    srv = PredictionServer(gate, max_concurrency=1, request_timeout_s=0.3)
+
+    async def scenario(port):
+        first = asyncio.ensure_future(_post(port, {"pH": 1}))
+        await asyncio.get_running_loop().run_in_executor(None, gate.entered.wait, 5)
+        busy = await _post(port, {"pH": 2})
+        timed_out = await first
+        gate.opened.set()
+        srv.batcher.submit = lambda item: False
+        queue_full = await _post(port, {"pH": 3})
+        return busy, timed_out, queue_full
+
+    busy, timed_out, queue_full = _run(srv, scenario)
+    assert busy[0] == 503 and busy[1]["retry-after"] == "1"
+    assert timed_out[0] == 504
+    assert queue_full[0] == 503 and queue_full[2] == {"error": "prediction queue full"}
+    assert srv.inflight == 0 and srv.counters["rejected"] == 1
+
+def test_coalesced_batches_return_each_request_its_own_results():
+    gate = _Gate()
+    srv = PredictionServer(gate, batch_size=64)
+    bodies = [{"pH": 10}, [{"pH": 20}, {"pH": 21}, {"pH": 22}], {"device_id": "x", "sensor_readings": {"pH": 30}},
+              [{"pH": 40}], [{"pH": 50}, {"pH": 51}]]
+
+    async def scenario(port):
+        blocker = asyncio.ensure_future(_post(port, {"pH": 0}))
+        await asyncio.get_running_loop().run_in_executor(None, gate.entered.wait, 5)
+        # these queue up behind the running batch and go through the model together
+        pending = [asyncio.ensure_future(_post(port, b)) for b in bodies]
+        while srv.batcher.qsize() < len(bodies):
+            await asyncio.sleep(0.01)
+        gate.opened.set()
+        return await blocker, await asyncio.gather(*pending)
+
+    blocker, out = _run(srv, scenario)
+    assert gate.calls == [1, 8]
+    assert blocker[2]["prediction"] == "p0"
+    assert out[0][2]["prediction"] == "p10"
+    assert [r["prediction"] for r in out[1][2]] == ["p20", "p21", "p22"]
+    assert out[2][2]["prediction"] == "p30" and out[2][2]["device_id"] == "x"
+    assert [r["prediction"] for r in out[3][2]] == ["p40"]
+    assert [r["prediction"] for r in out[4][2]] == ["p50", "p51"]
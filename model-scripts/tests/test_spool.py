@@ -0,0 +1,194 @@
+#store-and-forward prediction log: group commit, crash recovery, disk cap, forwarder cursor and retries
+
+import json
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+import spool
+from spool import CURSOR_FILE, DynamoForwarder, PredictionLog
+
+def _reading(i, dev="pi-1", ts=1_792_252_023):
+    return {"device_id": dev, "timestamp": ts, "pH": 6.5, "TDS_ppm": 200 + i}
+
+def _result(i):
+    return {"prediction": "Tulsi", "confidence": 0.9, "timestamp": 1_792_252_024}
+
+def _log(tmp_path, **kwargs):
+    kwargs.setdefault("commit_ms", 60_000)
+    kwargs.setdefault("seal_s", 3600)
+    return PredictionLog(tmp_path / "spool", **kwargs)
+
+def _rows(log):
+    return [json.loads(line) for p in sorted(log.dir.glob("seg-*")) for line in p.read_bytes().splitlines()]
+
+def test_group_commit_writes_everything_queued_in_one_commit(tmp_path):
+    log = _log(tmp_path)
+    log.extend([_reading(i) for i in range(30)], [_result(i) for i in range(30)])
+    assert _rows(log) == []
+    log.flush()
+    rows = _rows(log)
+    assert len(rows) == 30 and log.counters["commits"] == 1
+    # same-second readings keep integer seconds and get distinct per-prediction keys
+    assert {r["timestamp"] for r in rows} == {1_792_252_023}
+    assert len({r["ts_us"] for r in rows}) == 30
+    assert [r["sensor_readings"]["TDS_ppm"] for r in rows] == list(range(200, 230))
+
+def test_uptime_timestamps_fall_back_to_prediction_time(tmp_path):
+    log = _log(tmp_path)
+    # the ESP32 firmware sends millis(), device uptime rather than wall-clock time
+    log.append(_reading(0, ts=1_234_567), _result(0))
+    log.append(_reading(1, ts=None), _result(1))
+    log.flush()
+    assert [r["timestamp"] for r in _rows(log)] == [1_792_252_024, 1_792_252_024]
+
+def test_crash_recovery_keeps_complete_lines_and_seals(tmp_path):
+    log = _log(tmp_path)
+    log.extend([_reading(i) for i in range(5)], [_result(i) for i in range(5)])
+    log.flush()
+    (seg,) = log.dir.glob("seg-*.open")
+    # a crash in the middle of the next write leaves half a line behind
+    with open(seg, "ab") as f:
+        f.write(b'{"device_id": "pi-1", "timest')
+    (log.dir / "seg-00000007.open").write_bytes(b'{"partial')
+
+    recovered = _log(tmp_path)
+    assert list(recovered.dir.glob("seg-*.open")) == []
+    assert [p.name for p in recovered.dir.glob("seg-*.ndjson")] == [seg.with_suffix(".ndjson").name]
+    assert len(_rows(recovered)) == 5
+    assert recovered.oldest_sealed() == seg.with_suffix(".ndjson")
+    # new segments never reuse a recovered name
+    recovered.append(_reading(9), _result(9))
+    recovered.flush()
+    assert recovered._path.stem > seg.stem
+
+def test_disk_cap_drops_oldest_segments(tmp_path):
+    log = _log(tmp_path, segment_bytes=1000, max_bytes=4000)
+    for i in range(100):
+        log.append(_reading(i), _result(i))
+        log.flush()
+    on_disk = sum(p.stat().st_size for p in log.dir.glob("seg-*"))
+    assert on_disk <= 4000
+    kept = _rows(log)
+    assert log.counters["dropped_disk"] > 0
+    assert log.counters["dropped_disk"] + len(kept) == 100
+    # what is left is the newest rows
+    assert kept[-1]["sensor_readings"]["TDS_ppm"] == 299
+
+class _Crash(BaseException):
+    pass
+
+class FakeDynamo:
+    # unprocessed: items handed back on the first calls; fail: exceptions raised on those call numbers
+    def __init__(self, unprocessed=(), fail=None):
+        self.unprocessed = list(unprocessed)
+        self.fail = fail or {}
+        self.calls = []
+        self.items = {}
+
+    def batch_write_item(self, RequestItems):
+        (table, requests), = RequestItems.items()
+        self.calls.append(requests)
+        err = self.fail.get(len(self.calls))
+        if err is not None:
+            raise err
+        back = requests[:self.unprocessed.pop(0)] if self.unprocessed else []
+        for r in requests[len(back):]:
+            item = r["PutRequest"]["Item"]
+            self.items[(item["device_id"]["S"], item["ts_us"]["N"])] = item
+        return {"UnprocessedItems": {table: back} if back else {}}
+
+def _sealed_log(tmp_path, n):
+    log = _log(tmp_path)
+    log.extend([_reading(i) for i in range(n)], [_result(i) for i in range(n)])
+    log.close()
+    return log
+
+def test_forwarder_ships_a_segment_and_releases_it(tmp_path):
+    log = _sealed_log(tmp_path, 60)
+    client = FakeDynamo()
+    fwd = DynamoForwarder(log, "predictions", client=client)
+    assert fwd.ship_segment(log.oldest_sealed()) == 60
+    assert [len(c) for c in client.calls] == [25, 25, 10]
+    assert len(client.items) == 60
+    assert log.oldest_sealed() is None and list(log.dir.glob("seg-*")) == []
+    item = next(iter(client.items.values()))
+    assert item["timestamp"] == {"N": "1792252023"} and item["source"] == {"S": "edge"}
+
+def test_unprocessed_items_are_retried_after_backoff(tmp_path, monkeypatch):
+    log = _sealed_log(tmp_path, 25)
+    client = FakeDynamo(unprocessed=[10, 3])
+    delays = []
+    fwd = DynamoForwarder(log, "predictions", client=client, base_delay_s=0.001)
+    monkeypatch.setattr(fwd._stop, "wait", lambda t: delays.append(t) or False)
+    assert fwd.ship_segment(log.oldest_sealed()) == 25
+    # only what was handed back is resent
+    assert [len(c) for c in client.calls] == [25, 10, 3]
+    assert client.calls[1] == client.calls[0][:10]
+    assert len(client.items) == 25
+    assert fwd.counters["retries"] == 2 and fwd.counters["sent"] == 25
+    assert len(delays) == 2 and fwd._attempt == 0
+
+def test_throttling_errors_retry_and_validation_errors_drop(tmp_path, monkeypatch):
+    def err(code):
+        return ClientError({"Error": {"Code": code, "Message": code}}, "BatchWriteItem")
+
+    log = _sealed_log(tmp_path, 50)
+    client = FakeDynamo(fail={1: err("ProvisionedThroughputExceededException"), 3: err("ValidationException")})
+    fwd = DynamoForwarder(log, "predictions", client=client, base_delay_s=0.001)
+    monkeypatch.setattr(fwd._stop, "wait", lambda t: False)
+    assert fwd.ship_segment(log.oldest_sealed()) == 25
+    assert fwd.counters["retries"] == 1 and fwd.counters["rejected"] == 25
+    assert len(client.items) == 25
+
+def test_cursor_survives_a_crash_and_is_cleared_after_the_segment(tmp_path, monkeypatch):
+    log = _sealed_log(tmp_path, 60)
+    seg = log.oldest_sealed()
+    clock = iter(range(0, 10_000, 2))
+    # every batch counts as a second later, so the cursor is saved after each one
+    monkeypatch.setattr(spool.time, "monotonic", lambda: next(clock))
+    crashing = FakeDynamo(fail={3: _Crash()})
+    with pytest.raises(_Crash):
+        DynamoForwarder(log, "predictions", client=crashing).ship_segment(seg)
+    cursor = json.loads((log.dir / CURSOR_FILE).read_text())
+    assert cursor["segment"] == seg.name
+    assert len(seg.read_bytes()[:cursor["offset"]].splitlines()) == 50
+
+    # after a restart only the rows past the cursor are sent again
+    restarted = PredictionLog(log.dir, commit_ms=60_000)
+    client = FakeDynamo()
+    assert DynamoForwarder(restarted, "predictions", client=client).ship_segment(restarted.oldest_sealed()) == 10
+    assert [len(c) for c in client.calls] == [10]
+    assert not (log.dir / CURSOR_FILE).exists()
+
+    # the next segment is never named like the one the old cursor described
+    again = PredictionLog(log.dir, commit_ms=60_000)
+    again.append(_reading(0), _result(0))
+    again.flush()
+    assert again._path.name > seg.name
+
+def test_forwarder_thread_drains_the_log(tmp_path):
+    log = PredictionLog(tmp_path / "spool", commit_ms=5, seal_s=0.05).start()
+    client = FakeDynamo()
+    fwd = DynamoForwarder(log, "predictions", client=client, idle_s=0.01).start()
+    log.extend([_reading(i) for i in range(40)], [_result(i) for i in range(40)])
+    deadline = time.monotonic() + 10
+    while len(client.items) < 40 and time.monotonic() < deadline:
+        time.sleep(0.02)
+    fwd.stop()
+    log.close()
+    assert len(client.items) == 40
+
+def test_forwarded_rows_stay_on_the_collector_fast_paths(tmp_path):
+    from data_collector import flatten_page
+    from dedupe import ExactDedupeIndex
+    log = _sealed_log(tmp_path, 20)
+    client = FakeDynamo()
+    DynamoForwarder(log, "predictions", client=client).ship_segment(log.oldest_sealed())
+    rows = flatten_page(list(client.items.values()))
+    assert all(isinstance(r["timestamp"], int) and isinstance(r["ts_us"], int) for r in rows)
+    seen = ExactDedupeIndex()
+    assert all(seen.add(r["device_id"], r["ts_us"]) for r in rows)
+    # integer keys go to the compact per-device arrays, not the fallback set
+    assert len(seen) == 20 and not seen._other